@@ -0,0 +1,312 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import re
+import sys
+import glob
+import itertools
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import serial
+import control.protocol as prtcl
+from control.board import Board
+from control.sinks import open_sink
+from control.scheduler import Scheduler
+from control.emulator import load_variables
+
+"""End-to-end benchmarks of the acquisition: real protocols are
+executed as in run_experiment.py (Board, Scheduler and output sink)
+against an emulated chamber (see control.emulator), which runs in its
+own process so that the host's CPU time can be measured. Each protocol
+is run once per combination of baud rate, packet loss and window size.
+Run as
+
+  python -m control.benchmark --datasets lt_walks_v1 wt_walks_v1 --output results.json
+
+from the hardware/ directory; the protocols of each dataset are
+generated with its Makefile if needed. For each run, the results
+contain the observations received per second, the SET round trips per
+second, the host's CPU time per observation and the p50/p99 latency of
+each kind of instruction."""
+
+DATASETS_PATH = "../datasets"
+
+
+def dataset_protocols(dataset, path=DATASETS_PATH):
+    """Return the protocol files of a dataset, generating them with
+    its Makefile if needed; generators which fail (e.g. for lack of
+    their requirements) are skipped."""
+    directory = os.path.join(path, dataset)
+    if not glob.glob(os.path.join(directory, "protocols", "*.txt")):
+        subprocess.run(["make", "protocols"], cwd=directory)
+    protocols = sorted(glob.glob(os.path.join(directory, "protocols", "*.txt")))
+    if len(protocols) == 0:
+        raise Exception(f'Could not generate the protocols of "{directory}"')
+    return protocols
+
+
+def find_variables(protocol):
+    """Return the variables.csv file of the dataset a protocol belongs
+    to, i.e. in the protocol's directory or one of its parents."""
+    directory = os.path.dirname(os.path.abspath(protocol))
+    while True:
+        path = os.path.join(directory, "variables.csv")
+        if os.path.exists(path):
+            return path
+        if os.path.dirname(directory) == directory:
+            raise Exception(f'No variables.csv found for protocol "{protocol}"')
+        directory = os.path.dirname(directory)
+
+
+class EmulatorProcess:
+    def __init__(
+        self, variables_path, baud_rate=None, loss=0.0, seed=0, accept_window=False
+    ):
+        """Run python -m control.emulator in a separate process; the
+        host should connect to the port self.port."""
+        command = [sys.executable, "-m", "control.emulator"]
+        command += ["--variables", variables_path, "--loss", str(loss)]
+        command += ["--seed", str(seed)]
+        if baud_rate is not None:
+            command += ["--baud_rate", str(baud_rate)]
+        if accept_window:
+            command += ["--accept_window"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        match = re.search(r'port "(.*)"', self.process.stdout.readline())
+        if match is None:
+            self.close()
+            raise Exception("Could not start the emulator")
+        self.port = match.group(1)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _quiet(*args, **kwargs):
+    """Discard the logs of the board; the unexpected segments and
+    retransmissions are counted in the results instead."""
+    pass
+
+
+def _percentiles(latencies):
+    if len(latencies) == 0:
+        return None
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {"p50_ms": p50, "p99_ms": p99}
+
+
+def run_protocol(
+    protocol,
+    variables_path=None,
+    baud_rate=500000,
+    loss=0.0,
+    window_size=1,
+    max_instructions=None,
+    waits=False,
+    sink="null",
+    output_path=None,
+):
+    """Execute a protocol against an emulated chamber and return the
+    measured throughput and latencies.
+
+    Parameters
+    ----------
+    protocol : str
+        The path to the protocol file.
+    variables_path : str or NoneType, default=None
+        The variables.csv file of the chamber to emulate; if None, the
+        one of the protocol's dataset (see find_variables).
+    baud_rate : int or NoneType, default=500000
+        The baud rate emulated on the link; None for no limit.
+    loss : float, default=0.0
+        The probability that a packet sent or received by the
+        emulator is dropped.
+    window_size : int, default=1
+        The window size of the transport layer (see Board). The
+        chambers' firmware only supports stop-and-wait (1); for larger
+        windows, the emulator answers the WND instruction (see
+        Emulator, accept_window) to estimate what a firmware
+        supporting them would achieve.
+    max_instructions : int or NoneType, default=None
+        Only execute the first max_instructions instructions.
+    waits : bool, default=False
+        Whether to execute WAIT instructions; otherwise they are
+        skipped.
+    sink : str, default="null"
+        The output sink (see control.sinks.open_sink).
+    output_path : str or NoneType, default=None
+        Where the sink writes the observations.
+
+    """
+    if variables_path is None:
+        variables_path = find_variables(protocol)
+    variables = load_variables(variables_path)
+    accept_window = window_size > 1
+    with EmulatorProcess(variables_path, baud_rate, loss, 0, accept_window) as emulator:
+        with open_sink(sink, output_path) as output:
+            with serial.Serial(emulator.port, baud_rate or 500000) as ser:
+                board = Board(ser, sink=output, log_fun=_quiet, window_size=window_size)
+                output.write_header(board.variables)
+                prtcl.check(protocol, board.variables)
+                instructions = prtcl.stream(protocol)
+                if not waits:
+                    instructions = (i for i in instructions if i.kind != "WAIT")
+                instructions = itertools.islice(instructions, max_instructions)
+                scheduler = Scheduler(board)
+                latencies = {}
+                executed = sets = observations = 0
+                cpu_start, start = time.process_time(), time.perf_counter()
+                for instruction in instructions:
+                    skipped = board.skipped_sets
+                    started = time.perf_counter()
+                    result = scheduler.execute(instruction)
+                    elapsed = time.perf_counter() - started
+                    executed += 1
+                    if instruction.kind == "SET" and board.skipped_sets > skipped:
+                        continue
+                    latencies.setdefault(instruction.kind, []).append(elapsed)
+                    if instruction.kind == "SET":
+                        sets += 1
+                    elif instruction.kind == "MSR":
+                        observations += len(result)
+                scheduler.finish()
+                seconds = time.perf_counter() - start
+                cpu = time.process_time() - cpu_start
+                comms = board.comms
+    return {
+        "protocol": protocol,
+        "variables": len(variables),
+        "baud_rate": baud_rate,
+        "loss": loss,
+        "window_size": window_size,
+        "instructions": executed,
+        "observations": observations,
+        "sets": sets,
+        "skipped_sets": board.skipped_sets,
+        "seconds": seconds,
+        "observations_per_second": observations / seconds,
+        "set_round_trips_per_second": (
+            sets / sum(latencies["SET"]) if sets > 0 else None
+        ),
+        "cpu_us_per_observation": (
+            cpu / observations * 1e6 if observations > 0 else None
+        ),
+        "latency": {k: _percentiles(v) for k, v in latencies.items()},
+        "resends": comms.resends,
+        "ack_timeouts": comms.ack_timeouts,
+        "unexpected": comms.unexpected,
+    }
+
+
+def _commit():
+    """The current git commit, if any."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(r):
+    latency = ", ".join(
+        f"{k} p50/p99 = {v['p50_ms']:0.2f}/{v['p99_ms']:0.2f} ms"
+        for k, v in r["latency"].items()
+    )
+    sets = r["set_round_trips_per_second"]
+    cpu = r["cpu_us_per_observation"]
+    print(
+        f"  {os.path.basename(r['protocol'])} ({r['variables']} variables, "
+        f"baud rate = {r['baud_rate']}, loss = {r['loss']}, window = {r['window_size']})"
+    )
+    print(
+        f"    {r['observations_per_second']:0.1f} observations/s, "
+        + ("no SETs" if sets is None else f"{sets:0.1f} SETs/s")
+        + ("" if cpu is None else f", {cpu:0.1f} us CPU/observation")
+    )
+    print(f"    {latency}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end acquisition benchmarks")
+    parser.add_argument("--datasets", nargs="*", default=[])
+    parser.add_argument("--protocols", nargs="*", default=[])
+    parser.add_argument("--baud_rates", nargs="+", type=int, default=[500000])
+    parser.add_argument("--losses", nargs="+", type=float, default=[0.0, 0.01])
+    parser.add_argument("--window_sizes", nargs="+", type=int, default=[1])
+    parser.add_argument("--max_instructions", type=int, default=2000)
+    parser.add_argument("--waits", action="store_true")
+    parser.add_argument("--sink", default="null")
+    parser.add_argument(
+        "--output", default=None, help="Where to write the JSON results"
+    )
+    args = parser.parse_args()
+    protocols = list(args.protocols)
+    for dataset in args.datasets:
+        protocols += dataset_protocols(dataset)
+    if len(protocols) == 0:
+        parser.error("no protocols given (see --datasets and --protocols)")
+
+    results = []
+    print("END-TO-END ACQUISITION")
+    output_directory = tempfile.TemporaryDirectory()
+    for protocol in protocols:
+        for baud_rate in args.baud_rates:
+            for loss in args.losses:
+                for window_size in args.window_sizes:
+                    result = run_protocol(
+                        protocol,
+                        baud_rate=baud_rate,
+                        loss=loss,
+                        window_size=window_size,
+                        max_instructions=args.max_instructions,
+                        waits=args.waits,
+                        sink=args.sink,
+                        output_path=os.path.join(output_directory.name, "output"),
+                    )
+                    _print_result(result)
+                    results.append(result)
+    output_directory.cleanup()
+    if args.output is not None:
+        summary = {
+            "commit": _commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
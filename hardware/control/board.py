@@ -23,14 +23,21 @@
 
 import timeit
 import time
+import errno
+import asyncio
 import numpy as np
 import sys
 import control.messages as messages
+from control.measurements import Measurements
+from control.sinks import CsvSink, NullSink
 from control.serial.packet import PacketLayer
 from control.serial.segment import TransportLayer
+from control.serial.aio import AsyncPacketLayer, AsyncTransportLayer
+import control.serial.trace as trace
 
 """Module defining the Board class used to
-communicate with the control board of each chamber.
+communicate with the control board of each chamber, and its asyncio
+variant AsyncBoard.
 
 """
 
@@ -41,10 +48,23 @@ DATA_PARSED = "data_parsed"
 START_SYMBOL = b"<"
 END_SYMBOL = b">"
 MAX_COUNTER = np.single(100000.0)
+WINDOW_TIMEOUT = 1.0  # seconds to wait for the answer to a WND instruction
 
 
 class Board:
-    def __init__(self, serial, output_file=sys.stdout, log_fun=None, verbose=0):
+    def __init__(
+        self,
+        serial,
+        output_file=sys.stdout,
+        log_fun=None,
+        verbose=0,
+        window_size=1,
+        tracer=None,
+        metrics=None,
+        sink=None,
+        skip_redundant_sets=False,
+        session_cache=None,
+    ):
         """Given a serial connection to the board, reset the board and store
         the board's variable names.
 
@@ -55,8 +75,9 @@ class Board:
             serial.Serial (see pySerial library).
         output_file : file object or NoneType
             Where to output the observations received from the board
-            in CSV format. If None, there is no output (see
-            Board.take_measurements)
+            in CSV format (see control.sinks.CsvSink). If None, there
+            is no output (see Board.take_measurements). Ignored if a
+            sink is given.
         log_fun : function or NoneType, default=None
             The function used to log any debug messages, must take a
             string as first argument.
@@ -66,6 +87,49 @@ class Board:
             verbosity: 0 - no output, 1 - High-level traces, 2 -
             Messages sent/received from board, 3 - raw messages
             received from board and timeout changes.
+        window_size : int, default=1
+            If larger than 1, request the board to use a windowed
+            transport (see control.serial.segment.TransportLayer) of
+            at most this size. The size is negotiated with the
+            instruction WND,<window_size>, which the board answers
+            with the size it supports; stop-and-wait (size 1) is used
+            if the answer is anything else. The chambers' firmware
+            does not support WND: it sends an error and stops
+            answering, so if there is no answer within WINDOW_TIMEOUT
+            seconds, the board is reset and stop-and-wait is used (see
+            Board.window_refused).
+        tracer : control.serial.trace.Tracer or NoneType, default=None
+            Where the board and its communication layers record
+            events (see control.serial.trace); dump it after the run
+            with tracer.dump(path). If None, no events are recorded.
+        metrics : control.serial.metrics.Metrics or NoneType, default=None
+            Where to record the ACK round-trip times and the time
+            taken to receive each observation; snapshots are written
+            to the metrics' file while measurements are taken and
+            after each SET (see Metrics.poll), with the statistics of
+            the sink.
+        sink : control.sinks.OutputSink or NoneType, default=None
+            Where to write the observations received from the board
+            (see control.sinks). Observations are buffered by the
+            sink and handed to it when Board.take_measurements
+            returns (or during the next WAIT, see
+            control.scheduler); they are written before returning if it fails or
+            the board is reset (see OutputSink.drain).
+        skip_redundant_sets : bool, default=False
+            If True, keep a copy of the value of every variable set on
+            the board (see Board.shadow), and skip SET instructions
+            which would not change it; skipped SETs are counted in
+            Board.skipped_sets. The copy is discarded when the board
+            is reset. Note that the board raises its intervention flag
+            on every SET, and a skipped SET does not: the intervention
+            column of the next observation changes, so only set to
+            True for experiments which do not rely on it.
+        session_cache : control.session.SessionCache or NoneType, default=None
+            If given and it holds a session for the serial port (see
+            Board.save_session), resume it instead of resetting the
+            board; if the board does not answer, it is reset. The
+            seconds taken by each step of the connection are stored
+            in Board.startup.
 
         Returns
         -------
@@ -75,9 +139,19 @@ class Board:
         """
         self.serial = serial
         self.output_file = output_file
+        self.sink = self._default_sink(output_file) if sink is None else sink
+        # If False, the sink is flushed by the caller (see control.scheduler)
+        self.flush_after_measurements = True
+        self.tracer = trace.DISABLED if tracer is None else tracer
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.bind_sink(self.sink)
         self.last_observation = np.single(
             -1
         )  # To keep track of observations send by the board
+        self.skip_redundant_sets = skip_redundant_sets
+        self.shadow = {}  # Value of the variables set on the board
+        self.skipped_sets = 0
 
         # Wrap log function to filter by verbosity
         def log(string, verbosity_level=1, **kwargs):
@@ -88,6 +162,10 @@ class Board:
 
         self.verbose = verbose
 
+        self.session_cache = session_cache
+        self.startup = {}  # Seconds taken by each step of the connection
+        started = time.monotonic()
+
         # Clear the input and output buffers
         self.log("Clearing buffers")
         self.serial.reset_input_buffer()
@@ -95,17 +173,57 @@ class Board:
 
         # Initializing protocol
         self.log("Initializing communication layers")
-        self.comms = TransportLayer(
-            PacketLayer(self.serial, log_fun, verbose=3 if verbose > 3 else 0),
-            log_fun,
-            verbose=verbose,
+        self._log_fun = log_fun
+        self.comms = self._open_comms()
+        self.window_refused = False
+        started = self._startup_step("buffers", started)
+
+        # Resume the previous session if possible, otherwise reset the board
+        session = None
+        if session_cache is not None and self._port() is not None:
+            session = session_cache.get(self._port())
+        self.warm = session is not None and self._resume(session, window_size)
+        if not self.warm:
+            self._connect(1 if self.window_refused else window_size)
+        self.log(
+            "Connected in %0.3f seconds (%s)"
+            % (
+                sum(self.startup.values()),
+                ", ".join(f"{k}: {v:0.3f} s" for k, v in self.startup.items()),
+            )
         )
 
-        self.log("Resetting board")
-        # Send reset signal to arduino
-        self.serial.setDTR(False)
-        self.serial.setDTR(True)
+    def _startup_step(self, step, started):
+        """Record the duration of a step of the connection, and return
+        the time at which the next one starts."""
+        now = time.monotonic()
+        self.startup[step] = now - started
+        return now
+
+    def _port(self):
+        return getattr(self.serial, "port", None)
+
+    def _open_comms(self):
+        return TransportLayer(
+            PacketLayer(
+                self.serial,
+                self._log_fun,
+                verbose=3 if self.verbose > 3 else 0,
+                tracer=self.tracer,
+            ),
+            self._log_fun,
+            verbose=self.verbose,
+            tracer=self.tracer,
+            metrics=self.metrics,
+        )
+
+    def _connect(self, window_size):
+        """Reset the board and store the chamber configuration and
+        the board's variable names."""
+        started = time.monotonic()
+        self._reset_board()
         self.log("Waiting for chamber to come online")
+        started = self._startup_step("reset", started)
 
         # Receive chamber configuration identifier
         while True:
@@ -118,6 +236,7 @@ class Board:
         # Store chamber configuration
         self.log(f"Received chamber config: {response.config}")
         self.chamber_config = response.config
+        started = self._startup_step("chamber_config", started)
 
         # Receive chamber variables
         while True:
@@ -127,6 +246,77 @@ class Board:
                     break
             except Exception as e:
                 print(e)
+        self._store_variables(response)
+        started = self._startup_step("variables", started)
+
+        # Negotiate the window size of the transport layer
+        if window_size > 1:
+            if not self.negotiate_window(window_size):
+                # The board stopped answering: start over
+                self._fall_back()
+                self._connect(1)
+            self._startup_step("window", started)
+
+    def _resume(self, session, window_size):
+        """Resume a session stored by save_session; return False if the
+        board did not answer."""
+        started = time.monotonic()
+        self.log("Resuming the previous session")
+        self.comms.set_window_size(session["window_size"])
+        resumed = self.comms.resync(
+            session["last_delivered"], session.get("last_acknowledged")
+        )
+        started = self._startup_step("resync", started)
+        if not resumed:
+            self.log("  the board did not answer; resetting it")
+            self.comms.set_window_size(1)
+            self.session_cache.discard(self._port())
+            return False
+        self.chamber_config = session["chamber_config"]
+        self._store_variables(
+            messages.parse("VARIABLES_LIST," + ",".join(session["variables"]))
+        )
+        self.last_observation = np.single(session["last_observation"])
+        if window_size != session["window_size"]:
+            if not self.negotiate_window(window_size):
+                self.session_cache.discard(self._port())
+                self._fall_back()
+                return False
+            self._startup_step("window", started)
+        return True
+
+    def save_session(self):
+        """Store the session in the session cache, so that the next
+        Board on this port resumes it instead of resetting the board
+        (see control.session). Call at the end of a run, instead of
+        resetting the board."""
+        self.comms.flush()
+        self.session_cache.put(
+            self._port(),
+            {
+                "chamber_config": self.chamber_config,
+                "variables": self.variables[2:],
+                "last_observation": float(self.last_observation),
+                "window_size": self.comms.window_size,
+                "last_delivered": self.comms.last_delivered,
+                "last_acknowledged": self.comms.last_acknowledged,
+            },
+        )
+
+    def _reset_board(self):
+        self.log("Resetting board")
+        self.shadow.clear()
+        # Send reset signal to arduino
+        try:
+            self.serial.setDTR(False)
+            self.serial.setDTR(True)
+        except OSError as e:
+            # Ports without modem control lines (e.g. pseudo-terminals)
+            if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                raise
+            self.log(f"  Could not reset board through DTR: {e}")
+
+    def _store_variables(self, response):
         # Parse and store variable names
         self.log("Received variable names")
         # Compute length of a single observation block sent by the
@@ -135,19 +325,70 @@ class Board:
         # Add variables computed in this machine, i.e. the timestamp and config
         self.variables = ["timestamp", "config"] + response.variables
         for i, var in enumerate(self.variables):
-            log(f"  {i-2} : {var}")
+            self.log(f"  {i-2} : {var}")
+
+    def negotiate_window(self, window_size):
+        """Request the board to switch to a windowed transport of the
+        given size, and use the size the board replies with. Return
+        False if the board does not answer within WINDOW_TIMEOUT
+        seconds, e.g. because its firmware does not know the WND
+        instruction: it then sends an error outside of any packet
+        (<ERR,er01,...>) and stops answering until it is reset."""
+        self.comms.send(f"WND,{window_size}")
+        response = self.comms.receive(timeout=WINDOW_TIMEOUT)
+        if response is None:
+            self._window_refused()
+            return False
+        accepted = self._accepted_window(messages.parse(response))
+        self.comms.set_window_size(accepted)
+        return True
+
+    def _window_refused(self):
+        # The error may already have been logged by the packet layer
+        error = self.comms.packet_layer.decoder.pop_discarded()
+        message = "Board did not answer the window size request"
+        if len(error) > 0:
+            message += f": {error.decode(errors='replace')}"
+        self.log(message, 0)  # Always log independently of verbosity
+        self.log("  resetting it and using stop-and-wait", 0)
+        self.window_refused = True
+
+    def _fall_back(self):
+        """Start over with new communication layers, e.g. after the
+        board stopped answering; the board is reset when connecting."""
+        self.serial.reset_input_buffer()
+        self.comms = self._open_comms()
+
+    def _accepted_window(self, response):
+        if (
+            response.kind == "OK"
+            and len(response.args) == 2
+            and response.args[0] == "WND"
+        ):
+            accepted = int(response.args[1])
+            self.log(f"Using transport window of size {accepted}")
+            return accepted
+        else:
+            self.log(
+                f"Board did not accept window size, using stop-and-wait: {response}"
+            )
+            return 1
 
     def execute_instruction(self, instruction):
         """Execute an instruction, i.e. wait, set a variable, take
         measurements or reset the board.
 
         """
-        self.log(f"\nExecuting instruction {instruction}")
+        if self.verbose >= 1:
+            self.log(f"\nExecuting instruction {instruction}")
         if instruction.kind == "WAIT_INPUT":
             input(instruction.prompt)
         elif instruction.kind == "WAIT":
             seconds = instruction.wait / 1000
-            self.log("  waiting for %0.4f seconds" % seconds)
+            if self.verbose >= 1:
+                self.log("  waiting for %0.4f seconds" % seconds)
+            if self.tracer.enabled:
+                self.tracer.record(trace.WAIT_STARTED, instruction.wait)
             time.sleep(seconds)
         elif instruction.kind == "SET":
             self.set_variable(instruction)
@@ -159,22 +400,39 @@ class Board:
     def set_variable(self, instruction):
         if instruction.kind != "SET":
             raise ValueError(f'Wrong instruction type "{instruction}".')
+        if self._redundant_set(instruction):
+            return
+        if self.tracer.enabled:
+            self._record_set(instruction)
         self.comms.send(f"SET,{instruction.target},{instruction.value}")
         response = messages.parse(self.comms.receive())
         if response.kind != "OK":
             raise Exception(f"Unexpected response from board: {response}")
+        self.shadow[instruction.target] = messages.set_value(instruction.value)
+        if self.metrics is not None:
+            self.metrics.poll()
 
     def reset(self):
+        self.sink.drain()
+        self.shadow.clear()
+        if self.session_cache is not None:
+            self.session_cache.discard(self._port())
         self.comms.send("RST")
         response = messages.parse(self.comms.receive())
         if response.kind != "OK":
             raise Exception(f"Unexpected response from board: {response}")
 
     def take_measurements(self, instruction):
+        """Take the measurements of an MSR instruction and return them as
+        a control.measurements.Measurements object (see
+        Measurements.to_object_array for an array with one column per
+        variable)."""
         if instruction.kind != "MSR":
             raise ValueError(f'Wrong instruction type "{instruction}".')
 
         # Send MSR instruction
+        if self.tracer.enabled:
+            self.tracer.record(trace.MEASUREMENTS_STARTED, instruction.n)
         self.comms.send(f"MSR,{instruction.n},{instruction.wait}")
         # Receive and check confirmation
         response = messages.parse(self.comms.receive())
@@ -182,44 +440,295 @@ class Board:
             raise Exception(f"Unexpected response from board: {response}")
 
         # Initialize buffer
-        observations = np.zeros((instruction.n, len(self.variables)), dtype=object)
+        observations = Measurements(
+            self.variables, instruction.n, [self.chamber_config]
+        )
 
         # Reception loop
         count = 0
-        while count < instruction.n:
-            # Await response
-            data_bytes = self.comms.receive()
-            if len(data_bytes) != self.n_bytes:
-                raise Exception(
-                    f"Expected {self.n_bytes} bytes ({len(self.variables) - 1} variables), got {len(data_bytes)}."
-                )
-            observation = np.frombuffer(data_bytes, dtype=np.single)
-            # Check that counter matches
-            next_counter = (
-                self.last_observation + 1
-                if self.last_observation < MAX_COUNTER
-                else 0.0
-            )
-            if observation[0] == next_counter:
-                self.last_observation = observation[0]
-            else:
-                raise Exception(
-                    f"Expected observation counter {self.last_observation+1}, got {observation[0]}."
-                )
-            observations[count, 0] = timeit.default_timer()
-            observations[count, 1] = self.chamber_config
-            observations[count, 2:] = observation
-
-            # If required, directly print observation to output file (in CSV format)
-            if self.output_file is not None:
-                string = ",".join(["%s" % v for v in observations[count]])
-                print(string, file=self.output_file)
-                self.output_file.flush()
-            count += 1
-            self.log(f"  received observation {count}/{instruction.n}       ", end="\r")
+        try:
+            while count < instruction.n:
+                # Await response
+                started = time.monotonic()
+                data_bytes = self.comms.receive()
+                if self.metrics is not None:
+                    self._record_metrics(data_bytes, started)
+                self._store_observation(observations, count, data_bytes)
+                count += 1
+                if self.verbose >= 1:
+                    self.log(
+                        f"  received observation {count}/{instruction.n}       ",
+                        end="\r",
+                    )
+        except BaseException:
+            # Write what was received before failing
+            self.sink.drain()
+            raise
+        if self.flush_after_measurements:
+            self.sink.flush()
         # Await for board to confirm that all observations were sent with <OK,DONE>
         response = messages.parse(self.comms.receive())
         if response.kind == "OK" and response.args[0] == "DONE":
+            if self.tracer.enabled:
+                self.tracer.record(trace.MEASUREMENTS_DONE, instruction.n)
+            return observations
+        else:
+            raise Exception(f"Unexpected response from board: {response}")
+
+    @staticmethod
+    def _default_sink(output_file):
+        return NullSink() if output_file is None else CsvSink(output_file)
+
+    def _record_metrics(self, data_bytes, started):
+        self.metrics.record_observation(len(data_bytes), time.monotonic() - started)
+        self.metrics.poll()
+
+    def _redundant_set(self, instruction):
+        """Return True if a SET instruction would not change the value
+        of its variable on the board, and count it as skipped."""
+        if not self.skip_redundant_sets:
+            return False
+        value = messages.set_value(instruction.value)
+        if self.shadow.get(instruction.target) != value:
+            # Forget the value in case the SET fails
+            self.shadow.pop(instruction.target, None)
+            return False
+        self.skipped_sets += 1
+        if self.verbose >= 2:
+            self.log(f"  {instruction.target} is already {instruction.value}", 2)
+        if self.tracer.enabled:
+            self._record_set(instruction, trace.SET_SKIPPED)
+        return True
+
+    def _record_set(self, instruction, event=trace.VARIABLE_SET):
+        if instruction.target in self.variables:
+            index = self.variables.index(instruction.target)
+        else:
+            index = 0
+        self.tracer.record(event, index)
+
+    def _store_observation(self, observations, count, data_bytes):
+        if len(data_bytes) != self.n_bytes:
+            raise Exception(
+                f"Expected {self.n_bytes} bytes ({len(self.variables) - 1} variables), got {len(data_bytes)}."
+            )
+        observation = observations.store(count, timeit.default_timer(), 0, data_bytes)
+        # Check that counter matches
+        next_counter = (
+            self.last_observation + 1 if self.last_observation < MAX_COUNTER else 0.0
+        )
+        if observation[0] == next_counter:
+            self.last_observation = observation[0]
+        else:
+            raise Exception(
+                f"Expected observation counter {self.last_observation+1}, got {observation[0]}."
+            )
+        if self.tracer.enabled:
+            self.tracer.record(
+                trace.OBSERVATION_RECEIVED, int(observation[0]), n_bytes=len(data_bytes)
+            )
+
+        self.sink.write(observations, count)
+
+
+class AsyncBoard(Board):
+    def __init__(
+        self,
+        serial,
+        output_file=sys.stdout,
+        log_fun=None,
+        verbose=0,
+        window_size=1,
+        tracer=None,
+        metrics=None,
+        sink=None,
+        skip_redundant_sets=False,
+    ):
+        """asyncio variant of Board, with the same parameters and
+        attributes. The connection is established by awaiting
+        AsyncBoard.connect(), which must be called from within the
+        event loop; all methods that communicate with the board are
+        coroutines. The serial object must provide a file descriptor
+        (see control.serial.aio.AsyncPacketLayer).
+
+        Instructions are executed one at a time, even if
+        execute_instruction is awaited from several tasks.
+
+        """
+        self.serial = serial
+        self.output_file = output_file
+        self.sink = self._default_sink(output_file) if sink is None else sink
+        self.flush_after_measurements = True
+        self.tracer = trace.DISABLED if tracer is None else tracer
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.bind_sink(self.sink)
+        self.last_observation = np.single(-1)
+        self.skip_redundant_sets = skip_redundant_sets
+        self.shadow = {}
+        self.skipped_sets = 0
+        self.window_size = window_size
+        self.verbose = verbose
+
+        # Wrap log function to filter by verbosity
+        def log(string, verbosity_level=1, **kwargs):
+            if verbosity_level <= self.verbose:
+                log_fun(string, **kwargs)
+
+        self.log = log
+        self._log_fun = log_fun
+        self.comms = self._open_comms()
+        self.window_refused = False
+        self._lock = None
+
+    def _open_comms(self):
+        return AsyncTransportLayer(
+            AsyncPacketLayer(
+                self.serial,
+                self._log_fun,
+                verbose=3 if self.verbose > 3 else 0,
+                tracer=self.tracer,
+            ),
+            self._log_fun,
+            verbose=self.verbose,
+            tracer=self.tracer,
+            metrics=self.metrics,
+        )
+
+    async def connect(self):
+        """Reset the board and store the chamber configuration and the
+        board's variable names."""
+        self._lock = asyncio.Lock()
+        # Clear the input and output buffers
+        self.log("Clearing buffers")
+        self.serial.reset_input_buffer()
+        self.serial.reset_output_buffer()
+        self.comms.packet_layer.start()
+        await self._boot()
+        if self.window_size > 1 and not await self.negotiate_window(self.window_size):
+            # The board stopped answering: start over
+            self.comms.packet_layer.stop()
+            self.serial.reset_input_buffer()
+            self.comms = self._open_comms()
+            self.comms.packet_layer.start()
+            await self._boot()
+
+    async def _boot(self):
+        self._reset_board()
+        self.log("Waiting for chamber to come online")
+        response = await self._await_message("CHAMBER_CONFIG")
+        self.log(f"Received chamber config: {response.config}")
+        self.chamber_config = response.config
+        self._store_variables(await self._await_message("VARIABLES_LIST"))
+
+    def close(self):
+        """Stop reading from the serial connection."""
+        self.comms.packet_layer.stop()
+
+    async def _await_message(self, kind):
+        while True:
+            try:
+                response = messages.parse(await self.comms.receive())
+                if response.kind == kind:
+                    return response
+            except Exception as e:
+                print(e)
+
+    async def negotiate_window(self, window_size):
+        """Request the board to switch to a windowed transport of the
+        given size, and use the size the board replies with; return
+        False if the board does not answer (see Board.negotiate_window)."""
+        await self.comms.send(f"WND,{window_size}")
+        response = await self.comms.receive(timeout=WINDOW_TIMEOUT)
+        if response is None:
+            self._window_refused()
+            return False
+        response = messages.parse(response)
+        await self.comms.set_window_size(self._accepted_window(response))
+        return True
+
+    async def execute_instruction(self, instruction):
+        """Execute an instruction, i.e. wait, set a variable, take
+        measurements or reset the board.
+
+        """
+        async with self._lock:
+            if self.verbose >= 1:
+                self.log(f"\nExecuting instruction {instruction}")
+            if instruction.kind == "WAIT_INPUT":
+                await asyncio.get_running_loop().run_in_executor(
+                    None, input, instruction.prompt
+                )
+            elif instruction.kind == "WAIT":
+                seconds = instruction.wait / 1000
+                if self.verbose >= 1:
+                    self.log("  waiting for %0.4f seconds" % seconds)
+                if self.tracer.enabled:
+                    self.tracer.record(trace.WAIT_STARTED, instruction.wait)
+                await asyncio.sleep(seconds)
+            elif instruction.kind == "SET":
+                await self.set_variable(instruction)
+            elif instruction.kind == "MSR":
+                return await self.take_measurements(instruction)
+            elif instruction.kind == "RST":
+                await self.reset()
+
+    async def set_variable(self, instruction):
+        if instruction.kind != "SET":
+            raise ValueError(f'Wrong instruction type "{instruction}".')
+        if self._redundant_set(instruction):
+            return
+        if self.tracer.enabled:
+            self._record_set(instruction)
+        await self.comms.send(f"SET,{instruction.target},{instruction.value}")
+        response = messages.parse(await self.comms.receive())
+        if response.kind != "OK":
+            raise Exception(f"Unexpected response from board: {response}")
+        self.shadow[instruction.target] = messages.set_value(instruction.value)
+        if self.metrics is not None:
+            self.metrics.poll()
+
+    async def reset(self):
+        self.sink.drain()
+        self.shadow.clear()
+        await self.comms.send("RST")
+        response = messages.parse(await self.comms.receive())
+        if response.kind != "OK":
+            raise Exception(f"Unexpected response from board: {response}")
+
+    async def take_measurements(self, instruction):
+        if instruction.kind != "MSR":
+            raise ValueError(f'Wrong instruction type "{instruction}".')
+        if self.tracer.enabled:
+            self.tracer.record(trace.MEASUREMENTS_STARTED, instruction.n)
+        await self.comms.send(f"MSR,{instruction.n},{instruction.wait}")
+        response = messages.parse(await self.comms.receive())
+        if response.kind != "OK" or response.args[0] != "MSR":
+            raise Exception(f"Unexpected response from board: {response}")
+        observations = Measurements(
+            self.variables, instruction.n, [self.chamber_config]
+        )
+        try:
+            for count in range(instruction.n):
+                started = time.monotonic()
+                data_bytes = await self.comms.receive()
+                if self.metrics is not None:
+                    self._record_metrics(data_bytes, started)
+                self._store_observation(observations, count, data_bytes)
+                if self.verbose >= 1:
+                    self.log(
+                        f"  received observation {count + 1}/{instruction.n}       ",
+                        end="\r",
+                    )
+        except BaseException:
+            self.sink.drain()
+            raise
+        if self.flush_after_measurements:
+            self.sink.flush()
+        response = messages.parse(await self.comms.receive())
+        if response.kind == "OK" and response.args[0] == "DONE":
+            if self.tracer.enabled:
+                self.tracer.record(trace.MEASUREMENTS_DONE, instruction.n)
             return observations
         else:
             raise Exception(f"Unexpected response from board: {response}")
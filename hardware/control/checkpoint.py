@@ -0,0 +1,143 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import json
+import time
+import control.messages as messages
+from control.protocol import digest  # Stored with the checkpoints of a run
+
+"""Checkpoints of protocol runs, from which an interrupted run can be
+resumed (see run_experiment.py --resume).
+
+A checkpoint stores the index of the next protocol instruction, the
+value of every variable set by the protocol since the last reset (the
+actuator state) and the offsets of the output (see
+control.sinks.OutputSink.offsets). To resume, the output is truncated
+to the offsets, the SETs needed to restore the actuator state are sent
+to the board, and the protocol continues from the stored index. Note
+that the replayed SETs raise the board's intervention flag, i.e. the
+first observation after resuming is flagged."""
+
+
+class Checkpointer:
+    def __init__(self, path, sink, info, interval=60.0, clock=time.monotonic):
+        """Periodically store checkpoints of a run.
+
+        Parameters
+        ----------
+        path : str
+            The JSON file where checkpoints are stored; it is replaced
+            atomically.
+        sink : control.sinks.OutputSink
+            The output of the run.
+        info : dict
+            Stored with every checkpoint, e.g. the paths of the
+            protocol and of the output (see load).
+        interval : float, default=60
+            Minimum number of seconds between checkpoints.
+        clock : function, default=time.monotonic
+
+        Examples
+        --------
+        >>> import tempfile
+        >>> from control.sinks import NullSink
+        >>> path = os.path.join(tempfile.mkdtemp(), "run.checkpoint")
+        >>> checkpointer = Checkpointer(path, NullSink(), {"protocol": "p.txt"}, interval=0)
+        >>> protocol = ["SET,red,10", "SET,green,3", "MSR,1,0", "SET,red,1/2"]
+        >>> for i, instruction in enumerate(protocol):
+        ...     checkpointer.step(i + 1, messages.parse(instruction))
+        >>> checkpoint = load(path)
+        >>> checkpoint["protocol"], checkpoint["index"], checkpoint["actuators"]
+        ('p.txt', 4, {'red': '1/2', 'green': '3'})
+        >>> checkpointer.remove()
+        >>> os.path.exists(path)
+        False
+
+        """
+        self.path = path
+        self.sink = sink
+        self.info = info
+        self.interval = interval
+        self.clock = clock
+        self.actuators = {}  # Variables set since the last reset
+        self.saved = 0  # Number of checkpoints stored
+        self._last = clock()
+
+    def step(self, index, instruction):
+        """Record that an instruction was executed, index being the one
+        of the next instruction; store a checkpoint if it is due."""
+        if instruction.kind == "SET":
+            self.actuators[instruction.target] = instruction.value
+        elif instruction.kind == "RST":
+            self.actuators.clear()
+        if self.clock() - self._last >= self.interval:
+            self.save(index)
+
+    def save(self, index):
+        checkpoint = dict(
+            self.info,
+            index=index,
+            actuators=self.actuators,
+            offsets=self.sink.offsets(),
+            saved=time.time(),
+        )
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+        self.saved += 1
+        self._last = self.clock()
+
+    def remove(self):
+        """Remove the checkpoint, e.g. once the run is complete."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def load(path):
+    """Load a checkpoint stored by a Checkpointer."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def restore(board, checkpoint, checkpointer=None):
+    """Restore the actuator state of a checkpoint on a board, and
+    continue tracking it with the given checkpointer; return the index
+    of the next protocol instruction."""
+    for target, value in checkpoint["actuators"].items():
+        board.set_variable(messages.parse(f"SET,{target},{value}"))
+    if checkpointer is not None:
+        checkpointer.actuators = dict(checkpoint["actuators"])
+    return checkpoint["index"]
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -0,0 +1,373 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import csv
+import json
+import numpy as np
+from control.sinks import OutputSink, runs
+
+"""Chunked, columnar outputs for long runs, which can be loaded without
+parsing text: a series of memory-mappable .npy files (NpySink), and
+Arrow IPC streams or Parquet files (ArrowSink, requires pyarrow).
+
+Observations are written in chunks of rows_per_chunk observations, and
+whatever is left when the sink is drained (i.e. when the board is reset
+or fails, see Board) or closed. A run which was interrupted can be read
+up to its last complete chunk: .npy and Parquet chunks are listed in a
+manifest (MANIFEST) which is replaced atomically after each chunk, and
+Arrow IPC streams are readable up to their last complete record batch.
+
+The columns and their types are given by a dataset's variables.csv
+(see datasets/): its column_name column must contain the variables sent
+by the board, and an optional dtype column sets the numpy type of each
+column. By default, timestamps are stored as float64, the configuration
+as the index of its name in the list of configurations (stored in the
+manifest/schema) and the variables sent by the board as float32, as
+they are received."""
+
+MANIFEST = "_manifest.json"
+CONFIG_DTYPE = "u1"
+
+
+def load_schema(variables, path=None):
+    """Return the structured numpy dtype of the observations, with one
+    field per variable (see Board.variables), and a dictionary with the
+    description of each variable.
+
+    Parameters
+    ----------
+    variables : list of string
+        The names of the columns, i.e. "timestamp", "config" and the
+        variables sent by the board.
+    path : str or NoneType, default=None
+        The variables.csv file of a dataset. If None, the default types
+        are used.
+
+    Examples
+    --------
+    >>> dtype, _ = load_schema(["timestamp", "config", "counter", "red"])
+    >>> dtype
+    dtype([('timestamp', '<f8'), ('config', 'u1'), ('counter', '<f4'), ('red', '<f4')])
+
+    """
+    dtypes = {"timestamp": "<f8", "config": CONFIG_DTYPE}
+    descriptions = {}
+    if path is not None:
+        with open(path, newline="") as f:
+            rows = {row["column_name"]: row for row in csv.DictReader(f)}
+        missing = [v for v in variables if v not in rows]
+        if len(missing) > 0:
+            raise ValueError(f'Variables {missing} are not in "{path}"')
+        for v in variables:
+            descriptions[v] = rows[v].get("description") or ""
+            if v != "config" and rows[v].get("dtype"):
+                dtypes[v] = rows[v]["dtype"]
+    return np.dtype([(v, dtypes.get(v, "<f4")) for v in variables]), descriptions
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+class _ChunkedSink(OutputSink):
+    def __init__(self, variables_path=None, rows_per_chunk=10000):
+        self.variables_path = variables_path
+        self.rows_per_chunk = rows_per_chunk
+        self.dtype = None  # Set by write_header
+        self.descriptions = None
+        self.configs = []  # Configurations, in the order they were seen
+        self.chunks = 0
+        self._rows = []
+
+    def write_header(self, variables):
+        self.dtype, self.descriptions = load_schema(variables, self.variables_path)
+
+    def write(self, measurements, i):
+        self._rows.append((measurements, i))
+        if len(self._rows) >= self.rows_per_chunk:
+            self._write_chunk()
+
+    def flush(self):
+        # Only full chunks are written, to keep them large
+        pass
+
+    def drain(self):
+        if len(self._rows) > 0:
+            self._write_chunk()
+
+    def close(self):
+        self.drain()
+
+    def offsets(self):
+        self.drain()
+        return {"chunks": self.chunks}
+
+    def resume(self, chunks):
+        """Continue writing a run after its first chunks (see
+        OutputSink.offsets); the later chunks are deleted."""
+        try:
+            with open(os.path.join(self._directory(), MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:  # No chunks were written
+            manifest = {"chunks": [], "configs": []}
+        for chunk in manifest["chunks"][chunks:]:
+            os.remove(os.path.join(self._directory(), chunk["file"]))
+        kept = manifest["chunks"][:chunks]
+        self._files = [chunk["file"] for chunk in kept]
+        self._lengths = [chunk["rows"] for chunk in kept]
+        self.configs = manifest["configs"]
+        self.chunks = chunks
+
+    def _records(self):
+        """Return the buffered observations as a structured array."""
+        if self.dtype is None:
+            raise Exception("The header must be written before the observations")
+        records = np.zeros(len(self._rows), dtype=self.dtype)
+        names = self.dtype.names
+        pos = 0
+        for m, start, stop in runs(self._rows):
+            rows = slice(pos, pos + stop - start)
+            for config in m.configs:
+                if config not in self.configs:
+                    self.configs.append(config)
+            ids = np.array([self.configs.index(c) for c in m.configs])
+            records["timestamp"][rows] = m.timestamps[start:stop]
+            records["config"][rows] = ids[m.config_ids[start:stop]]
+            for j, name in enumerate(names[2:]):
+                records[name][rows] = m.values[start:stop, j]
+            pos += stop - start
+        self._rows.clear()
+        return records
+
+    def _manifest(self, files, rows):
+        return {
+            "columns": [[name, self.dtype[name].str] for name in self.dtype.names],
+            "descriptions": self.descriptions,
+            "configs": self.configs,
+            "chunks": [{"file": f, "rows": n} for f, n in zip(files, rows)],
+            "rows": sum(rows),
+        }
+
+
+class NpySink(_ChunkedSink):
+    def __init__(self, directory, variables_path=None, rows_per_chunk=10000):
+        """Write the observations to a directory, as a series of .npy
+        files (chunk-00000.npy, chunk-00001.npy, ...) holding
+        structured arrays with one field per variable; read them back
+        with load_npy.
+
+        Parameters
+        ----------
+        directory : str
+            Created if it does not exist.
+        variables_path : str or NoneType, default=None
+            The variables.csv file giving the types of the columns (see
+            load_schema).
+        rows_per_chunk : int, default=10000
+            The number of observations in each file.
+
+        Examples
+        --------
+        >>> import tempfile
+        >>> from control.measurements import Measurements
+        >>> m = Measurements(["timestamp", "config", "counter", "red"], 5, ["std"])
+        >>> for i in range(5):
+        ...     _ = m.store(i, i, 0, np.array([i, 2 * i], dtype=np.float32).tobytes())
+        >>> directory = tempfile.mkdtemp()
+        >>> with NpySink(directory, rows_per_chunk=2) as sink:
+        ...     sink.write_header(m.variables)
+        ...     for i in range(5):
+        ...         sink.write(m, i)
+        ...     sorted(os.listdir(directory))
+        ['_manifest.json', 'chunk-00000.npy', 'chunk-00001.npy']
+        >>> chunks, manifest = load_npy(directory)
+        >>> len(chunks), manifest["rows"], manifest["configs"]
+        (3, 5, ['std'])
+        >>> np.concatenate(chunks)["red"]
+        array([0., 2., 4., 6., 8.], dtype=float32)
+
+        """
+        super().__init__(variables_path, rows_per_chunk)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files = []
+        self._lengths = []
+
+    def _directory(self):
+        return self.directory
+
+    def _write_chunk(self):
+        records = self._records()
+        name = "chunk-%05d.npy" % self.chunks
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, records)
+        os.replace(path + ".tmp", path)
+        self.chunks += 1
+        self._files.append(name)
+        self._lengths.append(len(records))
+        _write_manifest(self.directory, self._manifest(self._files, self._lengths))
+
+
+def load_npy(directory, mmap_mode="r"):
+    """Return the chunks of a run written by NpySink, as a list of
+    (memory-mapped) structured arrays, and its manifest. Chunks which
+    are not in the manifest, e.g. one being written when the run was
+    interrupted, are ignored."""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    chunks = [
+        np.load(os.path.join(directory, chunk["file"]), mmap_mode=mmap_mode)
+        for chunk in manifest["chunks"]
+    ]
+    return chunks, manifest
+
+
+class ArrowSink(_ChunkedSink):
+    def __init__(self, path, variables_path=None, rows_per_chunk=10000, format="ipc"):
+        """Write the observations as Arrow record batches, one per chunk,
+        with the configuration as a dictionary-encoded string and the
+        description of each variable (see load_schema) in the field
+        metadata. Requires pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            If format is "ipc", the file of the Arrow IPC stream (see
+            load_arrow). If format is "parquet", a directory where each
+            chunk is written as a Parquet file (part-00000.parquet,
+            ...), which can be read with pyarrow.parquet.read_table.
+        variables_path : str or NoneType, default=None
+            The variables.csv file giving the types of the columns (see
+            load_schema).
+        rows_per_chunk : int, default=10000
+            The number of observations in each record batch.
+        format : {"ipc", "parquet"}, default="ipc"
+
+        """
+        if format not in ["ipc", "parquet"]:
+            raise ValueError(f'Unknown format "{format}"; should be "ipc" or "parquet"')
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError("Arrow and Parquet outputs require pyarrow") from e
+        super().__init__(variables_path, rows_per_chunk)
+        self.pa = pyarrow
+        self.path = path
+        self.format = format
+        self.schema = None  # Set by write_header
+        self._writer = None
+        self._files = []
+        self._lengths = []
+        if format == "parquet":
+            os.makedirs(path, exist_ok=True)
+
+    def _directory(self):
+        if self.format == "ipc":
+            raise ValueError("Arrow IPC streams cannot be resumed")
+        return self.path
+
+    def write_header(self, variables):
+        super().write_header(variables)
+        pa = self.pa
+        fields = []
+        for name in self.dtype.names:
+            if name == "config":
+                kind = pa.dictionary(pa.uint8(), pa.string())
+            else:
+                kind = pa.from_numpy_dtype(self.dtype[name])
+            metadata = {"description": self.descriptions.get(name, "")}
+            fields.append(pa.field(name, kind, metadata=metadata))
+        self.schema = pa.schema(fields)
+        if self.format == "ipc":
+            self._file = open(self.path, "wb")
+            self._writer = pa.ipc.new_stream(self._file, self.schema)
+
+    def _write_chunk(self):
+        pa = self.pa
+        records = self._records()
+        columns = []
+        for name in self.dtype.names:
+            if name == "config":
+                columns.append(
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(records[name], pa.uint8()),
+                        pa.array(self.configs, pa.string()),
+                    )
+                )
+            else:
+                columns.append(pa.array(records[name]))
+        batch = pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        if self.format == "ipc":
+            self._writer.write_batch(batch)
+            self._file.flush()
+        else:
+            import pyarrow.parquet as pq
+
+            name = "part-%05d.parquet" % self.chunks
+            path = os.path.join(self.path, name)
+            pq.write_table(pa.Table.from_batches([batch]), path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self._files.append(name)
+            self._lengths.append(len(records))
+            _write_manifest(self.path, self._manifest(self._files, self._lengths))
+        self.chunks += 1
+
+    def close(self):
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._file.close()
+            self._writer = None
+
+
+def load_arrow(path):
+    """Read an Arrow IPC stream written by ArrowSink into a
+    pyarrow.Table, up to its last complete record batch if the run was
+    interrupted."""
+    import pyarrow as pa
+
+    batches = []
+    with open(path, "rb") as f:
+        reader = pa.ipc.open_stream(f)
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (pa.ArrowInvalid, OSError):
+            pass  # Truncated batch
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
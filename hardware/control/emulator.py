@@ -0,0 +1,367 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import re
+import csv
+import time
+import argparse
+import threading
+import numpy as np
+from control.serial.packet import PacketLayer
+from control.serial.segment import TransportLayer
+from control.serial.ptyserial import PtySerial
+
+"""Emulator of a chamber's control board, which implements the
+firmware's side of the protocol (see hardware/arduino/*/*.ino and
+serial_comms.cpp) on a pseudo-terminal (POSIX only). Programs connect
+to the emulator's port as they would to /dev/ttyACM0, e.g. to run a
+protocol without a chamber attached, run from the hardware/ directory
+
+  python -m control.emulator --variables ../datasets/lt_walks_v1/variables.csv
+
+and pass the printed port to run_experiment.py or interpreter.py with
+--port. The sensors are not simulated: unless a model is given (see
+Emulator), they keep the value they were last set to, or 0."""
+
+# Columns of a dataset's variables.csv which are added by the host,
+# i.e. not sent by the board
+HOST_COLUMNS = [
+    "timestamp",
+    "config",
+    "aperture",
+    "iso",
+    "shutter_speed",
+    "image_file",
+    "image_timestamp",
+    "brightness_value",
+]
+
+# Variables set by the board itself, which cannot be SET
+INTERNAL = ["counter", "intervention"]
+
+NA = -9999.0  # Value which cannot be SET
+MAX_COUNTER = 100000.0  # The observation counter wraps around to 0 after it
+
+
+def load_variables(path):
+    """Return the names of the variables sent by a chamber's board, in
+    order, from the variables.csv file of one of its datasets.
+
+    Examples
+    --------
+    >>> load_variables("../datasets/wt_walks_v1/variables.csv")[:5]
+    ['counter', 'flag', 'intervention', 'hatch', 'pot_1']
+    >>> len(load_variables("../datasets/lt_camera_v1/variables.csv"))
+    44
+
+    """
+    with open(path, newline="") as f:
+        return [
+            row["column_name"]
+            for row in csv.DictReader(f)
+            if row["column_name"] not in HOST_COLUMNS
+        ]
+
+
+def _to_float(string):
+    """Parse the leading number of a string, or return 0.0, as
+    Arduino's String.toFloat does."""
+    match = re.match(r"\s*[-+]?(\d+\.?\d*|\.\d+)", string)
+    return 0.0 if match is None else float(match.group())
+
+
+class _EmulatedPacketLayer(PacketLayer):
+    """Packet layer which drops each packet sent or received with the
+    given probability, and paces the packets it sends at the given
+    baud rate (the pseudo-terminal itself transmits instantly)."""
+
+    def __init__(self, ser, loss, rng, baud_rate=None, **kwargs):
+        super().__init__(ser, **kwargs)
+        self.loss = loss
+        self.rng = rng
+        self.baud_rate = baud_rate
+        self.dropped = 0
+
+    def _drop(self):
+        if self.loss > 0 and self.rng.random() < self.loss:
+            self.dropped += 1
+            return True
+        return False
+
+    def send(self, data):
+        if self._drop():
+            return
+        written = self.bytes_written
+        super().send(data)
+        if self.baud_rate is not None:
+            # 8 data bits, a start and a stop bit per byte
+            time.sleep((self.bytes_written - written) * 10 / self.baud_rate)
+
+    def receive(self, timeout=None):
+        while True:
+            data = super().receive(timeout)
+            if not self._drop():
+                return data
+
+
+class Emulator:
+    def __init__(
+        self,
+        variables,
+        config="standard",
+        latency=0.0,
+        loss=0.0,
+        baud_rate=None,
+        seed=None,
+        model=None,
+        accept_window=False,
+        log_fun=print,
+        verbose=0,
+    ):
+        """Emulated board on a new pseudo-terminal; the host should
+        connect to the port self.port.
+
+        As the firmware, the emulator sends the chamber configuration
+        and its variables when it boots, and then answers SET, MSR and
+        RST instructions; after RST it boots again, i.e. sends the
+        configuration and variables with new sequence numbers. Like
+        the firmware, it stops answering after sending an error (e.g.
+        "<ERR,er04,target>" when a SET targets an unknown variable, or
+        "<ERR,er01,WND,4>" for the WND instruction of
+        Board.negotiate_window, which the firmware does not know),
+        until the port is closed; the ranges of the values set are not
+        checked.
+
+        Parameters
+        ----------
+        variables : list of string
+            The variables sent by the board, in order (see
+            load_variables).
+        config : str, default="standard"
+            The chamber configuration sent to the host.
+        latency : float, default=0.0
+            The time (in seconds) taken to read the sensors for each
+            observation.
+        loss : float, default=0.0
+            The probability that a packet sent or received by the
+            emulator is dropped.
+        baud_rate : int or NoneType, default=None
+            If given, the packets sent by the emulator take the time
+            they would take at this baud rate.
+        seed : int or NoneType, default=None
+            The seed of the random number generator used to drop
+            packets, which is also passed to the model.
+        accept_window : bool, default=False
+            If True, WND instructions are answered and the emulator
+            switches to the requested window size, e.g. to benchmark
+            a windowed transport. This is not firmware behaviour.
+        model : function or NoneType, default=None
+            Called as model(values, rng) before each observation is
+            taken, where values is a dictionary with the current value
+            of each variable, to update the sensor readings in place.
+        log_fun : function, default=print
+            The function used to log any debug messages of the
+            emulator's communication layers.
+        verbose : int, default=0
+            The verbosity of the communication layers (see
+            TransportLayer).
+
+        Attributes
+        ----------
+        values : dict
+            The current value of each variable.
+        boots : int
+            The number of times the board booted.
+        observations : int
+            The number of observations sent.
+        error : str or NoneType
+            The error the board stopped with, if any.
+
+        """
+        self.variables = list(variables)
+        self.config = config
+        self.latency = latency
+        self.loss = loss
+        self.baud_rate = baud_rate
+        self.model = model
+        self.accept_window = accept_window
+        self.log_fun = log_fun
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.serial = PtySerial()
+        self.port = self.serial.port
+        self.comms = None  # Set when booting
+        self.values = None
+        self.counter = 0.0
+        self.intervention = False
+        self._thread = None
+        # Stats counters
+        self.boots = 0
+        self.observations = 0
+        self.dropped = 0
+        self.error = None
+
+    def run(self):
+        """Run the firmware until the port is closed by both the host
+        and the emulator (see close)."""
+        try:
+            while True:
+                self._boot()
+                while self._step():
+                    pass
+        except (OSError, UserWarning):  # The port was closed
+            return
+
+    def start(self):
+        """Run the firmware in a background thread."""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop the emulator. The host must close its port first."""
+        self.serial.hangup()
+        if self._thread is not None:
+            self._thread.join()
+        self.serial.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _boot(self):
+        if self.comms is not None:
+            self.dropped += self.comms.packet_layer.dropped
+        self.comms = TransportLayer(
+            _EmulatedPacketLayer(
+                self.serial,
+                self.loss,
+                self.rng,
+                self.baud_rate,
+                log_fun=self.log_fun,
+                max_size=None,
+            ),
+            self.log_fun,
+            verbose=self.verbose,
+        )
+        self.values = dict.fromkeys(self.variables, 0.0)
+        self.counter = 0.0
+        self.intervention = False
+        self.boots += 1
+        self.comms.send(f"CHAMBER_CONFIG,{self.config}")
+        self.comms.send("VARIABLES_LIST," + ",".join(self.variables))
+
+    def _step(self):
+        """Receive and carry out an instruction; return False if the
+        board should boot again."""
+        msg = self.comms.receive().decode(errors="replace")
+        if msg.startswith("RST"):
+            self.comms.send("OK,RST")
+            return False
+        elif msg.startswith("WND,") and self.accept_window:
+            window_size = int(_to_float(msg[4:]))
+            self.comms.send(f"OK,WND,{window_size}")
+            self.comms.set_window_size(window_size)
+        elif msg.count(",") != 2:
+            self._fail("er01", msg)
+        elif msg.startswith("MSR,"):
+            _, n, wait = msg.split(",")
+            self._measure(int(_to_float(n)), int(_to_float(wait)))
+        elif msg.startswith("SET,"):
+            _, target, value = msg.split(",")
+            self._set(target, _to_float(value))
+        else:
+            self._fail("er01", msg)
+        return True
+
+    def _measure(self, n, wait):
+        self.comms.send(f"OK,MSR,n={n},wait={wait}")
+        for _ in range(n):
+            if self.latency > 0:
+                time.sleep(self.latency)
+            if self.model is not None:
+                self.model(self.values, self.rng)
+            if "counter" in self.values:
+                self.values["counter"] = self.counter
+            if "intervention" in self.values:
+                self.values["intervention"] = float(self.intervention)
+            observation = np.array(list(self.values.values()), dtype=np.single)
+            self.intervention = False
+            self.counter = self.counter + 1.0 if self.counter < MAX_COUNTER else 0.0
+            self.comms.send(observation.tobytes())
+            self.observations += 1
+        self.comms.send("OK,DONE")
+
+    def _set(self, target, value):
+        if target not in self.values or target in INTERNAL:
+            self._fail("er04", target)
+        elif value == NA and target != "flag":
+            self._fail("er42")
+        self.values[target] = value
+        self.intervention = True
+        self.comms.send(f"OK,SET,{target}={value:.2f}")
+
+    def _fail(self, code, params=None):
+        """Send an error outside of any packet and stop answering, as
+        the firmware does (see fail in utils.cpp)."""
+        self.error = code if params is None else f"{code},{params}"
+        self.serial.write(f"<ERR,{self.error}>".encode())
+        while True:
+            self.serial.read(64)  # Raises OSError once the port is closed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chamber emulator")
+    parser.add_argument("--variables", required=True, help="A dataset's variables.csv")
+    parser.add_argument("--config", default="standard")
+    parser.add_argument("--latency", default=0.0, type=float)
+    parser.add_argument("--loss", default=0.0, type=float)
+    parser.add_argument("--baud_rate", default=None, type=int)
+    parser.add_argument("--seed", default=None, type=int)
+    parser.add_argument(
+        "--accept_window",
+        action="store_true",
+        help="Answer WND instructions (not firmware behaviour)",
+    )
+    parser.add_argument("--verbose", default=0, type=int)
+    args = parser.parse_args()
+    emulator = Emulator(
+        load_variables(args.variables),
+        config=args.config,
+        latency=args.latency,
+        loss=args.loss,
+        baud_rate=args.baud_rate,
+        seed=args.seed,
+        accept_window=args.accept_window,
+        verbose=args.verbose,
+    )
+    print(
+        f'Emulating a chamber with configuration "{args.config}" on port "{emulator.port}"'
+    )
+    print("Press Ctrl-C to stop")
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        emulator.close()
@@ -0,0 +1,126 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+"""Columnar buffer for the observations returned by
+Board.take_measurements."""
+
+
+class Measurements:
+    def __init__(self, variables, n, configs):
+        """Preallocated buffer for n observations.
+
+        Parameters
+        ----------
+        variables : list of string
+            The names of all the columns, i.e. "timestamp", "config"
+            and the variables sent by the board (see Board.variables).
+        n : int
+            The number of observations.
+        configs : list of string
+            The chamber configurations the observations can be taken
+            in; each observation stores the index of its configuration
+            in this list.
+
+        Attributes
+        ----------
+        timestamps : numpy.ndarray of float64, shape (n,)
+            The time at which each observation was received (see
+            timeit.default_timer).
+        config_ids : numpy.ndarray of uint8, shape (n,)
+            The index of each observation's configuration in
+            `configs`.
+        values : numpy.ndarray of float32, shape (n, len(variables) - 2)
+            The variables sent by the board, as received.
+
+        Examples
+        --------
+        >>> m = Measurements(["timestamp", "config", "counter", "red"], 2, ["standard"])
+        >>> m.store(0, 1.5, 0, np.array([0, 0.3], dtype=np.float32).tobytes())
+        array([0. , 0.3], dtype=float32)
+        >>> m.store(1, 2.5, 0, np.array([1, 10], dtype=np.float32).tobytes())
+        array([ 1., 10.], dtype=float32)
+        >>> len(m), m.values.dtype, m.values.flags.c_contiguous
+        (2, dtype('float32'), True)
+        >>> m["red"]
+        array([ 0.3, 10. ], dtype=float32)
+        >>> m.to_object_array()
+        array([[1.5, 'standard', 0.0, 0.30000001192092896],
+               [2.5, 'standard', 1.0, 10.0]], dtype=object)
+        >>> m.row_to_csv(1)
+        '2.5,standard,1.0,10.0'
+
+        """
+        self.variables = variables
+        self.configs = configs
+        self.timestamps = np.zeros(n, dtype=np.float64)
+        self.config_ids = np.zeros(n, dtype=np.uint8)
+        self.values = np.zeros((n, len(variables) - 2), dtype=np.float32)
+
+    def store(self, i, timestamp, config_id, data_bytes):
+        """Store the i-th observation from the bytes sent by the board,
+        and return its values."""
+        self.timestamps[i] = timestamp
+        self.config_ids[i] = config_id
+        row = self.values[i]
+        row[:] = np.frombuffer(data_bytes, dtype=np.float32)
+        return row
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, variable):
+        """The column of the given variable."""
+        if variable == "timestamp":
+            return self.timestamps
+        elif variable == "config":
+            return np.array(self.configs, dtype=object)[self.config_ids]
+        else:
+            return self.values[:, self.variables.index(variable) - 2]
+
+    def to_object_array(self):
+        """Return the observations as a (n, len(variables)) array of
+        python objects, with the timestamp, configuration and the
+        variables sent by the board as columns."""
+        array = np.empty((len(self), len(self.variables)), dtype=object)
+        array[:, 0] = self.timestamps.tolist()
+        array[:, 1] = self["config"]
+        array[:, 2:] = self.values.astype(object)
+        return array
+
+    def row_to_csv(self, i):
+        """Format the i-th observation as a line of CSV."""
+        values = ",".join(map(str, self.values[i].tolist()))
+        return f"{self.timestamps[i]!s},{self.configs[self.config_ids[i]]},{values}"
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
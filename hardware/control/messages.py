@@ -23,6 +23,7 @@
 
 
 import re
+import numpy as np
 
 """ Classes to represent and parse the messages sent and received from
 the chambers' control boards.  """
@@ -32,9 +33,14 @@ the chambers' control boards.  """
 
 
 class Message:
-    def __init__(self, string, regexp):
+    __slots__ = ("raw", "kind", "args")
+    GRAMMAR = None  # Precompiled regular expression matching the message
+
+    def __init__(self, string, regexp=None):
         if type(string) == bytes:
             string = string.decode(errors="ignore")
+        if regexp is None:
+            regexp = self.GRAMMAR
         if regexp.match(string) is None:
             raise ValueError(f'Unrecognized message string "{string}"')
         else:
@@ -42,6 +48,32 @@ class Message:
         parts = string.split(",")
         self.kind = parts[0]
         self.args = parts[1:]
+        self._fields()
+
+    @classmethod
+    def from_args(cls, *args):
+        """Build a message from its arguments without matching it against
+        the grammar, e.g. for instructions which were already checked
+        (see control.protocol.compile).
+
+        Examples
+        --------
+        >>> MSR.from_args(100, 10).raw
+        'MSR,100,10'
+        >>> MSR.from_args(100, 10).n
+        100
+        """
+        msg = cls.__new__(cls)
+        msg.kind = cls.__name__
+        msg.args = [str(arg) for arg in args]
+        msg.raw = ",".join([msg.kind] + msg.args)
+        msg._fields()
+        return msg
+
+    def _fields(self):
+        """Set the attributes specific to the kind of message from its
+        arguments."""
+        pass
 
     def __str__(self):
         return self.raw
@@ -68,13 +100,35 @@ class SET(Message):
     ValueError: Unrecognized message string "ST,red,255"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^SET,[a-z0-9_]*,-?\d*\.?\d*$|^SET,[a-z0-9_]*,1/\d*$")
-        super().__init__(string, regexp)
+    __slots__ = ("target", "value")
+    GRAMMAR = re.compile(r"^SET,[a-z0-9_]*,-?\d*\.?\d*$|^SET,[a-z0-9_]*,1/\d*$")
+
+    def _fields(self):
         self.target = self.args[0]
         self.value = self.args[1]
 
 
+def set_value(value):
+    """The value a SET instruction sets its variable to, as the board
+    parses it (i.e. as a float), or the value itself if it is not a
+    number.
+
+    Examples
+    --------
+    >>> set_value("10") == set_value("10.0")
+    True
+    >>> set_value("0.1") == set_value("0.10000000149")
+    True
+    >>> set_value("1/3")
+    '1/3'
+
+    """
+    try:
+        return float(np.single(value))
+    except ValueError:
+        return value
+
+
 class MSR(Message):
     """
     Examples
@@ -92,9 +146,10 @@ class MSR(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^MSR,\d*,\d*$")
-        super().__init__(string, regexp)
+    __slots__ = ("n", "wait")
+    GRAMMAR = re.compile(r"^MSR,\d*,\d*$")
+
+    def _fields(self):
         self.n = int(self.args[0])
         self.wait = int(self.args[1])
 
@@ -114,9 +169,10 @@ class WAIT(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^WAIT,\d*$")
-        super().__init__(string, regexp)
+    __slots__ = ("wait",)
+    GRAMMAR = re.compile(r"^WAIT,\d*$")
+
+    def _fields(self):
         self.wait = int(self.args[0])
 
 
@@ -137,9 +193,10 @@ class WAIT_INPUT(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^WAIT_INPUT,.*$")
-        super().__init__(string, regexp)
+    __slots__ = ("prompt",)
+    GRAMMAR = re.compile(r"^WAIT_INPUT,.*$")
+
+    def _fields(self):
         self.prompt = self.args[0]
 
 
@@ -164,9 +221,8 @@ class OK(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^OK,.*$")
-        super().__init__(string, regexp)
+    __slots__ = ()
+    GRAMMAR = re.compile(r"^OK,.*$")
 
 
 class VARIABLES_LIST(Message):
@@ -188,9 +244,10 @@ class VARIABLES_LIST(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^VARIABLES_LIST(,[a-zA-Z0-9_]+)+$")
-        super().__init__(string, regexp)
+    __slots__ = ("variables",)
+    GRAMMAR = re.compile(r"^VARIABLES_LIST(,[a-zA-Z0-9_]+)+$")
+
+    def _fields(self):
         self.variables = self.args
 
 
@@ -213,9 +270,10 @@ class CHAMBER_CONFIG(Message):
     ValueError: Unrecognized message string "MR,100,10"
     """
 
-    def __init__(self, string):
-        regexp = re.compile("^CHAMBER_CONFIG,[a-zA-Z0-9\-]+$")
-        super().__init__(string, regexp)
+    __slots__ = ("config",)
+    GRAMMAR = re.compile(r"^CHAMBER_CONFIG,[a-zA-Z0-9\-]+$")
+
+    def _fields(self):
         self.config = self.args[0]
 
 
@@ -258,9 +316,28 @@ INSTRUCTIONS = [SET, MSR, WAIT, WAIT_INPUT]
 RESPONSES = [OK, VARIABLES_LIST, CHAMBER_CONFIG]  # DATA]
 
 
-def parse(string, accepted=INSTRUCTIONS + RESPONSES):
+# The message classes by their leading keyword, e.g. "MSR"
+KEYWORDS = {kind.__name__: kind for kind in INSTRUCTIONS + RESPONSES}
+
+
+def _keywords(accepted):
+    if accepted is None:
+        return KEYWORDS
+    return {kind.__name__: kind for kind in accepted}
+
+
+def parse(string, accepted=None):
     """
-    Parse a string into a message:
+    Parse a string into a message; only the class for the message's
+    leading keyword is tried (see KEYWORDS).
+
+    Parameters
+    ----------
+    string : str or bytes
+        The message.
+    accepted : list of classes or NoneType, default=None
+        The kinds of messages accepted; if None, all instructions and
+        responses.
 
     Examples
     --------
@@ -282,20 +359,46 @@ def parse(string, accepted=INSTRUCTIONS + RESPONSES):
     Traceback (most recent call last):
     ...
     ValueError: Unrecognized message string "TEST,hello"
+    >>> parse("OK,DONE", accepted=INSTRUCTIONS)
+    Traceback (most recent call last):
+    ...
+    ValueError: Unrecognized message string "OK,DONE"
     """
     if type(string) == bytes:
         string = string.decode()
-    parsed = None
-    for kind in accepted:
-        try:
-            parsed = kind(string)
-            break
-        except ValueError:
-            continue
-    if parsed is None:
+    keywords = KEYWORDS if accepted is None else _keywords(accepted)
+    kind = keywords.get(string.partition(",")[0])
+    if kind is None:
         raise ValueError(f'Unrecognized message string "{string}"')
-    else:
-        return parsed
+    return kind(string)
+
+
+def parse_many(lines, accepted=None):
+    """
+    Parse an iterable of strings into a list of messages (see parse).
+
+    Examples
+    --------
+    >>> [m.kind for m in parse_many(["SET,red,255", "MSR,10,0", "WAIT,100"])]
+    ['SET', 'MSR', 'WAIT']
+    >>> parse_many(["SET,red,255", "MSR,10"])
+    Traceback (most recent call last):
+    ...
+    ValueError: Line 1: Unrecognized message string "MSR,10"
+    """
+    get = _keywords(accepted).get
+    parsed = []
+    for i, string in enumerate(lines):
+        if type(string) == bytes:
+            string = string.decode()
+        kind = get(string.partition(",")[0])
+        try:
+            if kind is None:
+                raise ValueError(f'Unrecognized message string "{string}"')
+            parsed.append(kind(string))
+        except ValueError as e:
+            raise ValueError(f"Line {i}: {e}") from e
+    return parsed
 
 
 # ----------------------------------------------------------------------
@@ -0,0 +1,91 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import argparse
+import control.protocol as prtcl
+
+"""Rewrite an experiment protocol to take fewer round trips to the
+board (see control.protocol.optimize). Run with
+
+  python -m control.optimize_protocol --protocol <protocol.txt>
+
+from the hardware/ directory; the optimized protocol is written next
+to it, as <protocol>_optimized.txt, unless --output is given. Unless
+--strict is given, redundant SETs are removed, which changes the
+intervention flag of the observations that follow them."""
+
+# Parse parameters
+arguments = {
+    "protocol": {"type": str},
+    "output": {"type": str, "default": None},
+    "strict": {"type": bool, "default": False},  # Do not remove any SETs
+}
+
+parser = argparse.ArgumentParser(description="Optimize a protocol")
+for name, params in arguments.items():
+    required = True
+    if params["type"] == bool:
+        options = {"action": "store_true"}
+    else:
+        options = {"action": "store", "type": params["type"]}
+    if "default" in params:
+        options["default"] = params["default"]
+        required = False
+    parser.add_argument("--" + name, dest=name, required=required, **options)
+
+args = parser.parse_args()
+output = args.output
+if output is None:
+    output = args.protocol.split(".txt")[0] + "_optimized.txt"
+
+instructions, report = prtcl.optimize(prtcl.stream(args.protocol), strict=args.strict)
+with open(output, "w") as f:
+    print(f"# Optimized from {args.protocol}", file=f)
+    for instruction in instructions:
+        print(instruction, file=f)
+
+print(
+    "%d instructions -> %d (removed %d SET, %d WAIT and %d MSR instructions)"
+    % (
+        report["instructions"],
+        report["optimized"],
+        report["removed"]["SET"],
+        report["removed"]["WAIT"],
+        report["removed"]["MSR"],
+    ),
+    file=sys.stderr,
+)
+print(
+    "Estimated round trips to the board: %d -> %d (%d removed)"
+    % (*report["round_trips"], report["round_trips"][0] - report["round_trips"][1]),
+    file=sys.stderr,
+)
+if report["removed"]["SET"] > 0:
+    print(
+        "Warning: the removed SET instructions no longer raise the board's "
+        "intervention flag, so the intervention column of the observations "
+        "can change (use --strict to keep all SETs)",
+        file=sys.stderr,
+    )
+print(f'Wrote the optimized protocol to "{output}"', file=sys.stderr)
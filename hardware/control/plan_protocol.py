@@ -0,0 +1,106 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import argparse
+import control.protocol as prtcl
+import control.timing as timing
+import control.serial.trace as trace
+
+"""Predict how long an experiment protocol takes to run, and the share
+of the time spent waiting, setting variables and taking measurements,
+without running it (see control.timing). Fit the timing model of a
+chamber from a previous run and store it with
+
+  python -m control.plan_protocol --protocol <protocol.txt> --trace <run.trace> --run_output <run.csv> --save_model <model.json>
+
+from the hardware/ directory, where the trace and the output were
+written by run_experiment.py (with --trace_path and the csv sink), and
+then plan other protocols with --model <model.json>."""
+
+# Parse parameters
+arguments = {
+    "protocol": {"type": str},
+    "model": {"type": str, "default": None},  # A model stored with --save_model
+    "trace": {"type": str, "default": None},  # Trace of a run, to fit the model
+    "run_output": {"type": str, "default": None},  # Output of the same run (csv)
+    "save_model": {"type": str, "default": None},  # Where to store the fitted model
+    "skip_redundant_sets": {"default": False, "type": bool},  # As in run_experiment.py
+}
+
+parser = argparse.ArgumentParser(description="Plan a protocol run")
+for name, params in arguments.items():
+    required = True
+    if params["type"] == bool:
+        options = {"action": "store_true"}
+    else:
+        options = {"action": "store", "type": params["type"]}
+    if "default" in params:
+        options["default"] = params["default"]
+        required = False
+    parser.add_argument("--" + name, dest=name, required=required, **options)
+
+args = parser.parse_args()
+
+if args.model is not None:
+    model = timing.load(args.model)
+elif args.trace is not None:
+    observations = None
+    if args.run_output is not None:
+        observations = timing.read_observations(args.run_output)
+    model = timing.fit(trace.load(args.trace), observations)
+    if args.save_model is not None:
+        model.save(args.save_model)
+        print(f'Stored the timing model in "{args.save_model}"', file=sys.stderr)
+else:
+    parser.error("either --model or --trace must be given")
+print(model, file=sys.stderr)
+
+analysis = prtcl.analyze(
+    prtcl.stream(args.protocol),
+    model.osr_variables,
+    skip_redundant_sets=args.skip_redundant_sets,
+)
+prediction = model.predict(analysis)
+print(
+    "%d instructions: %d SETs sent (%d skipped), %d MSR instructions taking %d measurements, %0.2f seconds of WAITs"
+    % (
+        analysis["instructions"],
+        analysis["sets"],
+        analysis["skipped_sets"],
+        analysis["msrs"],
+        analysis["samples"],
+        analysis["wait_ms"] / 1000,
+    )
+)
+print("Predicted run time: %0.2f seconds" % prediction["total"])
+for part in ["waiting", "setting", "measuring"]:
+    print(
+        "  %-9s %10.2f seconds (%0.1f%%)"
+        % (part, prediction[part], 100 * prediction["shares"][part])
+    )
+if prediction["wait_inputs"] > 0:
+    print(
+        "  (not including the time taken to answer %d WAIT_INPUT instructions)"
+        % prediction["wait_inputs"]
+    )
@@ -22,33 +22,541 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
-import re
+import os
+import struct
+import zipfile
+import hashlib
+import itertools
+import numpy as np
 import control.messages as messages
 
+"""Loading of experiment protocols: text files with one instruction
+per line (see control.messages.INSTRUCTIONS), where empty lines and
+lines starting with # are ignored. Protocols can be loaded into a list
+(load), or checked in a first pass which builds no messages (check)
+and then read lazily while they are executed (stream), so that long
+protocols take little memory and the first instruction is available
+immediately.
 
-def load(filename, targets):
-    # Load protocol into memory
+Protocols can also be compiled into arrays (compile), which are cached
+in a .npz file next to the protocol and memory-mapped when the same
+protocol is run again (load_compiled), skipping the text parsing.
+
+Finally, protocols can be rewritten to take fewer round trips to the
+board while setting the same values and taking the same number of
+observations (optimize, or from the command line with
+control/optimize_protocol.py), and their cost can be counted before
+they are run (analyze, see control.timing for the predicted run
+time)."""
+
+# Opcodes of the instructions in a compiled protocol
+OPCODES = ["SET", "MSR", "WAIT", "WAIT_INPUT"]
+
+
+def digest(path):
+    """SHA-256 digest of a file (e.g. a protocol), as a hex string."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _lines(f):
+    """Yield the index and contents of the lines of a protocol file
+    which hold an instruction."""
+    for i, line in enumerate(f):
+        line = line.rstrip()
+        if line == "" or line[0] == "#":
+            continue
+        yield i, line
+
+
+def _checked(f, targets):
+    """Yield the index, contents and kind of the lines of a protocol
+    file which hold an instruction, checking them (see check)."""
+    keywords = messages.KEYWORDS
+    targets = set(targets)
+    numeric = (messages.MSR, messages.WAIT)
+    for i, line in _lines(f):
+        keyword, _, rest = line.partition(",")
+        kind = keywords.get(keyword)
+        if kind is None or kind.GRAMMAR.match(line) is None:
+            raise ValueError(
+                f'Line {i}: "{line}" does not match any valid instructions.'
+            )
+        # The grammars also match empty numbers (e.g. "WAIT,")
+        if kind in numeric and "" in rest.split(","):
+            raise ValueError(
+                f'Line {i}: "{line}" does not match any valid instructions.'
+            )
+        if kind is messages.SET and rest.partition(",")[0] not in targets:
+            raise SyntaxError(
+                f'Line {i}: target "{rest.partition(",")[0]}" does not match any variables on board'
+            )
+        yield i, line, kind
+
+
+def check(filename, targets):
+    """Check that every line of a protocol holds a valid instruction
+    (including its numbers), and that SET instructions target one of
+    the given variables, without building the instructions; return
+    their number.
+
+    Raises ValueError (syntax) or SyntaxError (target) naming the line,
+    as load does.
+
+    """
     with open(filename, "r", encoding="UTF-8") as f:
-        lines = [line.rstrip() for line in f]
-        f.close()
-    # Check all instructions have the correct syntax
-    comment_regex = re.compile("^#.*$")
-    parsed = []
-    for i, line in enumerate(lines):
-        if line == "":
-            pass
-        elif comment_regex.match(line) is not None:
-            pass
-        else:
+        return sum(1 for _ in _checked(f, targets))
+
+
+def stream(filename, start=0):
+    """Yield the instructions of a protocol, parsing each line as it is
+    read; the first start instructions are skipped without being
+    parsed. Check the protocol first (see check), as the SET targets
+    are not checked here; the file should not be modified until the
+    generator is exhausted."""
+    with open(filename, "r", encoding="UTF-8") as f:
+        for i, line in itertools.islice(_lines(f), start, None):
             try:
-                instruction = messages.parse(line)
-                if instruction.kind == "SET" and instruction.target not in targets:
-                    raise SyntaxError(
-                        f'Line {i}: target "{instruction.target}" does not match any variables on board'
-                    )
-                parsed.append(instruction)
+                yield messages.parse(line)
             except ValueError as e:
                 raise ValueError(
                     f'Line {i}: "{line}" does not match any valid instructions.'
                 ) from e
-    return parsed
+
+
+def load(filename, targets):
+    """Load a protocol into a list of instructions, checking it first
+    (see check)."""
+    with open(filename, "r", encoding="UTF-8") as f:
+        lines = [line for _, line, _ in _checked(f, targets)]
+    return messages.parse_many(lines)
+
+
+# ----------------------------------------------------------------------
+# Compiled protocols
+
+
+class CompiledProtocol:
+    def __init__(self, arrays):
+        """A protocol as a struct of arrays, with one entry per
+        instruction (see compile).
+
+        Parameters
+        ----------
+        arrays : dict of numpy.ndarray
+            The arrays described below, e.g. as returned by
+            numpy.load or memory-mapped from a cache file.
+
+        Attributes
+        ----------
+        opcodes : numpy.ndarray of uint8
+            The kind of each instruction, as an index into OPCODES.
+        targets : numpy.ndarray of int16
+            The target of SET instructions, as an index into
+            `variables`; -1 for other instructions.
+        values : numpy.ndarray of float64
+            The value of SET instructions; NaN for other instructions
+            and for values which are not a number (e.g. "1/2").
+        n : numpy.ndarray of int32
+            The number of measurements of MSR instructions; 0 for
+            other instructions.
+        wait : numpy.ndarray of int64
+            The wait of MSR and WAIT instructions; 0 for other
+            instructions.
+        text : numpy.ndarray of int32
+            The value of SET instructions and the prompt of WAIT_INPUT
+            instructions, as written in the protocol, as an index into
+            `strings`; -1 for other instructions.
+        strings : numpy.ndarray of str
+            The distinct values and prompts.
+        variables : numpy.ndarray of str
+            The board variables the protocol was compiled for.
+        digest : numpy.ndarray of str
+            The SHA-256 digest of the protocol file (0-dimensional).
+
+        Examples
+        --------
+        >>> arrays = {
+        ...     "opcodes": np.array([0, 1], dtype=np.uint8),
+        ...     "targets": np.array([1, -1], dtype=np.int16),
+        ...     "values": np.array([10, np.nan]),
+        ...     "n": np.array([0, 5], dtype=np.int32),
+        ...     "wait": np.array([0, 100], dtype=np.int64),
+        ...     "text": np.array([0, -1], dtype=np.int32),
+        ...     "strings": np.array(["10"]),
+        ...     "variables": np.array(["red", "green"]),
+        ...     "digest": np.array(""),
+        ... }
+        >>> protocol = CompiledProtocol(arrays)
+        >>> len(protocol)
+        2
+        >>> [str(i) for i in protocol.instructions()]
+        ['SET,green,10', 'MSR,5,100']
+        >>> [str(i) for i in protocol.instructions(start=1)]
+        ['MSR,5,100']
+
+        """
+        self.opcodes = arrays["opcodes"]
+        self.targets = arrays["targets"]
+        self.values = arrays["values"]
+        self.n = arrays["n"]
+        self.wait = arrays["wait"]
+        self.text = arrays["text"]
+        self.strings = arrays["strings"]
+        self.variables = arrays["variables"]
+        self.digest = str(arrays["digest"])
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def arrays(self):
+        """The arrays of the protocol, by name (see CompiledProtocol)."""
+        return {
+            "opcodes": self.opcodes,
+            "targets": self.targets,
+            "values": self.values,
+            "n": self.n,
+            "wait": self.wait,
+            "text": self.text,
+            "strings": self.strings,
+            "variables": self.variables,
+            "digest": np.array(self.digest),
+        }
+
+    def instructions(self, start=0, chunk_size=4096):
+        """Yield the instructions of the protocol from the given index,
+        building them from the arrays a chunk at a time."""
+        variables = self.variables.tolist()
+        strings = self.strings.tolist()
+        builders = [
+            lambda t, n, w, s: messages.SET.from_args(variables[t], strings[s]),
+            lambda t, n, w, s: messages.MSR.from_args(n, w),
+            lambda t, n, w, s: messages.WAIT.from_args(w),
+            lambda t, n, w, s: messages.WAIT_INPUT.from_args(strings[s]),
+        ]
+        for i in range(start, len(self), chunk_size):
+            chunk = slice(i, i + chunk_size)
+            for op, t, n, w, s in zip(
+                self.opcodes[chunk].tolist(),
+                self.targets[chunk].tolist(),
+                self.n[chunk].tolist(),
+                self.wait[chunk].tolist(),
+                self.text[chunk].tolist(),
+            ):
+                yield builders[op](t, n, w, s)
+
+
+def compile(filename, targets):
+    """Compile a protocol into a CompiledProtocol, checking it as check
+    does; the SET targets are stored as indices into the given list of
+    variables (e.g. Board.variables)."""
+    columns = {name: [] for name in ["opcodes", "targets", "values", "n", "wait"]}
+    columns["text"] = []
+    strings = {}
+    index = {target: i for i, target in enumerate(targets)}
+    with open(filename, "r", encoding="UTF-8") as f:
+        for _, line, kind in _checked(f, targets):
+            args = line.split(",")[1:]
+            target, value, n, wait, text = -1, np.nan, 0, 0, -1
+            if kind is messages.SET:
+                target = index[args[0]]
+                text = strings.setdefault(args[1], len(strings))
+                try:
+                    value = float(args[1])
+                except ValueError:
+                    pass
+            elif kind is messages.MSR:
+                n, wait = int(args[0]), int(args[1])
+            elif kind is messages.WAIT:
+                wait = int(args[0])
+            else:
+                text = strings.setdefault(args[0], len(strings))
+            columns["opcodes"].append(OPCODES.index(kind.__name__))
+            columns["targets"].append(target)
+            columns["values"].append(value)
+            columns["n"].append(n)
+            columns["wait"].append(wait)
+            columns["text"].append(text)
+    return CompiledProtocol(
+        {
+            "opcodes": np.array(columns["opcodes"], dtype=np.uint8),
+            "targets": np.array(columns["targets"], dtype=np.int16),
+            "values": np.array(columns["values"], dtype=np.float64),
+            "n": np.array(columns["n"], dtype=np.int32),
+            "wait": np.array(columns["wait"], dtype=np.int64),
+            "text": np.array(columns["text"], dtype=np.int32),
+            "strings": np.array(list(strings), dtype=str),
+            "variables": np.array(list(targets), dtype=str),
+            "digest": np.array(digest(filename)),
+        }
+    )
+
+
+def compiled_path(filename):
+    """Path of the cache file of a compiled protocol, next to it."""
+    return os.path.splitext(filename)[0] + ".npz"
+
+
+def save_compiled(protocol, path):
+    """Store a compiled protocol in an uncompressed .npz file, so that
+    it can be memory-mapped (see mmap_npz); the file is replaced
+    atomically."""
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **protocol.arrays())
+    os.replace(path + ".tmp", path)
+
+
+def mmap_npz(path):
+    """Memory-map the arrays of an uncompressed .npz file (numpy.load
+    ignores mmap_mode for .npz files); returns a dict of arrays."""
+    with zipfile.ZipFile(path) as archive:
+        members = archive.infolist()
+    arrays = {}
+    with open(path, "rb") as f:
+        for member in members:
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'"{path}" is compressed and cannot be memory-mapped')
+            # The data follows the local header of the member
+            f.seek(member.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            f.seek(member.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = member.filename[: -len(".npy")]
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran else "C",
+                )
+    return arrays
+
+
+def load_compiled(filename, targets, cache=True):
+    """Return a protocol compiled for the given variables, memory-mapped
+    from its cache file (see compiled_path) if the file was compiled
+    from the same contents (by SHA-256 digest) and variables; otherwise
+    compile it and, if cache, store it in the cache file. If the cache
+    cannot be written (e.g. a read-only directory), the compiled
+    protocol is returned all the same."""
+    path = compiled_path(filename)
+    if cache and os.path.exists(path):
+        try:
+            protocol = CompiledProtocol(mmap_npz(path))
+        except (ValueError, KeyError, OSError, zipfile.BadZipFile):
+            protocol = None
+        if (
+            protocol is not None
+            and protocol.digest == digest(filename)
+            and protocol.variables.tolist() == list(targets)
+        ):
+            return protocol
+    protocol = compile(filename, targets)
+    if cache:
+        try:
+            save_compiled(protocol, path)
+        except OSError:
+            pass
+    return protocol
+
+
+# ----------------------------------------------------------------------
+# Optimization
+
+# Largest number of measurements of a single MSR instruction (the
+# firmware stores it in an int, which takes 16 bits on some boards)
+MAX_MSR = 32767
+
+
+def optimize(protocol, strict=False):
+    """Rewrite a protocol to take fewer round trips to the board. Three
+    rewrites are done:
+
+      - SET instructions which do not change the value of their target
+        (as Board.skip_redundant_sets does at run time), unless strict;
+      - consecutive WAIT instructions are merged into one;
+      - consecutive MSR instructions with the same wait are merged into
+        one (of at most MAX_MSR measurements).
+
+    The values of the variables and the number of observations taken
+    are unchanged, but unless strict, the observations are not: every
+    SET raises the board's intervention flag, so the "intervention"
+    column of the first observation after a removed SET can change
+    from 1 to 0. If strict, SETs are left untouched so the
+    observations are the same.
+
+    Parameters
+    ----------
+    protocol : iterable of control.messages.Message
+        The instructions, e.g. as returned by load or stream.
+    strict : bool, default=False
+        If True, do not remove any SET instructions, so the
+        intervention flags in the observations are unchanged.
+
+    Returns
+    -------
+    instructions : list of control.messages.Message
+        The optimized protocol.
+    report : dict
+        The number of "instructions" before and after ("optimized"),
+        the number of instructions removed by kind ("removed") and the
+        estimated round trips to the board before and after (one for
+        every SET and MSR instruction).
+
+    Examples
+    --------
+    >>> protocol = [messages.parse(line) for line in [
+    ...     "SET,red,10", "MSR,1,0", "SET,red,10.0", "MSR,1,0",
+    ...     "WAIT,100", "WAIT,50", "SET,flag,1", "SET,flag,1", "MSR,2,0"]]
+    >>> instructions, report = optimize(protocol)
+    >>> [str(i) for i in instructions]
+    ['SET,red,10', 'MSR,2,0', 'WAIT,150', 'SET,flag,1', 'MSR,2,0']
+    >>> report["removed"], report["round_trips"]
+    ({'SET': 2, 'WAIT': 1, 'MSR': 1}, (7, 4))
+    >>> instructions, report = optimize(protocol, strict=True)
+    >>> [str(i) for i in instructions]
+    ['SET,red,10', 'MSR,1,0', 'SET,red,10.0', 'MSR,1,0', 'WAIT,150', 'SET,flag,1', 'SET,flag,1', 'MSR,2,0']
+
+    """
+    values = {}
+    instructions = []
+    removed = {"SET": 0, "WAIT": 0, "MSR": 0}
+    n = 0
+    for instruction in protocol:
+        n += 1
+        kind = instruction.kind
+        last = instructions[-1] if instructions else None
+        if kind == "SET":
+            value = messages.set_value(instruction.value)
+            if not strict and values.get(instruction.target) == value:
+                removed["SET"] += 1
+                continue
+            values[instruction.target] = value
+        elif kind == "WAIT" and last is not None and last.kind == "WAIT":
+            instructions[-1] = messages.WAIT.from_args(last.wait + instruction.wait)
+            removed["WAIT"] += 1
+            continue
+        elif (
+            kind == "MSR"
+            and last is not None
+            and last.kind == "MSR"
+            and last.wait == instruction.wait
+            and last.n + instruction.n <= MAX_MSR
+        ):
+            instructions[-1] = messages.MSR.from_args(
+                last.n + instruction.n, instruction.wait
+            )
+            removed["MSR"] += 1
+            continue
+        instructions.append(instruction)
+    round_trips = sum(1 for i in instructions if i.kind in ["SET", "MSR"])
+    report = {
+        "instructions": n,
+        "optimized": len(instructions),
+        "removed": removed,
+        "round_trips": (round_trips + removed["SET"] + removed["MSR"], round_trips),
+    }
+    return instructions, report
+
+
+# ----------------------------------------------------------------------
+# Analysis
+
+
+def analyze(protocol, osr_variables=(), skip_redundant_sets=False):
+    """Count the cost of a protocol without running it: the time spent
+    in WAITs, the SETs sent to the board and the MSR instructions and
+    measurements, grouped by the oversampling settings they are taken
+    with (see control.timing.TimingModel).
+
+    Parameters
+    ----------
+    protocol : iterable of control.messages.Message
+        The instructions, e.g. as returned by load or stream.
+    osr_variables : list of str, default=()
+        The variables holding oversampling settings (e.g. "osr_c"),
+        whose values are followed through the protocol.
+    skip_redundant_sets : bool, default=False
+        Do not count SETs which do not change their target, as the
+        Board does not send them if skip_redundant_sets is set (see
+        Board).
+
+    Returns
+    -------
+    analysis : dict
+        The number of "instructions", the milliseconds spent in WAITs
+        ("wait_ms"), the number of WAIT_INPUTs ("wait_inputs"), of
+        SETs sent ("sets") and skipped ("skipped_sets"), of MSR
+        instructions ("msrs") and of measurements ("samples"), and
+        "measurements", a dict mapping the values of osr_variables
+        (None if not set by the protocol) to the number of MSR
+        instructions and measurements taken with them.
+
+    Examples
+    --------
+    >>> protocol = [messages.parse(line) for line in [
+    ...     "SET,red,10", "MSR,10,0", "SET,osr_c,4", "SET,red,10", "MSR,5,0",
+    ...     "WAIT,100", "WAIT,50", "MSR,1,0"]]
+    >>> analysis = analyze(protocol, ["osr_c"], skip_redundant_sets=True)
+    >>> analysis["wait_ms"], analysis["sets"], analysis["skipped_sets"]
+    (150, 2, 1)
+    >>> analysis["msrs"], analysis["samples"]
+    (3, 16)
+    >>> analysis["measurements"]
+    {(None,): [1, 10], (4.0,): [2, 6]}
+
+    """
+    values = {}
+    analysis = {
+        "instructions": 0,
+        "wait_ms": 0,
+        "wait_inputs": 0,
+        "sets": 0,
+        "skipped_sets": 0,
+        "msrs": 0,
+        "samples": 0,
+        "measurements": {},
+    }
+    for instruction in protocol:
+        analysis["instructions"] += 1
+        kind = instruction.kind
+        if kind == "SET":
+            value = messages.set_value(instruction.value)
+            if skip_redundant_sets and values.get(instruction.target) == value:
+                analysis["skipped_sets"] += 1
+            else:
+                analysis["sets"] += 1
+                values[instruction.target] = value
+        elif kind == "MSR":
+            analysis["msrs"] += 1
+            analysis["samples"] += instruction.n
+            settings = tuple(values.get(v) for v in osr_variables)
+            counts = analysis["measurements"].setdefault(settings, [0, 0])
+            counts[0] += 1
+            counts[1] += instruction.n
+        elif kind == "WAIT":
+            analysis["wait_ms"] += instruction.wait
+        elif kind == "WAIT_INPUT":
+            analysis["wait_inputs"] += 1
+    return analysis
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -29,9 +29,15 @@ import sys
 import numpy as np
 import control.protocol as prtcl
 from control.board import Board
+from control.serial.trace import Tracer
+from control.serial.metrics import Metrics
+from control.serial.capture import CaptureSerial
+from control.sinks import open_sink
+from control.scheduler import Scheduler
+from control.session import SessionCache, keep_dtr, DEFAULT_PATH
+import control.checkpoint as checkpoint
 from datetime import datetime
 
-
 # Parse parameters
 arguments = {
     "delay": {"default": 4000, "type": int},  # Milliseconds to wait for board to reset
@@ -40,6 +46,24 @@ arguments = {
     "verbose": {"default": 1, "type": int},
     "protocol": {"type": str},
     "output_path": {"type": str, "default": "data_raw/"},
+    "window_size": {"default": 1, "type": int},
+    "trace_path": {"type": str, "default": None},  # Where to dump the event trace
+    "trace_size": {"default": 65536, "type": int},  # Events kept in the trace
+    "metrics_path": {"type": str, "default": None},  # Where to write metric snapshots
+    "metrics_interval": {"default": 10.0, "type": float},  # Seconds between snapshots
+    "metrics_format": {"default": "json", "type": str},  # json or prometheus
+    "capture_path": {"type": str, "default": None},  # Where to capture the raw traffic
+    "sink": {"default": "csv", "type": str},  # One of control.sinks.SINKS
+    "rows_per_flush": {"default": 1000, "type": int},  # Buffered (or per chunk)
+    "ms_per_flush": {"default": 1000.0, "type": float},  # Max. time buffered (csv)
+    "writer_thread": {"default": False, "type": bool},  # Write from a separate thread
+    "variables_path": {"type": str, "default": None},  # variables.csv with column types
+    "skip_redundant_sets": {"default": False, "type": bool},  # Skip no-op SETs (Board)
+    "warm": {"default": False, "type": bool},  # Resume the session, no reset
+    "session_path": {"default": DEFAULT_PATH, "type": str},  # Where sessions are stored
+    "checkpoint_interval": {"default": 60.0, "type": float},  # Seconds; 0 disables
+    "resume": {"type": str, "default": None},  # Checkpoint of the run to resume
+    "no_compile_cache": {"default": False, "type": bool},  # Don't cache the compilation
 }
 
 parser = argparse.ArgumentParser(description="Run experiments")
@@ -63,15 +87,43 @@ protocol_name = args.protocol.split("/")[-1]
 protocol_name = protocol_name.split(".txt")[0]
 timestamp = datetime.now().strftime("%Y_%m_%d-%H_%M_%S")
 log_filename = "logs/%s_%s.log" % (timestamp, protocol_name)
-output_filename = args.output_path + timestamp + "_" + protocol_name + ".csv"
-print(f'\nSaving data to "{output_filename}"\n', file=sys.stderr)
-
-with open(output_filename, "w") as output_file:
+extension = {
+    "csv": ".csv",
+    "binary": ".bin",
+    "npy": ".npy.d",
+    "arrow": ".arrow",
+    "parquet": ".parquet.d",
+}.get(args.sink, "")
+output_filename = args.output_path + timestamp + "_" + protocol_name + extension
+resumed = None
+if args.resume is not None:
+    # Continue the output of the interrupted run
+    resumed = checkpoint.load(args.resume)
+    if resumed["digest"] != prtcl.digest(args.protocol):
+        raise ValueError(f'The protocol "{args.protocol}" changed since the checkpoint')
+    output_filename = resumed["output"]
+    args.sink = resumed["sink"]
+    args.variables_path = resumed["variables_path"]
+if args.sink != "null":
+    print(f'\nSaving data to "{output_filename}"\n', file=sys.stderr)
+
+with open_sink(
+    args.sink,
+    output_filename,
+    args.rows_per_flush,
+    args.ms_per_flush,
+    threaded=args.writer_thread,
+    variables_path=args.variables_path,
+    resume=None if resumed is None else resumed["offsets"],
+) as sink:
     with open(log_filename, "w") as logfile:
 
         def log(msg, end="\n"):
             print(msg, end=end, file=sys.stderr)
             print(msg, end=end, file=logfile)
+
+        def flush_logs():
+            logfile.flush()
             sys.stderr.flush()
             sys.stdout.flush()
 
@@ -79,33 +131,102 @@ with open(output_filename, "w") as output_file:
 
         # Open port and execute protocol
         log("Opening port %s at baud rate %d" % (args.port, args.baud_rate))
-        with serial.Serial(args.port, args.baud_rate, timeout=None) as ser:
+        ser = serial.Serial(args.port, args.baud_rate, timeout=None)
+        if args.warm:
+            keep_dtr(ser)
+        if args.capture_path is not None:
+            log('Capturing serial traffic to "%s"' % args.capture_path)
+            ser = CaptureSerial(ser, args.capture_path)
+        with ser:
+            tracer = None if args.trace_path is None else Tracer(args.trace_size)
+            metrics = Metrics(
+                path=args.metrics_path,
+                interval=args.metrics_interval,
+                format=args.metrics_format,
+            )
             board = Board(
                 serial=ser,
-                output_file=output_file,
+                sink=sink,
                 log_fun=log,
                 verbose=args.verbose,
+                window_size=args.window_size,
+                tracer=tracer,
+                metrics=metrics,
+                skip_redundant_sets=args.skip_redundant_sets,
+                session_cache=SessionCache(args.session_path) if args.warm else None,
             )
 
             # Write header with variable names
-            header = ",".join(board.variables)
-            print(header, file=output_file)
-
-            # Load and parse protocol
-            log("Loading and parsing protocol")
-            protocol = prtcl.load(args.protocol, board.variables)
-            log("Protocol loaded")
-
-            start_time = time.time()
-            # Go through protocol, executing each instruction
-            for i, instruction in enumerate(protocol):
-                board.execute_instruction(instruction)
-
-            # Tell board to reset and close serial connection
-            board.reset()
-            time.sleep(args.delay / 1000)
-            log(
-                'Ran experiment for protocol "%s" in %0.2f seconds. Stored results in "%s"'
-                % (args.protocol, time.time() - start_time, output_filename)
+            sink.write_header(board.variables)
+
+            # Load the compiled protocol, memory-mapped from its cache
+            # if it was already compiled
+            log("Loading protocol")
+            protocol = prtcl.load_compiled(
+                args.protocol, board.variables, cache=not args.no_compile_cache
+            )
+            log("Protocol loaded (%d instructions)" % len(protocol))
+
+            # Periodically store the progress of the run
+            checkpointer = checkpoint.Checkpointer(
+                output_filename + ".checkpoint",
+                sink,
+                {
+                    "protocol": args.protocol,
+                    "digest": protocol.digest,
+                    "output": output_filename,
+                    "sink": args.sink,
+                    "variables_path": args.variables_path,
+                },
+                interval=args.checkpoint_interval,
             )
-            print(board.comms)
+            start = 0
+            if resumed is not None:
+                start = checkpoint.restore(board, resumed, checkpointer)
+                log("Resuming the protocol from instruction %d" % start)
+
+            try:
+                start_time = time.time()
+                # Go through protocol, executing each instruction; the logs
+                # and outputs are flushed during WAITs
+                scheduler = Scheduler(board)
+                scheduler.when_idle(flush_logs)
+                scheduler.when_idle(metrics.poll)  # e.g. during long WAITs
+                flush_logs()
+                for i, instruction in enumerate(protocol.instructions(start), start):
+                    scheduler.execute(instruction)
+                    if args.checkpoint_interval > 0:
+                        checkpointer.step(i + 1, instruction)
+                scheduler.finish()
+                checkpointer.remove()
+
+                if args.warm:
+                    # Leave the board running for the next run
+                    board.save_session()
+                else:
+                    # Tell board to reset and close serial connection
+                    board.reset()
+                    time.sleep(args.delay / 1000)
+                log(
+                    'Ran experiment for protocol "%s" in %0.2f seconds. Stored results in "%s"'
+                    % (args.protocol, time.time() - start_time, output_filename)
+                )
+                log("Skipped %d redundant SET instructions" % board.skipped_sets)
+                print(scheduler)
+                print(board.comms)
+                print(board.comms.packet_layer)
+                print(metrics)
+            finally:
+                # Also written if the run fails, when they are most useful
+                if args.metrics_path is not None:
+                    metrics.write()
+                if tracer is not None:
+                    tracer.dump(args.trace_path)
+                    log(
+                        'Dumped %d trace events (%d dropped) to "%s"'
+                        % (
+                            min(tracer.recorded, tracer.size),
+                            tracer.dropped,
+                            args.trace_path,
+                        )
+                    )
@@ -126,14 +126,14 @@ with open(output_filename, "w") as output_file:
             print(header, file=output_file)
             output_file.flush()
 
-            # Load and parse protocol
-            log("Loading and parsing protocol")
-            protocol = prtcl.load(args.protocol, board.variables + camera_variables)
-            log("Protocol loaded")
+            # Check the protocol; its instructions are read as they are executed
+            log("Checking protocol")
+            prtcl.check(args.protocol, board.variables + camera_variables)
+            log("Protocol checked")
 
             start_time = time.time()
             # Go through protocol, executing each instruction
-            for i, instruction in enumerate(protocol):
+            for i, instruction in enumerate(prtcl.stream(args.protocol)):
                 if instruction.kind == "SET" and instruction.target == "aperture":
                     log(f"Executing instruction {instruction}")
                     cam.set_aperture(instruction.value)
@@ -151,7 +151,9 @@ with open(output_filename, "w") as output_file:
                     sub_instruction = deepcopy(instruction)
                     sub_instruction.n = 1
                     for i in range(instruction.n):
-                        observation = board.execute_instruction(sub_instruction)
+                        observation = board.execute_instruction(
+                            sub_instruction
+                        ).to_object_array()
                         timestamp = observation[0]
                         filename = str(IMG_COUNTER) + f"_{timestamp:d}" + ".jpg"
                         path = images_directory + filename
@@ -0,0 +1,186 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import time
+import collections
+import control.serial.trace as trace
+
+"""Deadline-based execution of protocols.
+
+Board.execute_instruction implements WAIT,<ms> with time.sleep, which
+overshoots by up to a few milliseconds, and every other instruction
+adds the host's overhead; over protocols with thousands of WAITs, these
+delays add up. The Scheduler keeps a timeline instead: each WAIT ends
+at an absolute deadline on the monotonic clock, computed from where the
+previous WAIT should have ended (plus the time taken by the
+instructions in between), so the lateness of one WAIT is recovered by
+the next. The time spent waiting is used for deferred work, e.g.
+flushing the output sink and the logs."""
+
+SPIN = 0.001  # Seconds before a deadline spent polling the clock instead of sleeping
+
+
+class Scheduler:
+    def __init__(self, board, clock=time.monotonic, sleep=time.sleep, spin=SPIN):
+        """Execute instructions on a Board, turning WAITs into deadlines.
+        While the scheduler is used, the board's output sink is flushed
+        while waiting, instead of after each MSR instruction (see
+        Board.flush_after_measurements).
+
+        Parameters
+        ----------
+        board : control.board.Board
+            The board the instructions are executed on.
+        clock : function, default=time.monotonic
+            Returns the current time, in seconds.
+        sleep : function, default=time.sleep
+        spin : float, default=SPIN
+            The last seconds before a deadline are spent polling the
+            clock, as sleeping may overshoot.
+
+        Attributes
+        ----------
+        lateness : float
+            How many seconds the schedule is behind, i.e. how late the
+            last WAIT ended; it is recovered by the next WAITs.
+        max_lateness : float
+            The largest lateness of a WAIT.
+        overshoot : float
+            The total lateness of all WAITs, i.e. how much the run
+            would have been delayed by sleeping through each WAIT.
+        waits : int
+            The number of WAIT instructions executed.
+
+        Examples
+        --------
+        >>> class StandInBoard:
+        ...     sink = None
+        ...     def execute_instruction(self, instruction):
+        ...         print(instruction)
+        >>> import control.messages as messages
+        >>> scheduler = Scheduler(StandInBoard())
+        >>> scheduler.defer(print, "work done while waiting")
+        >>> protocol = ["SET,red,10", "WAIT,20", "WAIT,20", "MSR,1,0"]
+        >>> start = time.monotonic()
+        >>> scheduler.run([messages.parse(i) for i in protocol])
+        SET,red,10
+        work done while waiting
+        MSR,1,0
+        >>> 0.04 <= time.monotonic() - start < 0.06
+        True
+        >>> scheduler.waits, scheduler.lateness < 0.005
+        (2, True)
+
+        """
+        self.board = board
+        self.tracer = getattr(board, "tracer", trace.DISABLED)
+        self.clock = clock
+        self.sleep = sleep
+        self.spin = spin
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.overshoot = 0.0
+        self.waits = 0
+        self.waited = 0.0  # Total duration of the WAITs
+        self._deferred = collections.deque()
+        self._idle = []
+        if getattr(board, "sink", None) is not None:
+            board.flush_after_measurements = False
+            self.when_idle(board.sink.flush)
+
+    def defer(self, fun, *args):
+        """Call fun(*args) during the next WAIT with enough time left, or
+        at the end of the run."""
+        self._deferred.append((fun, args))
+
+    def when_idle(self, fun, *args):
+        """Call fun(*args) during every WAIT, and at the end of the run."""
+        self._idle.append((fun, args))
+
+    def execute(self, instruction):
+        """Execute an instruction; return what Board.execute_instruction
+        returns."""
+        if instruction.kind == "WAIT":
+            if self.tracer.enabled:
+                self.tracer.record(trace.WAIT_STARTED, instruction.wait)
+            self.wait(instruction.wait / 1000)
+        else:
+            if instruction.kind == "WAIT_INPUT":
+                # The schedule starts again once the user is done
+                self.lateness = 0.0
+            return self.board.execute_instruction(instruction)
+
+    def wait(self, seconds):
+        """Wait until the deadline of a WAIT of the given duration,
+        doing deferred work in the meantime."""
+        deadline = self.clock() - self.lateness + seconds
+        for fun, args in self._idle:
+            fun(*args)
+        while self._deferred and self.clock() < deadline - self.spin:
+            fun, args = self._deferred.popleft()
+            fun(*args)
+        remaining = deadline - self.spin - self.clock()
+        if remaining > 0:
+            self.sleep(remaining)
+        while self.clock() < deadline:
+            pass
+        self.lateness = self.clock() - deadline
+        self.max_lateness = max(self.max_lateness, self.lateness)
+        self.overshoot += self.lateness
+        self.waits += 1
+        self.waited += seconds
+
+    def finish(self):
+        """Do the remaining deferred work."""
+        for fun, args in self._idle:
+            fun(*args)
+        while self._deferred:
+            fun, args = self._deferred.popleft()
+            fun(*args)
+
+    def run(self, protocol):
+        """Execute a list of instructions (see control.protocol.load),
+        then do the remaining deferred work."""
+        for instruction in protocol:
+            self.execute(instruction)
+        self.finish()
+
+    def __str__(self):
+        string = "SCHEDULE"
+        string += "\n--------"
+        string += f"\n  waits = {self.waits} ({self.waited:0.3f} s)"
+        string += f"\n  drift = {self.lateness * 1000:0.3f} ms (max. {self.max_lateness * 1000:0.3f} ms)"
+        string += f"\n  total lateness of the waits = {self.overshoot * 1000:0.3f} ms"
+        return string
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -0,0 +1,266 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import asyncio
+import binascii
+import collections
+from control.serial.frame import FrameDecoder, FrameEncoder
+from control.serial.packet import ARDUINO_BUFFER_SIZE
+from control.serial.segment import TransportLayer, Segment, MAX_INT
+import control.serial.trace as trace
+
+"""asyncio variants of the packet and transport layers (see packet.py
+and segment.py), with the same wire protocol. Instead of blocking on
+serial reads, the packet layer registers the file descriptor of the
+serial connection with the event loop and decodes incoming bytes as
+they arrive, so other tasks can run while waiting for the board.
+
+Writes are small (at most ARDUINO_BUFFER_SIZE bytes per packet) and are
+done directly, without waiting for them to be transmitted."""
+
+
+class AsyncPacketLayer:
+    def __init__(
+        self,
+        ser,
+        log_fun=print,
+        verbose=0,
+        discarded="warn",
+        max_size=ARDUINO_BUFFER_SIZE,
+        tracer=None,
+    ):
+        """
+        Parameters
+        ----------
+        ser : serial.Serial
+            The serial connection object (see pySerial library); it
+            must provide a file descriptor through ser.fileno(). Its
+            read timeout is set to 0, i.e. reads never block.
+        log_fun, verbose, discarded, max_size, tracer
+            See control.serial.packet.PacketLayer.
+
+        """
+        self.serial = ser
+        self.tracer = trace.DISABLED if tracer is None else tracer
+        self.verbose = verbose
+        self.discarded = discarded
+        self.encoder = FrameEncoder(max_size=max_size)
+        self.decoder = FrameDecoder()
+        self._packets = collections.deque()  # Decoded packets (or errors)
+        self._waiter = None
+        self._loop = None
+        # Stats counters
+        self.read_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        # Wrap log function to filter by verbosity
+        def log(string, verbosity_level=0, **kwargs):
+            if verbosity_level <= self.verbose:
+                log_fun(string, **kwargs)
+
+        self.log = log
+
+        # Reads are only done when the event loop reports data is available
+        settings = self.serial.get_settings()
+        settings["timeout"] = 0
+        self.serial.apply_settings(settings)
+
+    def start(self):
+        """Start reading from the serial connection in the running event
+        loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self.serial.fileno(), self._on_readable)
+
+    def stop(self):
+        """Stop reading from the serial connection."""
+        if self._loop is not None:
+            self._loop.remove_reader(self.serial.fileno())
+            self._loop = None
+
+    def _on_readable(self):
+        chunk = self.serial.read(max(1, self.serial.in_waiting))
+        self.read_calls += 1
+        self.bytes_read += len(chunk)
+        if self.tracer.enabled:
+            self.tracer.record(trace.SERIAL_READ, n_bytes=len(chunk))
+        if self.verbose >= 3:
+            self.log(f"      chunk={chunk}", 3)
+        self.decoder.feed(chunk)
+        while True:
+            try:
+                packet = self.decoder.next_packet()
+            except binascii.Error as e:
+                packet = e  # Raised when the packet is received
+            if packet is None:
+                break
+            self._packets.append(packet)
+        if len(self._packets) > 0 and self._waiter is not None:
+            if not self._waiter.done():
+                self._waiter.set_result(None)
+
+    def send(self, data):
+        """Encode and send a message to the board over serial"""
+        msg = self.encoder.encode(data)  # Raises ValueError if too large
+        self.serial.write(msg)
+        self.bytes_written += len(msg)
+        if self.tracer.enabled:
+            self.tracer.record(trace.PACKET_SENT, n_bytes=len(msg))
+        if self.verbose >= 1:
+            self.log(f'      SENT: "{data}"', 1)
+            self.log(f'      SENT (raw, {len(msg)} bytes): "{msg}"', 2)
+
+    async def receive(self, timeout=None):
+        """Wait for the next message from the serial connection and
+        return it decoded."""
+        if len(self._packets) == 0:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                # The rest of a partial frame is not coming
+                self.decoder.drop_partial()
+                raise UserWarning(f"Packet reception timed out after {timeout} seconds")
+            finally:
+                self._waiter = None
+        packet = self._packets.popleft()
+        # Decide what to do with discarded bytes
+        discarded = self.decoder.pop_discarded()
+        if len(discarded) > 0:
+            if self.tracer.enabled:
+                self.tracer.record(trace.BYTES_DISCARDED, n_bytes=len(discarded))
+            warning = f"Unexpected bytes outside of message symbols: {discarded}"
+            if self.discarded == "raise":
+                raise Exception(warning)
+            elif self.discarded == "warn":
+                self.log(warning, 0)  # Always log independently of verbosity
+        if isinstance(packet, binascii.Error):
+            raise packet
+        if self.tracer.enabled:
+            self.tracer.record(trace.PACKET_RECEIVED, n_bytes=len(packet))
+        if self.verbose >= 1:
+            self.log(f'      RECEIVED: "{packet}"', 1)
+        return packet
+
+    def bytes_per_read(self):
+        """Average number of bytes returned by each read call to the
+        serial object."""
+        return self.bytes_read / self.read_calls if self.read_calls > 0 else 0.0
+
+    def __str__(self):
+        string = "PACKET LAYER STATE"
+        string += "\n------------------"
+        string += f"\n  read calls = {self.read_calls}"
+        string += f"\n  bytes read = {self.bytes_read}"
+        string += f"\n  bytes written = {self.bytes_written}"
+        string += f"\n  bytes per read call = {self.bytes_per_read():0.2f}"
+        return string
+
+
+class AsyncTransportLayer(TransportLayer):
+    """Transport layer on top of an AsyncPacketLayer; the parameters and
+    state are the same as for TransportLayer, but send, receive, flush
+    and set_window_size are coroutines. It must not be used by more
+    than one task at a time."""
+
+    async def _receive(self, timeout=None):
+        try:
+            packet = await self.packet_layer.receive(timeout)
+        except UserWarning as e:  # Timed-out
+            self._receive_failed(e)
+            return None
+        except binascii.Error as e:  # Could not decode base64
+            self._receive_failed(f"Error decoding packet:  {e}")
+            return None
+        return self._decode(packet)
+
+    async def send(self, data):
+        """Send data to the other end. In stop-and-wait mode, wait until
+        it is acknowledged; in windowed mode, only until there is room
+        in the window (see flush)."""
+        if type(data) == str:
+            data = data.encode()
+        if self.window_size > 1:
+            while len(self._unacked) >= self.window_size:
+                await self._poll()
+            self._send_next(data)
+            return
+        segment_to_send = Segment(number=(self.last_delivered + 1) % MAX_INT, data=data)
+        acknowledged = False
+        transmissions = 0
+        while not acknowledged:
+            self._send(segment_to_send)
+            sent_at = time.monotonic()
+            transmissions += 1
+            while not acknowledged:
+                remaining = sent_at + self.rto - time.monotonic()
+                if remaining <= 0:
+                    self._timed_out()
+                    break
+                reply = await self._receive(timeout=remaining)
+                acknowledged = self._handle_reply(
+                    reply, segment_to_send, sent_at, transmissions
+                )
+        self.resends += transmissions - 1
+        self.payload_sent += len(data)
+
+    async def receive(self, timeout=None):
+        """Wait until the next segment from the other end is received,
+        acknowledge it and return its data. If a timeout (in seconds) is
+        given, return None if no segment is received in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.window_size > 1:
+            while len(self._received) == 0:
+                remaining = self._remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return None
+                await self._poll(deadline)
+            return self._received.popleft()
+        while True:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                return None
+            segment = await self._receive(timeout=remaining)
+            if self._handle_segment(segment):
+                return segment.data
+
+    async def flush(self):
+        """Wait until all sent segments have been acknowledged."""
+        while len(self._unacked) > 0:
+            await self._poll()
+
+    async def set_window_size(self, window_size):
+        """Change the window size, once all sent segments have been
+        acknowledged."""
+        if window_size < 1:
+            raise ValueError("window_size should be at least 1")
+        await self.flush()
+        self._set_window_size(window_size)
+
+    async def _poll(self, deadline=None):
+        timeout = self._window_timeout()
+        if timeout is not None and timeout <= 0:
+            self._resend_window()
+        else:
+            timeout = self._earliest(timeout, self._remaining(deadline))
+            self._handle_windowed(await self._receive(timeout=timeout))
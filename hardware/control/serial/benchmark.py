@@ -0,0 +1,305 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import binascii
+import argparse
+import timeit
+import threading
+import numpy as np
+from control.serial.frame import FrameDecoder, FrameEncoder
+from control.serial.packet import PacketLayer
+import control.serial.segment as segment
+from control.serial.segment import TransportLayer, Segment
+from control.serial.loopback import loopback_pair
+import control.serial.trace as trace
+from control.measurements import Measurements
+import control.messages as messages
+
+"""Microbenchmarks for the serial communication layers, which run
+without a board attached. Run as
+
+  python -m control.serial.benchmark [--benchmarks frame ...]
+
+from the hardware/ directory."""
+
+
+def benchmark_frame(n_packets=100000, packet_size=176, chunk_size=4096):
+    """Encode n_packets random packets into a single stream and decode
+    it back in chunks of chunk_size bytes, as they would be read from
+    the serial."""
+    packets = [os.urandom(packet_size) for _ in range(n_packets)]
+    encoder = FrameEncoder()
+    start = timeit.default_timer()
+    stream = b"".join(encoder.encode(p) for p in packets)
+    encode_time = timeit.default_timer() - start
+
+    decoder = FrameDecoder()
+    start = timeit.default_timer()
+    n_decoded = 0
+    for i in range(0, len(stream), chunk_size):
+        decoder.feed(stream[i : i + chunk_size])
+        for _ in decoder:
+            n_decoded += 1
+    decode_time = timeit.default_timer() - start
+    assert n_decoded == n_packets
+
+    print(
+        f"FRAME CODEC ({n_packets} packets of {packet_size} bytes, {len(stream)} bytes on the wire)"
+    )
+    print(
+        f"  encode: {n_packets / encode_time:0.0f} packets/s, {len(stream) / encode_time / 1e6:0.1f} MB/s"
+    )
+    print(
+        f"  decode: {n_packets / decode_time:0.0f} packets/s, {len(stream) / decode_time / 1e6:0.1f} MB/s (chunks of {chunk_size} bytes)"
+    )
+
+
+def benchmark_window(
+    window_sizes=(1, 2, 4, 8, 16),
+    n_observations=500,
+    n_variables=44,
+    baud_rate=500000,
+    latency=0.001,
+):
+    """Stream n_observations observations (of n_variables floats) from
+    an emulated board to the host over an emulated link, for
+    different transport window sizes."""
+    print(
+        f"TRANSPORT WINDOW ({n_observations} observations of {n_variables} variables, {baud_rate} baud, {latency * 1000:0.1f} ms latency)"
+    )
+    for window_size in window_sizes:
+        host_serial, board_serial = loopback_pair(baud_rate, latency)
+        host = TransportLayer(PacketLayer(host_serial), window_size=window_size)
+        board = TransportLayer(
+            PacketLayer(board_serial, max_size=None), window_size=window_size
+        )
+        observation = os.urandom(4 * n_variables)
+
+        def run_board():
+            board.receive()  # Measurement instruction
+            for _ in range(n_observations):
+                board.send(observation)
+            board.receive()  # End of the benchmark
+
+        thread = threading.Thread(target=run_board, daemon=True)
+        thread.start()
+        start = timeit.default_timer()
+        host.send("MSR")
+        for _ in range(n_observations):
+            assert host.receive() == observation
+        elapsed = timeit.default_timer() - start
+        host.send("END")
+        thread.join()
+        print(
+            f"  window size {window_size:>3}: {n_observations / elapsed:0.1f} observations/s"
+        )
+
+
+def _encode_reference(seg):
+    """Segment encoding with int.to_bytes and concatenation, as it was
+    implemented before control.serial.segment.encode (kept as a
+    baseline for benchmark_segment)."""
+    flags = (1 * seg.ack + 2 * seg.syn).to_bytes(length=1, byteorder="little")
+    number = seg.number.to_bytes(length=4, byteorder="little")
+    ack_number = seg.ack_number.to_bytes(length=4, byteorder="little")
+    segment_bytes = flags + number + ack_number + seg.data
+    return segment_bytes + binascii.crc32(segment_bytes).to_bytes(
+        length=4, byteorder="little"
+    )
+
+
+def _decode_reference(segment_bytes):
+    """Baseline segment decoding with int.from_bytes slices (see
+    _encode_reference)."""
+    checksum = int.from_bytes(segment_bytes[-4:], byteorder="little")
+    rest = segment_bytes[:-4]
+    if checksum != binascii.crc32(rest):
+        raise UserWarning("Checksum does not match")
+    number = int.from_bytes(rest[1:5], byteorder="little")
+    ack_number = int.from_bytes(rest[5:9], byteorder="little")
+    return Segment(number, ack_number, rest[0] & 1, (rest[0] >> 1) & 1, rest[9:])
+
+
+def _encode_pack_into(seg, buffer):
+    """Segment encoding with HEADER.pack_into and CHECKSUM.pack_into on
+    a reusable buffer, which must hold exactly one segment of this size
+    (kept as an alternative for benchmark_segment)."""
+    end = segment.HEADER.size + len(seg.data)
+    segment.HEADER.pack_into(
+        buffer, 0, 1 * seg.ack + 2 * seg.syn, seg.number, seg.ack_number
+    )
+    buffer[segment.HEADER.size : end] = seg.data
+    segment.CHECKSUM.pack_into(buffer, end, binascii.crc32(buffer[:end]))
+    return buffer
+
+
+def benchmark_segment(n_segments=200000, n_variables=44):
+    """Time the encoding and decoding of a data segment (an
+    observation of n_variables floats) and of its ACK, against the
+    reference int.to_bytes/from_bytes implementation."""
+    data = os.urandom(4 * n_variables)
+    data_segment = Segment(12, 34, data=data)
+    encoded = segment.encode(data_segment)
+    encoded_ack = segment.encode_ack(56, 12)
+    ack_segment = Segment(56, 12, ack=True)
+    data_buffer = bytearray(len(encoded))
+    ack_buffer = bytearray(len(encoded_ack))
+    cases = {
+        "reference": [
+            lambda: _encode_reference(data_segment),
+            lambda: _decode_reference(encoded),
+            lambda: _encode_reference(ack_segment),
+            lambda: _decode_reference(encoded_ack),
+        ],
+        "struct": [
+            lambda: segment.encode(data_segment),
+            lambda: segment.decode(encoded),
+            lambda: segment.encode_ack(56, 12),
+            lambda: segment.decode(encoded_ack),
+        ],
+        "pack_into": [
+            lambda: _encode_pack_into(data_segment, data_buffer),
+            lambda: segment.decode(encoded),
+            lambda: _encode_pack_into(ack_segment, ack_buffer),
+            lambda: segment.decode(encoded_ack),
+        ],
+    }
+    print(f"SEGMENT CODEC ({n_segments} data + ACK segments, {len(data)} data bytes)")
+    for name, (encode_data, decode_data, encode_ack, decode_ack) in cases.items():
+        start = timeit.default_timer()
+        for _ in range(n_segments):
+            encode_data()
+            decode_data()
+            encode_ack()
+            decode_ack()
+        elapsed = timeit.default_timer() - start
+        print(f"  {name:>9}: {elapsed / n_segments * 1e6:0.2f} us per observation")
+
+
+def benchmark_trace(n_events=1000000):
+    """Time the cost of recording an event, with a disabled and an
+    enabled tracer."""
+    print(f"TRACE ({n_events} events)")
+    for name, tracer in [("disabled", trace.DISABLED), ("enabled", trace.Tracer())]:
+        start = timeit.default_timer()
+        for i in range(n_events):
+            if tracer.enabled:
+                tracer.record(trace.SEGMENT_SENT, i, 0, 176)
+        elapsed = timeit.default_timer() - start
+        print(f"  {name:>8}: {elapsed / n_events * 1e9:0.1f} ns per event")
+
+
+def benchmark_measurements(n_observations=10000, n_variables=44):
+    """Time storing the observations of MSR,<n_observations>,0 into a
+    Measurements buffer, against the previous (n, n_vars) object
+    array."""
+    variables = ["timestamp", "config"] + [f"v{i}" for i in range(n_variables)]
+    payloads = [os.urandom(4 * n_variables) for _ in range(n_observations)]
+    print(f"MEASUREMENTS ({n_observations} observations of {n_variables} variables)")
+
+    start = timeit.default_timer()
+    objects = np.zeros((n_observations, len(variables)), dtype=object)
+    for i, data in enumerate(payloads):
+        objects[i, 0] = timeit.default_timer()
+        objects[i, 1] = "standard"
+        objects[i, 2:] = np.frombuffer(data, dtype=np.single)
+    elapsed = timeit.default_timer() - start
+    size = objects.nbytes + 24 * objects.size  # Pointers and boxed floats
+    print(f"  object array: {elapsed * 1000:0.1f} ms, ~{size / 1e6:0.1f} MB")
+
+    start = timeit.default_timer()
+    measurements = Measurements(variables, n_observations, ["standard"])
+    for i, data in enumerate(payloads):
+        measurements.store(i, timeit.default_timer(), 0, data)
+    elapsed = timeit.default_timer() - start
+    size = (
+        measurements.values.nbytes
+        + measurements.timestamps.nbytes
+        + measurements.config_ids.nbytes
+    )
+    print(f"  measurements: {elapsed * 1000:0.1f} ms, {size / 1e6:0.1f} MB")
+
+
+def _parse_reference(string):
+    """Message parsing as it was implemented before the dispatch on
+    the leading keyword (kept as a baseline for benchmark_parse): each
+    message class is tried in turn, compiling its grammar and raising
+    ValueError on a mismatch."""
+    for kind in messages.INSTRUCTIONS + messages.RESPONSES:
+        try:
+            if re.compile(kind.GRAMMAR.pattern).match(string) is None:
+                raise ValueError(f'Unrecognized message string "{string}"')
+            return kind(string)
+        except ValueError:
+            continue
+    raise ValueError(f'Unrecognized message string "{string}"')
+
+
+def benchmark_parse(n_lines=700000, seed=42):
+    """Time parsing a generated protocol of n_lines instructions, with
+    the reference parser, parse and parse_many."""
+    rng = np.random.default_rng(seed)
+    targets = ["red", "green", "blue", "pol_1", "pol_2", "osr_c"]
+    lines = []
+    for _ in range(n_lines):
+        kind = rng.integers(3)
+        if kind == 0:
+            lines.append(f"SET,{rng.choice(targets)},{rng.integers(256)}")
+        elif kind == 1:
+            lines.append(f"MSR,{rng.integers(1, 100)},0")
+        else:
+            lines.append(f"WAIT,{rng.integers(1000)}")
+    cases = {
+        "reference": lambda: [_parse_reference(line) for line in lines],
+        "parse": lambda: [messages.parse(line) for line in lines],
+        "parse_many": lambda: messages.parse_many(lines),
+    }
+    print(f"PARSE ({n_lines} instructions)")
+    for name, parse in cases.items():
+        start = timeit.default_timer()
+        parse()
+        elapsed = timeit.default_timer() - start
+        print(
+            f"  {name:>10}: {elapsed:0.2f} s, {elapsed / n_lines * 1e6:0.2f} us per line"
+        )
+
+
+BENCHMARKS = {
+    "frame": benchmark_frame,
+    "segment": benchmark_segment,
+    "window": benchmark_window,
+    "trace": benchmark_trace,
+    "measurements": benchmark_measurements,
+    "parse": benchmark_parse,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serial layer microbenchmarks")
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,319 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import struct
+import timeit
+import argparse
+from control.serial.frame import FrameDecoder
+import control.serial.segment as segment
+
+"""Capture and replay of the raw bytes exchanged with a board.
+
+CaptureSerial wraps the pySerial object given to the packet layer and
+records every chunk read from and written to it, with its time, in a
+compact binary file. ReplaySerial feeds the chunks that were read back
+to the packet layer, at their original pace or as fast as possible, so
+the host side of the stack (e.g. Board.take_measurements) can be
+profiled on real chamber traffic without a chamber attached. Replay a
+capture with
+
+  python -m control.serial.capture <file> [--realtime]
+
+from the hardware/ directory.
+
+File format: the MAGIC string, followed by one record per chunk: a
+RECORD header (kind, nanoseconds since the capture started, length)
+and the bytes of the chunk."""
+
+MAGIC = b"CHAMBER-CAPTURE-1\n"
+RECORD = struct.Struct("<BqI")
+READ = 0
+WRITE = 1
+
+
+class CaptureSerial:
+    def __init__(self, ser, path):
+        """Record the chunks read from/written to the serial object ser
+        into the file at path. All other attributes and methods are
+        those of ser.
+
+        Examples
+        --------
+        >>> import tempfile, os
+        >>> from control.serial.loopback import loopback_pair
+        >>> host, board = loopback_pair()
+        >>> path = os.path.join(tempfile.mkdtemp(), "test.cap")
+        >>> with CaptureSerial(host, path) as capture:
+        ...     board.write(b"hello")
+        ...     capture.write(b"hi")
+        ...     capture.in_waiting
+        ...     capture.read(5)
+        5
+        2
+        5
+        b'hello'
+        >>> [(kind, data) for _, kind, data in load(path)]
+        [(1, b'hi'), (0, b'hello')]
+        >>> replay = ReplaySerial(path)
+        >>> replay.in_waiting, replay.read(3), replay.read(3), replay.read(3)
+        (5, b'hel', b'lo', b'')
+
+        """
+        self.serial = ser
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self._start = time.monotonic_ns()
+
+    def _record(self, kind, data):
+        self.file.write(RECORD.pack(kind, time.monotonic_ns() - self._start, len(data)))
+        self.file.write(data)
+
+    def read(self, size=1):
+        data = self.serial.read(size)
+        self._record(READ, data)
+        return data
+
+    def write(self, data):
+        written = self.serial.write(data)
+        self._record(WRITE, bytes(data))
+        return written
+
+    def close(self):
+        self.file.close()
+        self.serial.close()
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load(path):
+    """Return the records of a capture file as a list of (time in
+    nanoseconds, kind, bytes) tuples."""
+    with open(path, "rb") as f:
+        contents = f.read()
+    if not contents.startswith(MAGIC):
+        raise ValueError(f'"{path}" is not a capture file')
+    records = []
+    pos = len(MAGIC)
+    while pos < len(contents):
+        kind, t, length = RECORD.unpack_from(contents, pos)
+        pos += RECORD.size
+        records.append((t, kind, contents[pos : pos + length]))
+        pos += length
+    return records
+
+
+def sent_data(path):
+    """Return the data of the segments the host sent in a capture (e.g.
+    the instructions to the board), without ACKs or retransmissions.
+    Segments are sent in order, so those which do not follow the
+    highest sequence number sent so far are retransmissions (e.g. of a
+    whole window, see TransportLayer)."""
+    decoder = FrameDecoder()
+    data = []
+    last_number = None
+    for _, kind, chunk in load(path):
+        if kind != WRITE:
+            continue
+        for packet in decoder.decode(chunk):
+            seg = segment.decode(packet)
+            if seg.ack:
+                continue
+            if last_number is None or segment.distance(last_number, seg.number) == 1:
+                data.append(seg.data)
+                last_number = seg.number
+    return data
+
+
+class ReplaySerial:
+    def __init__(self, path, realtime=False, timeout=None, write_timeout=None):
+        """Serial object which returns the chunks read in a capture (see
+        CaptureSerial); the bytes written to it are discarded.
+
+        Parameters
+        ----------
+        path : str
+            The capture file.
+        realtime : bool, default=False
+            If True, chunks become available when they were read in
+            the capture, relative to when the replay started (i.e. the
+            creation of this object). Otherwise, they are available
+            immediately.
+        timeout, write_timeout : float or NoneType
+            As for serial.Serial. Reads which timed out in the capture
+            also return no bytes in the replay.
+
+        """
+        self.chunks = [(t, data) for t, kind, data in load(path) if kind == READ]
+        self.realtime = realtime
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+        self._next = 0  # Next chunk to be read
+        self._pos = 0  # Bytes of the next chunk already read
+        self._start = time.monotonic_ns()
+        # Stats
+        self.bytes_written = 0
+
+    def _available_at(self, chunk):
+        """Monotonic time (in nanoseconds) at which a chunk is available."""
+        return self._start + self.chunks[chunk][0] if self.realtime else 0
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic_ns()
+        waiting = 0
+        chunk = self._next
+        while chunk < len(self.chunks) and self._available_at(chunk) <= now:
+            waiting += len(self.chunks[chunk][1])
+            if not self.realtime and waiting > 0:
+                break  # Keep the chunking of the capture
+            chunk += 1
+        return waiting - self._pos
+
+    def read(self, size=1):
+        out = bytearray()
+        while len(out) < size and self._next < len(self.chunks):
+            wait = (self._available_at(self._next) - time.monotonic_ns()) / 1e9
+            if wait > 0:
+                if self.timeout is not None and wait > self.timeout:
+                    time.sleep(self.timeout)
+                    break
+                time.sleep(wait)
+            data = self.chunks[self._next][1]
+            if len(data) == 0:
+                # A read which timed out in the capture
+                self._next += 1
+                if len(out) == 0:
+                    break
+                continue
+            take = min(size - len(out), len(data) - self._pos)
+            out += data[self._pos : self._pos + take]
+            self._pos += take
+            if self._pos == len(data):
+                self._next += 1
+                self._pos = 0
+        return bytes(out)
+
+    def done(self):
+        """Whether all the captured chunks have been read."""
+        return self._next >= len(self.chunks)
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def get_settings(self):
+        return {"timeout": self.timeout, "write_timeout": self.write_timeout}
+
+    def apply_settings(self, settings):
+        self.timeout = settings.get("timeout", self.timeout)
+        self.write_timeout = settings.get("write_timeout", self.write_timeout)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def setDTR(self, value=True):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def replay(path, realtime=False, log_fun=print, verbose=0):
+    """Replay a capture through a Board, re-executing the instructions
+    the host sent in it; return the list of observation arrays
+    returned by the measurement instructions."""
+    import control.messages as messages
+    from control.board import Board
+
+    instructions = [d.decode() for d in sent_data(path)]
+    window_size = 1
+    if len(instructions) > 0 and instructions[0].startswith("WND,"):
+        # Negotiated by the board when it connects
+        window_size = int(instructions.pop(0).split(",")[1])
+    with ReplaySerial(path, realtime=realtime) as ser:
+        board = Board(
+            ser,
+            output_file=None,
+            log_fun=log_fun,
+            verbose=verbose,
+            window_size=window_size,
+            # Send every SET which was sent in the capture
+            skip_redundant_sets=False,
+        )
+        results = []
+        for instruction in instructions:
+            if instruction == "RST":
+                board.reset()
+            else:
+                result = board.execute_instruction(messages.parse(instruction))
+                if result is not None:
+                    results.append(result)
+    return board, results
+
+
+# ----------------------------------------------------------------------
+# Doctests and replay of captures
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Replay a capture file")
+        parser.add_argument("path", type=str)
+        parser.add_argument("--realtime", action="store_true")
+        parser.add_argument("--verbose", type=int, default=0)
+        args = parser.parse_args()
+        start = timeit.default_timer()
+        board, results = replay(args.path, args.realtime, verbose=args.verbose)
+        elapsed = timeit.default_timer() - start
+        n = sum(len(r) for r in results)
+        print(f"Replayed {n} observations in {elapsed:0.3f} seconds")
+        print(f"  {n / elapsed:0.1f} observations/s")
+        print(board.comms)
+        print(board.comms.packet_layer)
+    else:
+        import doctest
+
+        doctest.testmod(
+            extraglobs={},
+            verbose=True,
+            optionflags=doctest.ELLIPSIS,
+        )
@@ -0,0 +1,205 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import binascii
+
+"""Encoding/decoding of the frames exchanged over the serial, i.e. a
+base64 encoded packet sandwiched between a start (NUL) and end (EOT)
+symbol. The encoder and decoder perform no I/O: bytes are fed to the
+decoder as they arrive from any source (a pySerial object, an asyncio
+transport, an in-memory buffer) and complete packets are taken out of
+it. The layer using them is implemented in packet.py"""
+
+
+START_SYMBOL = b"\0"
+END_SYMBOL = b"\4"
+
+
+class FrameEncoder:
+    def __init__(self, max_size=None):
+        """
+        Parameters
+        ----------
+        max_size : int or NoneType, default=None
+            The maximum length of an encoded frame, including the
+            start/end symbols. If None, frames can have any length.
+
+        """
+        self.max_size = max_size
+
+    def encode(self, data):
+        """Encode a packet into a frame.
+
+        Examples
+        --------
+        >>> FrameEncoder().encode(b"test")
+        b'\\x00dGVzdA==\\x04'
+        >>> FrameEncoder(max_size=8).encode(b"test")
+        Traceback (most recent call last):
+        ...
+        ValueError: Encoded frame is larger than the maximum size (10 > 8).
+
+        """
+        frame = START_SYMBOL + binascii.b2a_base64(data, newline=False) + END_SYMBOL
+        if self.max_size is not None and len(frame) > self.max_size:
+            raise ValueError(
+                f"Encoded frame is larger than the maximum size ({len(frame)} > {self.max_size})."
+            )
+        return frame
+
+
+class FrameDecoder:
+    def __init__(self):
+        """Incremental decoder: bytes are appended with feed() and
+        complete packets are taken with next_packet() or by iterating
+        over the decoder.
+
+        Bytes received outside of the start/end symbols are kept in
+        the attribute `discarded` until they are taken with
+        pop_discarded().
+
+        Examples
+        --------
+        >>> decoder = FrameDecoder()
+        >>> decoder.feed(b"xx\\0dGVz")
+        >>> decoder.next_packet() is None
+        True
+        >>> decoder.feed(b"dA==\\4\\0YQ==\\4\\0")
+        >>> list(decoder)
+        [b'test', b'a']
+        >>> decoder.pop_discarded()
+        b'xx'
+        >>> decoder.decode(b"YWI=\\4")
+        [b'ab']
+        >>> decoder.decode(b"\\0YW=\\4\\0YQ==\\4")
+        Traceback (most recent call last):
+        ...
+        binascii.Error: Incorrect padding
+        >>> decoder.decode(b"")
+        [b'a']
+
+        """
+        self.buffer = bytearray()
+        self._pos = 0  # Start of the bytes which have not been parsed
+        self._scanned = 0  # Position up to which the end symbol was searched
+        self.discarded = bytearray()
+        # Stats counters
+        self.bytes_fed = 0
+        self.packets = 0
+
+    def feed(self, data):
+        """Append a chunk of bytes to the decoder's buffer."""
+        if self._pos > 0 and 2 * self._pos >= len(self.buffer):
+            # Drop the bytes which have already been parsed
+            del self.buffer[: self._pos]
+            self._scanned -= self._pos
+            self._pos = 0
+        self.buffer += data
+        self.bytes_fed += len(data)
+
+    def next_packet(self):
+        """Return the next complete packet in the buffer, decoded from
+        base64, or None if there is none.
+
+        Raises binascii.Error if the frame is not correctly base64
+        encoded; the frame is dropped and decoding can continue.
+
+        """
+        buffer = self.buffer
+        start = buffer.find(START_SYMBOL, self._pos)
+        if start < 0:
+            self.discarded += buffer[self._pos :]
+            buffer.clear()
+            self._pos = 0
+            self._scanned = 0
+            return None
+        if start > self._pos:
+            self.discarded += buffer[self._pos : start]
+            self._pos = start
+        end = buffer.find(END_SYMBOL, max(start + 1, self._scanned))
+        if end < 0:
+            self._scanned = len(buffer)
+            return None
+        self._pos = end + 1
+        self._scanned = end + 1
+        self.packets += 1
+        # Decode directly from the buffer, without copying the frame
+        with memoryview(buffer)[start + 1 : end] as body:
+            return binascii.a2b_base64(body)
+
+    def decode(self, data):
+        """Feed a chunk of bytes and return the list of complete
+        packets in the buffer."""
+        self.feed(data)
+        return list(self)
+
+    def pop_discarded(self):
+        """Return and clear the bytes discarded so far."""
+        discarded = bytes(self.discarded)
+        self.discarded.clear()
+        return discarded
+
+    def drop_partial(self):
+        """Drop the bytes of an incomplete frame at the end of the buffer,
+        e.g. after a timeout, so that they are not joined to the next
+        frame; the bytes discarded so far are kept.
+
+        Examples
+        --------
+        >>> decoder = FrameDecoder()
+        >>> decoder.decode(b"xx\\0dGVz")
+        []
+        >>> decoder.drop_partial()
+        >>> decoder.decode(b"\\0YQ==\\4")
+        [b'a']
+        >>> decoder.pop_discarded()
+        b'xx'
+        """
+        self.buffer.clear()
+        self._pos = 0
+        self._scanned = 0
+
+    def reset(self):
+        """Drop all buffered and discarded bytes."""
+        self.buffer.clear()
+        self.discarded.clear()
+        self._pos = 0
+        self._scanned = 0
+
+    def __iter__(self):
+        while True:
+            packet = self.next_packet()
+            if packet is None:
+                return
+            yield packet
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -0,0 +1,242 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import threading
+import collections
+import numpy as np
+
+"""In-memory emulation of a serial link, to run the communication
+layers without a board attached. A link is a pair of LoopbackSerial
+objects (see loopback_pair) which implement the subset of the pySerial
+interface used by the packet layer; bytes written to one end are
+delivered to the other after the time needed to transmit them at the
+given baud rate plus a fixed latency. Bytes can also be dropped or
+corrupted at random, to exercise the error control of the transport
+layer."""
+
+
+class _Channel:
+    """One direction of the link."""
+
+    def __init__(self, baud_rate, latency, loss=0.0, corruption=0.0, rng=None):
+        self.baud_rate = baud_rate
+        self.latency = latency
+        self.loss = loss
+        self.corruption = corruption
+        self.rng = rng
+        # Stats counters
+        self.bytes_lost = 0
+        self.bytes_corrupted = 0
+        self.condition = threading.Condition()
+        self.chunks = collections.deque()  # (delivery time, bytes)
+        self.busy_until = 0.0  # When the line finishes transmitting
+
+    def _impair(self, data):
+        """Drop and corrupt bytes at random."""
+        data = np.frombuffer(data, dtype=np.uint8).copy()
+        if self.corruption > 0:
+            corrupted = self.rng.random(len(data)) < self.corruption
+            # Flip one random bit of each corrupted byte
+            bits = self.rng.integers(0, 8, size=corrupted.sum())
+            data[corrupted] ^= (1 << bits).astype(np.uint8)
+            self.bytes_corrupted += len(bits)
+        if self.loss > 0:
+            kept = self.rng.random(len(data)) >= self.loss
+            self.bytes_lost += len(data) - kept.sum()
+            data = data[kept]
+        return data.tobytes()
+
+    def write(self, data):
+        if self.loss > 0 or self.corruption > 0:
+            data = self._impair(data)
+        with self.condition:
+            now = time.monotonic()
+            tx_time = 0.0 if self.baud_rate is None else len(data) * 10 / self.baud_rate
+            self.busy_until = max(now, self.busy_until) + tx_time
+            self.chunks.append((self.busy_until + self.latency, bytes(data)))
+            self.condition.notify_all()
+
+    def available(self):
+        now = time.monotonic()
+        with self.condition:
+            return sum(len(c) for t, c in self.chunks if t <= now)
+
+    def read(self, size, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        out = bytearray()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                # Take the bytes which have been delivered
+                while self.chunks and self.chunks[0][0] <= now and len(out) < size:
+                    t, chunk = self.chunks[0]
+                    take = size - len(out)
+                    out += chunk[:take]
+                    if take < len(chunk):
+                        self.chunks[0] = (t, chunk[take:])
+                    else:
+                        self.chunks.popleft()
+                if len(out) >= size:
+                    return bytes(out)
+                # Wait until the next chunk is delivered or the timeout
+                wait = self.chunks[0][0] - now if self.chunks else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return bytes(out)
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+
+    def clear(self):
+        with self.condition:
+            self.chunks.clear()
+
+
+class LoopbackSerial:
+    def __init__(self, rx, tx, timeout=None, write_timeout=None, on_dtr=None):
+        """One end of an emulated serial link; use loopback_pair to
+        create one.
+
+        Examples
+        --------
+        >>> a, b = loopback_pair()
+        >>> a.write(b"hello")
+        5
+        >>> b.in_waiting
+        5
+        >>> b.read(3), b.read(2)
+        (b'hel', b'lo')
+        >>> b.timeout = 0.01
+        >>> b.read()
+        b''
+
+        Lossy link, where the board is reset when DTR is set:
+
+        >>> a, b = loopback_pair(loss=0.5, seed=42, on_dtr=lambda v: print(f"DTR={v}"))
+        >>> a.write(b"0123456789")
+        10
+        >>> b.read(b.in_waiting)
+        b'012467'
+        >>> a.setDTR(False); a.setDTR(True)
+        DTR=False
+        DTR=True
+
+        """
+        self._rx = rx
+        self._tx = tx
+        self.on_dtr = on_dtr
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return self._rx.available()
+
+    def read(self, size=1):
+        return self._rx.read(size, self.timeout)
+
+    def write(self, data):
+        self._tx.write(data)
+        return len(data)
+
+    def flush(self):
+        """Block until all written bytes have been transmitted."""
+        remaining = self._tx.busy_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def get_settings(self):
+        return {"timeout": self.timeout, "write_timeout": self.write_timeout}
+
+    def apply_settings(self, settings):
+        self.timeout = settings.get("timeout", self.timeout)
+        self.write_timeout = settings.get("write_timeout", self.write_timeout)
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def setDTR(self, value=True):
+        if self.on_dtr is not None:
+            self.on_dtr(value)
+
+    def close(self):
+        self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def loopback_pair(
+    baud_rate=None, latency=0.0, loss=0.0, corruption=0.0, seed=None, on_dtr=None
+):
+    """Return the two ends of an emulated serial link.
+
+    Parameters
+    ----------
+    baud_rate : int or NoneType, default=None
+        The baud rate of the link, used to compute the time it takes
+        to transmit each byte (10 bits per byte). If None, bytes are
+        transmitted instantly.
+    latency : float, default=0
+        Seconds added to the delivery of every write, e.g. to emulate
+        the latency of the USB bus.
+    loss : float, default=0
+        Probability that each byte written is dropped.
+    corruption : float, default=0
+        Probability that a bit of each byte written is flipped.
+    seed : int or NoneType, default=None
+        Seed for the random loss and corruption.
+    on_dtr : function or NoneType, default=None
+        Called with the value given to setDTR on the first end (the
+        host), e.g. to reset an emulated board.
+
+    """
+    # One generator for each direction, as they are used from different threads
+    rng_a, rng_b = [
+        np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(2)
+    ]
+    a_to_b = _Channel(baud_rate, latency, loss, corruption, rng_a)
+    b_to_a = _Channel(baud_rate, latency, loss, corruption, rng_b)
+    return (
+        LoopbackSerial(b_to_a, a_to_b, on_dtr=on_dtr),
+        LoopbackSerial(a_to_b, b_to_a),
+    )
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -0,0 +1,327 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import bisect
+import collections
+
+"""Metrics of the communication with the board, to monitor the health
+of the link during long runs: histograms of the ACK round-trip times
+and of the time taken to receive each observation, bytes on the wire
+(i.e. base64 encoded frames) vs. payload bytes, rolling goodput, the
+counters of the transport layer and the backpressure of the output
+sink (see control.sinks.ThreadedSink). Snapshots can be written periodically
+to a JSON file or to a Prometheus text file (e.g. for the node
+exporter's textfile collector)."""
+
+# Histogram bucket upper bounds (seconds), from 100 microseconds to ~13 seconds
+LATENCY_BUCKETS = tuple(1e-4 * 2**i for i in range(18))
+
+FORMATS = ["json", "prometheus"]
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """Histogram with fixed bucket upper bounds; values above the
+        last bound go to an overflow bucket.
+
+        Examples
+        --------
+        >>> h = Histogram(bounds=(1, 2, 4))
+        >>> for v in [0.5, 1.5, 1.7, 3, 10]:
+        ...     h.record(v)
+        >>> h.counts
+        [1, 2, 1, 1]
+        >>> h.count, h.sum
+        (5, 16.7)
+        >>> h.quantile(0.5)
+        2
+        >>> h.quantile(1)
+        inf
+        >>> d = Histogram(bounds=(1e-4 * 2**5, 1)).to_dict()
+        >>> d["p99"], d["buckets"]
+        (None, {'0.0032': 0, '1': 0, '+Inf': 0})
+        >>> h.to_dict()["p99"]
+        '+Inf'
+
+        """
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q-th quantile, or
+        None if no values were recorded."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+
+    def to_dict(self):
+        """The histogram as a dictionary which can be written as JSON:
+        the bucket bounds are labelled with a fixed precision, and
+        quantiles in the overflow bucket are "+Inf"."""
+
+        def quantile(q):
+            bound = self.quantile(q)
+            return "+Inf" if bound == float("inf") else bound
+
+        labels = ["%g" % b for b in self.bounds] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": quantile(0.5),
+            "p90": quantile(0.9),
+            "p99": quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Metrics:
+    def __init__(self, path=None, interval=10.0, format="json", goodput_window=10.0):
+        """
+        Parameters
+        ----------
+        path : str or NoneType, default=None
+            The file where snapshots are written by poll() and
+            write(). If None, snapshots are only returned by
+            snapshot().
+        interval : float, default=10
+            Minimum number of seconds between snapshots written by
+            poll().
+        format : {"json", "prometheus"}, default="json"
+            The format of the snapshot file.
+        goodput_window : float, default=10
+            Length (in seconds) of the window over which the rolling
+            goodput is computed.
+
+        """
+        if format not in FORMATS:
+            raise ValueError(f'Unknown format "{format}"; should be one of {FORMATS}')
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self.goodput_window = goodput_window
+        self.transport = None  # The transport layer whose counters are reported
+        self.sink = None  # The output sink whose statistics are reported
+        self.ack_rtt = Histogram()
+        self.observation_latency = Histogram()
+        self.observations = 0
+        self.started = time.monotonic()
+        self._received = collections.deque()  # (time, payload bytes)
+        self._received_in_window = 0
+        self._last_written = self.started
+
+    def bind(self, transport_layer):
+        """Report the counters of the given transport layer (and its
+        packet layer)."""
+        self.transport = transport_layer
+
+    def bind_sink(self, sink):
+        """Report the statistics of the given output sink (see
+        control.sinks.OutputSink.stats)."""
+        self.sink = sink
+
+    def record_rtt(self, rtt):
+        self.ack_rtt.record(rtt)
+
+    def record_observation(self, n_bytes, latency):
+        """Record an observation of n_bytes payload bytes, which took
+        latency seconds to receive."""
+        now = time.monotonic()
+        self.observations += 1
+        self.observation_latency.record(latency)
+        self._received.append((now, n_bytes))
+        self._received_in_window += n_bytes
+        self._expire(now)
+
+    def _expire(self, now):
+        while self._received and self._received[0][0] < now - self.goodput_window:
+            self._received_in_window -= self._received.popleft()[1]
+
+    def goodput(self):
+        """Observation payload bytes per second received over the last
+        goodput_window seconds."""
+        now = time.monotonic()
+        self._expire(now)
+        window = min(self.goodput_window, now - self.started)
+        return self._received_in_window / window if window > 0 else 0.0
+
+    def snapshot(self):
+        """Return the current metrics as a dictionary."""
+        snapshot = {
+            "timestamp": time.time(),
+            "uptime": time.monotonic() - self.started,
+            "observations": self.observations,
+            "goodput": self.goodput(),
+            "ack_rtt": self.ack_rtt.to_dict(),
+            "observation_latency": self.observation_latency.to_dict(),
+        }
+        if self.transport is not None:
+            comms = self.transport
+            snapshot["transport"] = {
+                "payload_bytes_sent": comms.payload_sent,
+                "payload_bytes_received": comms.payload_received,
+                "wire_bytes_sent": comms.packet_layer.bytes_written,
+                "wire_bytes_received": comms.packet_layer.bytes_read,
+                "unexpected": comms.unexpected,
+                "ack_resends": comms.ack_resends,
+                "resends": comms.resends,
+                "failed_checksums": comms.failed_checksums,
+                "ack_timeouts": comms.ack_timeouts,
+                "rto": comms.rto,
+                "srtt": comms.srtt,
+            }
+        if self.sink is not None and self.sink.stats() is not None:
+            snapshot["sink"] = self.sink.stats()
+        return snapshot
+
+    def poll(self):
+        """Write a snapshot if a path was given and at least interval
+        seconds passed since the last one."""
+        if self.path is not None:
+            now = time.monotonic()
+            if now - self._last_written >= self.interval:
+                self._last_written = now
+                self.write()
+
+    def write(self, path=None):
+        """Write a snapshot to the given path (by default, self.path).
+        The file is replaced atomically, so readers never see a
+        partially written snapshot."""
+        path = self.path if path is None else path
+        snapshot = self.snapshot()
+        if self.format == "json":
+            text = json.dumps(snapshot, indent=2)
+        else:
+            text = to_prometheus(snapshot)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def __str__(self):
+        string = "METRICS"
+        string += "\n-------"
+        string += f"\n  observations = {self.observations}"
+        string += f"\n  goodput = {self.goodput():0.1f} bytes/s (last {self.goodput_window} s)"
+        for name, h in [
+            ("ACK round-trip time", self.ack_rtt),
+            ("observation latency", self.observation_latency),
+        ]:
+            if h.count > 0:
+                string += f"\n  {name}: mean = {h.sum / h.count * 1000:0.2f} ms, p50 <= {h.quantile(0.5) * 1000:0.2f} ms, p99 <= {h.quantile(0.99) * 1000:0.2f} ms"
+        if self.transport is not None:
+            comms = self.transport
+            wire = comms.packet_layer.bytes_written + comms.packet_layer.bytes_read
+            payload = comms.payload_sent + comms.payload_received
+            string += f"\n  bytes on the wire = {wire} ({payload} payload bytes)"
+        if self.sink is not None and self.sink.stats() is not None:
+            stats = self.sink.stats()
+            string += f"\n  sink queue: high-water mark = {stats['queue_high_water']} blocks, blocked for {stats['blocked_seconds']:0.3f} s"
+        return string
+
+
+def to_prometheus(snapshot, prefix="chamber_"):
+    """Format a snapshot (see Metrics.snapshot) in the Prometheus text
+    exposition format.
+
+    Examples
+    --------
+    >>> m = Metrics()
+    >>> m.record_rtt(0.002)
+    >>> print(to_prometheus(m.snapshot()), end="")
+    # TYPE chamber_uptime_seconds gauge
+    chamber_uptime_seconds ...
+    # TYPE chamber_observations_total counter
+    chamber_observations_total 0
+    # TYPE chamber_goodput_bytes_per_second gauge
+    chamber_goodput_bytes_per_second 0.0
+    # TYPE chamber_ack_rtt_seconds histogram
+    chamber_ack_rtt_seconds_bucket{le="0.0001"} 0
+    ...
+    chamber_ack_rtt_seconds_bucket{le="0.0032"} 1
+    ...
+    chamber_ack_rtt_seconds_bucket{le="+Inf"} 1
+    chamber_ack_rtt_seconds_sum 0.002
+    chamber_ack_rtt_seconds_count 1
+    # TYPE chamber_observation_latency_seconds histogram
+    ...
+    chamber_observation_latency_seconds_count 0
+
+    """
+    lines = []
+
+    def metric(name, kind, value):
+        lines.append(f"# TYPE {prefix}{name} {kind}")
+        lines.append(f"{prefix}{name} {value}")
+
+    metric("uptime_seconds", "gauge", snapshot["uptime"])
+    metric("observations_total", "counter", snapshot["observations"])
+    metric("goodput_bytes_per_second", "gauge", snapshot["goodput"])
+    for name in ["ack_rtt", "observation_latency"]:
+        histogram = snapshot[name]
+        full_name = f"{prefix}{name}_seconds"
+        lines.append(f"# TYPE {full_name} histogram")
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{full_name}_sum {histogram['sum']}")
+        lines.append(f"{full_name}_count {histogram['count']}")
+    if "transport" in snapshot:
+        for name, value in snapshot["transport"].items():
+            if name in ["rto", "srtt"]:
+                if value is not None:
+                    metric(f"{name}_seconds", "gauge", value)
+            else:
+                metric(f"{name}_total", "counter", value)
+    if "sink" in snapshot:
+        stats = snapshot["sink"]
+        metric("sink_queue_depth", "gauge", stats["queue_depth"])
+        metric("sink_queue_high_water", "gauge", stats["queue_high_water"])
+        metric("sink_blocked_seconds_total", "counter", stats["blocked_seconds"])
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
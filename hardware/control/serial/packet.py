@@ -20,31 +20,32 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import base64
-import enum
 from serial import SerialTimeoutException
+from control.serial.frame import FrameDecoder, FrameEncoder, START_SYMBOL, END_SYMBOL
+import control.serial.trace as trace
 
 """Implements the transmission of packets over the serial,
 i.e. encodes/decodes messages into base64 and sends/receives them
 using pythons pySerial. Corresponds to the Network layers and below of
-the OSI Model (pySerial would be the data link layer)"""
+the OSI Model (pySerial would be the data link layer). The framing
+itself is implemented in frame.py"""
 
 
-START_SYMBOL = b"\0"
-END_SYMBOL = b"\4"
 ARDUINO_BUFFER_SIZE = 64
 
 WRITE_TIMEOUT = 0.1  # 100 milliseconds
 
 
-class State(enum.Enum):
-    WAITING_FOR_START = 1
-    READING = 2
-    DATA_PARSED = 3
-
-
 class PacketLayer:
-    def __init__(self, ser, log_fun=print, verbose=0, discarded="warn"):
+    def __init__(
+        self,
+        ser,
+        log_fun=print,
+        verbose=0,
+        discarded="warn",
+        max_size=ARDUINO_BUFFER_SIZE,
+        tracer=None,
+    ):
         """
         Parameters
         ----------
@@ -63,12 +64,27 @@ class PacketLayer:
             What to do when bytes are received outside of a start/end
             symbol. "ignore" does nothing, "warn" logs a warning,
             "raise" raises an exception.
+        max_size : int or NoneType, default=ARDUINO_BUFFER_SIZE
+            The maximum size (in bytes) of an encoded packet that can
+            be sent. By default, the size of the arduino software
+            buffer; None means no limit.
+        tracer : control.serial.trace.Tracer or NoneType, default=None
+            Where to record the packets sent/received and the serial
+            reads. If None, no events are recorded.
 
         """
         # Set class attributes
         self.serial = ser
+        self.tracer = trace.DISABLED if tracer is None else tracer
         self.verbose = verbose
         self.discarded = discarded
+        self.encoder = FrameEncoder(max_size=max_size)
+        self.decoder = FrameDecoder()
+        self._timeout = ser.get_settings()["timeout"]
+        # Stats counters
+        self.read_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
 
         # Wrap log function to filter by verbosity
         def log(string, verbosity_level=0, **kwargs):
@@ -82,54 +98,74 @@ class PacketLayer:
 
     def send(self, data):
         """Encode and send a message to the board over serial"""
-        msg = START_SYMBOL + base64.b64encode(data) + END_SYMBOL
-        if len(msg) > ARDUINO_BUFFER_SIZE:
-            raise ValueError(
-                f"Attempting to send a packet which is larger ({len(msg)} > {ARDUINO_BUFFER_SIZE}) than the arduino software buffer size."
-            )
+        msg = self.encoder.encode(data)  # Raises ValueError if too large
         try:
             self.serial.write(msg)
             self.serial.flush()
+            self.bytes_written += len(msg)
         except SerialTimeoutException as e:
             self.log(f"Serial write timed out: {e}")
-        self.log(f'      SENT: "{data}"', 1)
-        self.log(f'      SENT (raw, {len(msg)} bytes): "{msg}"', 2)
+        if self.tracer.enabled:
+            self.tracer.record(trace.PACKET_SENT, n_bytes=len(msg))
+        if self.verbose >= 1:
+            self.log(f'      SENT: "{data}"', 1)
+            self.log(f'      SENT (raw, {len(msg)} bytes): "{msg}"', 2)
 
     def receive(self, timeout=None):
-        """Read and decode a message from the serial connection"""
+        """Read and decode a message from the serial connection.
+
+        All bytes waiting in the serial input buffer are read in a
+        single call and fed to the frame decoder. Bytes following the
+        end of a packet are kept in the decoder for the next call.
+
+        """
         self._set_timeout(timeout)
-        state = State.WAITING_FOR_START
-        msg = b""
-        discarded = b""
-        while state != State.DATA_PARSED:
-            byte = self.serial.read()
-            self.log(f"      byte={byte}", 3)
-            if len(byte) == 0:
+        while True:
+            # Raises binascii.Error if incorrectly padded
+            data = self.decoder.next_packet()
+            if data is not None:
+                break
+            # Read everything available, or block until one byte arrives
+            chunk = self.serial.read(max(1, self.serial.in_waiting))
+            self.read_calls += 1
+            self.bytes_read += len(chunk)
+            if len(chunk) == 0:
+                # Drop any partial frame, which would otherwise swallow
+                # the next one
+                self.decoder.drop_partial()
                 raise UserWarning(f"Packet reception timed out after {timeout} seconds")
-            if state == State.READING:
-                if byte == END_SYMBOL:
-                    state = State.DATA_PARSED
-                else:
-                    msg += byte
-            elif state == State.WAITING_FOR_START and byte == START_SYMBOL:
-                state = State.READING
-            else:
-                discarded += byte
-        self.log(f'      RECEIVED (raw, {len(msg)} bytes): "{msg}"', 2)
+            if self.tracer.enabled:
+                self.tracer.record(trace.SERIAL_READ, n_bytes=len(chunk))
+            if self.verbose >= 3:
+                self.log(f"      chunk={chunk}", 3)
+            self.decoder.feed(chunk)
         # Decide what to do with discarded bytes
+        discarded = self.decoder.pop_discarded()
         if len(discarded) > 0:
+            if self.tracer.enabled:
+                self.tracer.record(trace.BYTES_DISCARDED, n_bytes=len(discarded))
             warning = f"Unexpected bytes outside of message symbols: {discarded}"
             if self.discarded == "raise":
                 raise Exception(warning)
             elif self.discarded == "warn":
                 self.log(warning, 0)  # Always log independently of verbosity
-        # Return decoded message
-        data = base64.b64decode(msg)  # Raises binascii.Error if incorrectly padded
-        self.log(f'      RECEIVED: "{data}"', 1)
+        if self.tracer.enabled:
+            self.tracer.record(trace.PACKET_RECEIVED, n_bytes=len(data))
+        if self.verbose >= 1:
+            self.log(f'      RECEIVED: "{data}"', 1)
         return data
 
+    def bytes_per_read(self):
+        """Average number of bytes returned by each read call to the
+        serial object."""
+        return self.bytes_read / self.read_calls if self.read_calls > 0 else 0.0
+
     def _set_timeout(self, timeout):
-        """Set the read timeout of the serial connection"""
+        """Set the read timeout of the serial connection, if it differs
+        from the last one set"""
+        if timeout == self._timeout:
+            return
+        self._timeout = timeout
         settings = self.serial.get_settings()
         settings["timeout"] = timeout
         self.serial.apply_settings(settings)
@@ -141,3 +177,12 @@ class PacketLayer:
         settings["write_timeout"] = timeout
         self.serial.apply_settings(settings)
         self.log(f"  Changed write timeout to {timeout} seconds", 3)
+
+    def __str__(self):
+        string = "PACKET LAYER STATE"
+        string += "\n------------------"
+        string += f"\n  read calls = {self.read_calls}"
+        string += f"\n  bytes read = {self.bytes_read}"
+        string += f"\n  bytes written = {self.bytes_written}"
+        string += f"\n  bytes per read call = {self.bytes_per_read():0.2f}"
+        return string
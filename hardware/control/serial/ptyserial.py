@@ -0,0 +1,146 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import tty
+import time
+import fcntl
+import select
+import struct
+import termios
+
+"""Pseudo-terminal (POSIX only) on which a program can stand in for a
+board: the host opens the pty's port name with pySerial as it would
+open /dev/ttyACM0, and the stand-in reads/writes the other (master)
+end through a PtySerial object, which implements the subset of the
+pySerial interface used by the packet layer."""
+
+
+class PtySerial:
+    def __init__(self, timeout=None, write_timeout=None):
+        """Open a new pseudo-terminal; the host should connect to the
+        port self.port.
+
+        Examples
+        --------
+        >>> import serial
+        >>> board = PtySerial()
+        >>> host = serial.Serial(board.port, 500000, timeout=1)
+        >>> host.write(b"\\0hello\\4")
+        7
+        >>> board.read(7)
+        b'\\x00hello\\x04'
+        >>> board.write(b"\\4bye\\0")
+        5
+        >>> host.read(5)
+        b'\\x04bye\\x00'
+        >>> host.close(); board.close()
+
+        """
+        self.fd, self._slave_fd = os.openpty()
+        # No echo or special characters (e.g. EOT) on the line
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        buffer = fcntl.ioctl(self.fd, termios.FIONREAD, b"\0\0\0\0")
+        return struct.unpack("I", buffer)[0]
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        out = bytearray()
+        while len(out) < size:
+            remaining = (
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                break
+            # Raises OSError (EIO) once the host closed the port, after hangup()
+            out += os.read(self.fd, size - len(out))
+        return bytes(out)
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def get_settings(self):
+        return {"timeout": self.timeout, "write_timeout": self.write_timeout}
+
+    def apply_settings(self, settings):
+        self.timeout = settings.get("timeout", self.timeout)
+        self.write_timeout = settings.get("write_timeout", self.write_timeout)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def reset_output_buffer(self):
+        termios.tcflush(self.fd, termios.TCOFLUSH)
+
+    def setDTR(self, value=True):
+        pass
+
+    def hangup(self):
+        """Close this end's copy of the host's port, so that reads fail
+        (raise OSError) once the host closes the port too. Call it and
+        wait for any threads reading from this object to return before
+        calling close(), as the file descriptor may be reused."""
+        if self._slave_fd is not None:
+            os.close(self._slave_fd)
+            self._slave_fd = None
+
+    def close(self):
+        self.hangup()
+        if self.is_open:
+            os.close(self.fd)
+            self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
@@ -20,9 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import time
+import struct
 import binascii
 import enum
+import collections
 from numpy.random import default_rng
+import control.serial.trace as trace
 
 """Implements the transmission of segments over the serial with error
 control & acknowledgement. Would correspond to the Transport layer of
@@ -30,8 +34,23 @@ the OSI model. The next (lower) layer is implemented in packet.py"""
 
 MAX_INT = 2**32
 BYTE_ORDER = "little"
-# 200 milliseconds
+# Initial retransmission timeout (100 milliseconds), before any
+# round-trip time has been measured
 ACK_TIMEOUT = 0.1
+# Bounds for the retransmission timeout
+MIN_ACK_TIMEOUT = 0.005
+MAX_ACK_TIMEOUT = 2.0
+# Parameters of the round-trip time estimator (see RFC 6298)
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+CLOCK_GRANULARITY = 0.001
+
+# Segment layout: flags byte, sequence number and ack number (4 bytes
+# each, little endian), followed by the data and a CRC32 checksum of
+# all the preceding bytes
+HEADER = struct.Struct("<BII")
+CHECKSUM = struct.Struct("<I")
+OVERHEAD = HEADER.size + CHECKSUM.size
 
 # TODO: wrap around max int?
 
@@ -43,6 +62,8 @@ class State(enum.Enum):
 
 
 class Segment:
+    __slots__ = ("number", "ack_number", "ack", "syn", "data")
+
     def __init__(self, number, ack_number=0, ack=False, syn=False, data=b""):
         # Store class attributes
         if number < 0:
@@ -88,21 +109,37 @@ def encode(segment):
     #   0 - ACK
     #   1 - SYN
     flags = 1 * segment.ack + 2 * segment.syn
-    flags = flags.to_bytes(length=1, byteorder=BYTE_ORDER, signed=False)
-    # Sequence number bytes
-    number = segment.number.to_bytes(length=4, byteorder=BYTE_ORDER, signed=False)
-    # Ack number bytes
-    ack_number = segment.ack_number.to_bytes(
-        length=4, byteorder=BYTE_ORDER, signed=False
-    )
-    # Assemble
-    segment_bytes = flags + number + ack_number + segment.data
-    # Compute checksum
-    checksum = binascii.crc32(segment_bytes).to_bytes(
-        length=4, byteorder=BYTE_ORDER, signed=False
+    # Segments hold a single observation at most (~200 bytes), so two
+    # small concatenations are cheaper than HEADER.pack_into and a copy
+    # of the data into a reusable buffer (see benchmark_segment in
+    # control.serial.benchmark)
+    body = HEADER.pack(flags, segment.number, segment.ack_number) + segment.data
+    return body + CHECKSUM.pack(binascii.crc32(body))
+
+
+# Pre-encoded flags byte of an ACK segment and its checksum, from
+# which the checksum of the whole segment is continued
+_ACK_FLAGS = b"\x01"
+_ACK_FLAGS_CHECKSUM = binascii.crc32(_ACK_FLAGS)
+_ACK_NUMBERS = struct.Struct("<II")
+_ACK_TAIL = struct.Struct("<III")
+
+
+def encode_ack(number, ack_number):
+    """Encode an ACK segment without data; equivalent to, but faster
+    than, encode(Segment(number, ack_number, ack=True)).
+
+    Examples
+    --------
+    >>> encode_ack(3, 7) == encode(Segment(3, 7, ack=True))
+    True
+    >>> print(decode(encode_ack(4294967294, 12)))
+    <num=4294967294,ack_num=12,ACK=1,SYN=0,b''>
+    """
+    checksum = binascii.crc32(
+        _ACK_NUMBERS.pack(number, ack_number), _ACK_FLAGS_CHECKSUM
     )
-    segment_bytes += checksum
-    return segment_bytes
+    return _ACK_FLAGS + _ACK_TAIL.pack(number, ack_number, checksum)
 
 
 def decode(segment_bytes):
@@ -118,39 +155,113 @@ def decode(segment_bytes):
     Traceback (most recent call last):
     ...
     UserWarning: Received checksum "14103450" does not match computed one "2883007386"
+    >>> decode(b"abc")
+    Traceback (most recent call last):
+    ...
+    UserWarning: Received segment is too short (3 < 13 bytes)
 
     """
     # Check for errors
-    checksum = int.from_bytes(segment_bytes[-4:], byteorder=BYTE_ORDER, signed=False)
-    rest = segment_bytes[:-4]
-    computed_checksum = binascii.crc32(rest)
+    n_bytes = len(segment_bytes) - OVERHEAD
+    if n_bytes < 0:
+        raise UserWarning(
+            f"Received segment is too short ({len(segment_bytes)} < {OVERHEAD} bytes)"
+        )
+    (checksum,) = CHECKSUM.unpack_from(segment_bytes, HEADER.size + n_bytes)
+    computed_checksum = binascii.crc32(segment_bytes[: HEADER.size + n_bytes])
     if checksum != computed_checksum:
         raise UserWarning(
             f'Received checksum "{checksum}" does not match computed one "{computed_checksum}"'
         )
     # Cut into the appropriate pieces
-    flags = rest[0]
-    ack = flags & 1
-    syn = (flags >> 1) & 1
-    number = int.from_bytes(rest[1:5], byteorder=BYTE_ORDER, signed=False)
-    ack_number = int.from_bytes(rest[5:9], byteorder=BYTE_ORDER, signed=False)
-    data = rest[9:]
+    flags, number, ack_number = HEADER.unpack_from(segment_bytes)
+    data = bytes(segment_bytes[HEADER.size : HEADER.size + n_bytes])
+    return Segment(number, ack_number, flags & 1, (flags >> 1) & 1, data)
+
 
-    return Segment(number, ack_number, ack, syn, data)
+def distance(a, b):
+    """Number of steps from sequence number a to b, taking into
+    account the wrap-around at MAX_INT.
+
+    Examples
+    --------
+    >>> distance(3, 5)
+    2
+    >>> distance(MAX_INT - 1, 1)
+    2
+    """
+    return (b - a) % MAX_INT
 
 
 class TransportLayer:
-    def __init__(self, packet_layer, log_fun=print, verbose=0):
+    def __init__(
+        self,
+        packet_layer,
+        log_fun=print,
+        verbose=0,
+        window_size=1,
+        tracer=None,
+        metrics=None,
+    ):
+        """
+        Parameters
+        ----------
+        packet_layer : control.serial.packet.PacketLayer
+            The layer used to send/receive the encoded segments.
+        log_fun : function, default=print
+            The function used to log any debug messages, must take a
+            string as first argument.
+        verbose : int
+            Verbosity of the debug traces: 0 - only unexpected
+            segments, 1 - timeouts and decoding errors, 2 - all
+            segments sent/received.
+        window_size : int, default=1
+            The maximum number of segments that can be sent without
+            being acknowledged. With 1 (the default), every segment
+            is acknowledged before the next one is sent
+            (stop-and-wait). For larger windows, segments are
+            pipelined and acknowledged cumulatively, and a timeout
+            resends all unacknowledged segments (Go-Back-N). Both
+            ends of the link must use the same mode (see
+            Board.__init__).
+        tracer : control.serial.trace.Tracer or NoneType, default=None
+            Where to record the segments sent/received, timeouts and
+            errors. If None, no events are recorded.
+        metrics : control.serial.metrics.Metrics or NoneType, default=None
+            Where to record the measured ACK round-trip times; it
+            also reports the layer's counters (see Metrics.bind).
+
+        """
+        if window_size < 1:
+            raise ValueError("window_size should be at least 1")
         self.packet_layer = packet_layer
+        self.tracer = trace.DISABLED if tracer is None else tracer
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.bind(self)
         self.last_acknowledged = 4294967295 - 1
         self.last_delivered = 4294967295 - 1
         self.verbose = verbose
+        self.window_size = window_size
+        # State for the windowed mode
+        self.last_sent = self.last_delivered
+        self._unacked = collections.deque()  # Sent but not acknowledged
+        self._received = collections.deque()  # Received but not returned
+        self._timer = None  # When the oldest unacknowledged segment was sent
+        self._rtt_probe = None  # (number, send time) of the segment being timed
+        # Round-trip time estimation
+        self.srtt = None
+        self.rttvar = None
+        self.rto = ACK_TIMEOUT
         # Stats counters
         self.unexpected = 0
         self.ack_resends = 0
         self.resends = 0
         self.failed_checksums = 0
         self.ack_timeouts = 0
+        # Data bytes sent/received, without counting retransmissions
+        self.payload_sent = 0
+        self.payload_received = 0
 
         # Wrap log function to filter by verbosity
         def log(string, verbosity_level=1, **kwargs):
@@ -161,88 +272,385 @@ class TransportLayer:
 
     def _send(self, segment):
         self.packet_layer.send(encode(segment))
-        self.log(f"  SENT segment: {segment}", 2)
+        if self.tracer.enabled:
+            self.tracer.record(
+                trace.SEGMENT_SENT,
+                segment.number,
+                segment.ack_number,
+                len(segment.data),
+            )
+        if self.verbose >= 2:
+            self.log(f"  SENT segment: {segment}", 2)
+
+    def _send_ack(self, ack_number):
+        self.packet_layer.send(encode_ack(self.last_delivered, ack_number))
+        if self.tracer.enabled:
+            self.tracer.record(trace.ACK_SENT, self.last_delivered, ack_number)
+        if self.verbose >= 2:
+            self.log(f"  SENT ACK: <num={self.last_delivered},ack_num={ack_number}>", 2)
 
     def _receive(self, timeout=None):
         try:
             packet = self.packet_layer.receive(timeout)
-            segment = decode(packet)
-            self.log(f"  RECEIVED segment: {segment}", 2)
-            return segment
         except UserWarning as e:  # Timed-out
-            self.log(f"  {e}", 1)
+            self._receive_failed(e)
             return None
         except binascii.Error as e:  # Could not decode base64
-            self.log(f"Error decoding packet:  {e}", 1)
+            self._receive_failed(f"Error decoding packet:  {e}")
+            return None
+        return self._decode(packet)
+
+    def _decode(self, packet):
+        try:
+            segment = decode(packet)
+        except UserWarning as e:  # Checksum failed
+            self._receive_failed(e)
             return None
+        if self.tracer.enabled:
+            self.tracer.record(
+                trace.SEGMENT_RECEIVED,
+                segment.number,
+                segment.ack_number,
+                len(segment.data),
+            )
+        if self.verbose >= 2:
+            self.log(f"  RECEIVED segment: {segment}", 2)
+        return segment
+
+    def resync(self, last_delivered, last_acknowledged=None, attempts=3):
+        """Resume a session with the other end, in which the last
+        segment this end delivered had number last_delivered, without
+        delivering any data: that segment is sent again (empty), which
+        the other end acknowledges again if it is still in the same
+        session; the acknowledgement carries the number of the last
+        segment it sent. Return True if the sequence numbers were
+        resynchronized, False if there was no answer after the given
+        number of attempts (the state of this end is not changed).
+
+        If given, last_acknowledged is the number of the last segment
+        this end acknowledged in the session. It is kept, rather than
+        taken from the other end's answer: acknowledgements still in
+        flight when the session ended (e.g. flushed with the port's
+        buffers) may not have reached the other end, which then
+        resends those segments; they are acknowledged again instead
+        of being delivered twice.
+
+        Examples
+        --------
+        >>> import threading
+        >>> from control.serial.loopback import loopback_pair
+        >>> from control.serial.packet import PacketLayer
+        >>> host_serial, board_serial = loopback_pair()
+        >>> host = TransportLayer(PacketLayer(host_serial))
+        >>> board = TransportLayer(PacketLayer(board_serial))
+        >>> def run_board():
+        ...     board.send(board.receive())
+        ...     board.receive()  # Resyncs are acknowledged but not delivered
+        >>> thread = threading.Thread(target=run_board)
+        >>> thread.start()
+        >>> host.send(b"echo"); host.receive()
+        b'echo'
+        >>> number = host.last_delivered
+        >>> host = TransportLayer(PacketLayer(host_serial))  # A new session
+        >>> host.resync(number - 1, attempts=1)
+            unexpected segment: <num=4294967294,ack_num=0,ACK=0,SYN=0,b''>
+        False
+        >>> host.resync(number)
+        True
+        >>> host.last_acknowledged == board.last_delivered
+        True
+        >>> host.send(b"bye"); thread.join()
+
+        """
+        probe = Segment(number=last_delivered)
+        for _ in range(attempts):
+            self._send(probe)
+            deadline = time.monotonic() + self.rto
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                reply = self._receive(timeout=remaining)
+                if (
+                    reply is not None
+                    and reply.ack
+                    and reply.ack_number == last_delivered
+                ):
+                    self.last_delivered = last_delivered
+                    self.last_acknowledged = (
+                        reply.number if last_acknowledged is None else last_acknowledged
+                    )
+                    self._set_window_size(self.window_size)
+                    return True
+        return False
+
+    def _receive_failed(self, error):
+        if self.tracer.enabled:
+            self.tracer.record(trace.RECEIVE_FAILED)
+        self.log(f"  {error}", 1)
 
     def send(self, data):
+        """Send data to the other end. In stop-and-wait mode, block
+        until it is acknowledged; in windowed mode, only until there
+        is room in the window (see flush)."""
         if type(data) == str:
             data = data.encode()
+        if self.window_size > 1:
+            return self._send_windowed(data)
         # Encode into segment
         segment_to_send = Segment(number=(self.last_delivered + 1) % MAX_INT, data=data)
         # Send & acknowledgement
         acknowledged = False
+        transmissions = 0
         while not acknowledged:
             self._send(segment_to_send)
-            try:
-                reply = self._receive(timeout=ACK_TIMEOUT)
-                if reply is None:
-                    # i.e. checksum failed
-                    self.failed_checksums += 1
-                elif reply.ack and reply.ack_number == segment_to_send.number:
-                    # Received acknowledgement
-                    self.last_delivered = segment_to_send.number
-                    self.resends += 1
-                    acknowledged = True
-                elif not reply.ack and reply.number == self.last_acknowledged:
-                    # Reply was repetition of an already acknowledged segment; resend the acknowledgement
-                    ack_segment = Segment(
-                        self.last_delivered, self.last_acknowledged, ack=True
-                    )
-                    self._send(ack_segment)
-                    self.ack_resends += 1
-                else:
-                    # Unexpected segment
-                    self.unexpected += 1
-                    self.log(f"    unexpected segment: {reply}", 0)
-            except UserWarning as e:
-                self.log(f"    ACK reception timed out: {e}", 1)
-                self.ack_timeouts += 1
-        self.resends -= 1
-
-    def receive(self):
-        acknowledged = False
-        while not acknowledged:
-            segment = self._receive()
-            if segment is None:
-                pass
-            elif (
-                not segment.ack
-                and segment.number == (self.last_acknowledged + 1) % MAX_INT
-            ):
-                # The expected case: we receive a segment with the
-                # number following our last acknowledgement
-                ack_segment = Segment(self.last_delivered, segment.number, ack=True)
-                self._send(ack_segment)
-                self.last_acknowledged = (self.last_acknowledged + 1) % MAX_INT
-                acknowledged = True
-                # Return data
+            sent_at = time.monotonic()
+            transmissions += 1
+            # Wait for the acknowledgement until the timeout expires;
+            # other replies do not trigger a resend, as resending on
+            # a stale ACK would cause another stale ACK
+            while not acknowledged:
+                remaining = sent_at + self.rto - time.monotonic()
+                if remaining <= 0:
+                    self._timed_out()
+                    break
+                reply = self._receive(timeout=remaining)
+                acknowledged = self._handle_reply(
+                    reply, segment_to_send, sent_at, transmissions
+                )
+        self.resends += transmissions - 1
+        self.payload_sent += len(data)
+
+    def receive(self, timeout=None):
+        """Block until the next segment from the other end is received,
+        acknowledge it and return its data. If a timeout (in seconds) is
+        given, return None if no segment is received in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.window_size > 1:
+            return self._receive_windowed(deadline)
+        while True:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                return None
+            segment = self._receive(timeout=remaining)
+            if self._handle_segment(segment):
                 return segment.data
-            elif not segment.ack and segment.number == self.last_acknowledged:
-                # We receive a segment which we already acknowledged,
-                # i.e. the previous acknowledgement was lost. Resend
-                # it.
-                ack_segment = Segment(self.last_delivered, segment.number, ack=True)
-                self._send(ack_segment)
-                self.ack_resends += 1
-            else:
-                self.unexpected += 1
-                self.log(f"    unexpected segment {segment}", 0)
+
+    def _handle_reply(self, reply, segment_to_send, sent_at, transmissions):
+        """Process the reply received after sending a segment in
+        stop-and-wait mode; return True if it acknowledges the
+        segment."""
+        if reply is None:
+            if time.monotonic() - sent_at < self.rto:
+                # i.e. checksum failed, rather than timed out
+                self.failed_checksums += 1
+        elif reply.ack and reply.ack_number == segment_to_send.number:
+            # Received acknowledgement; only segments which were not
+            # resent give unambiguous round-trip times
+            if transmissions == 1:
+                self._update_rtt(time.monotonic() - sent_at)
+            self.last_delivered = segment_to_send.number
+            return True
+        elif reply.ack and reply.ack_number == self.last_delivered:
+            # A repeated acknowledgement of the previous segment, e.g.
+            # after a timeout resent it; nothing to do
+            self.log(f"    repeated ACK: {reply}", 1)
+        elif not reply.ack and reply.number == self.last_acknowledged:
+            # Reply was repetition of an already acknowledged segment; resend the acknowledgement
+            self._send_ack(self.last_acknowledged)
+            self.ack_resends += 1
+        else:
+            # Unexpected segment
+            self._unexpected(reply)
+        return False
+
+    def _handle_segment(self, segment):
+        """Process a segment received in stop-and-wait mode; return True
+        if it is the next expected segment (which is acknowledged)."""
+        if segment is None:
+            pass
+        elif (
+            not segment.ack and segment.number == (self.last_acknowledged + 1) % MAX_INT
+        ):
+            # The expected case: we receive a segment with the
+            # number following our last acknowledgement
+            self._send_ack(segment.number)
+            self.last_acknowledged = (self.last_acknowledged + 1) % MAX_INT
+            self.payload_received += len(segment.data)
+            return True
+        elif not segment.ack and segment.number == self.last_acknowledged:
+            # We receive a segment which we already acknowledged,
+            # i.e. the previous acknowledgement was lost. Resend
+            # it.
+            self._send_ack(segment.number)
+            self.ack_resends += 1
+        else:
+            self._unexpected(segment)
+        return False
+
+    def _unexpected(self, segment):
+        self.unexpected += 1
+        if self.tracer.enabled:
+            self.tracer.record(
+                trace.UNEXPECTED_SEGMENT,
+                segment.number,
+                segment.ack_number,
+                len(segment.data),
+            )
+        self.log(f"    unexpected segment: {segment}", 0)
+
+    # ------------------------------------------------------------------
+    # Windowed (Go-Back-N) mode
+
+    def flush(self):
+        """Block until all sent segments have been acknowledged."""
+        while len(self._unacked) > 0:
+            self._poll()
+
+    def set_window_size(self, window_size):
+        """Change the window size, once all sent segments have been
+        acknowledged."""
+        if window_size < 1:
+            raise ValueError("window_size should be at least 1")
+        self.flush()
+        self._set_window_size(window_size)
+
+    def _set_window_size(self, window_size):
+        self.last_sent = self.last_delivered
+        self.window_size = window_size
+
+    def _send_windowed(self, data):
+        while len(self._unacked) >= self.window_size:
+            self._poll()
+        self._send_next(data)
+
+    def _receive_windowed(self, deadline=None):
+        while len(self._received) == 0:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                return None
+            self._poll(deadline)
+        return self._received.popleft()
+
+    def _poll(self, deadline=None):
+        """Receive and process one segment, waiting at most until the
+        deadline (see time.monotonic) if one is given. If the oldest
+        sent segment has not been acknowledged in time, resend all the
+        segments in the window instead."""
+        timeout = self._window_timeout()
+        if timeout is not None and timeout <= 0:
+            self._resend_window()
+        else:
+            timeout = self._earliest(timeout, self._remaining(deadline))
+            self._handle_windowed(self._receive(timeout=timeout))
+
+    def _send_next(self, data):
+        """Send data in the next segment of the window."""
+        segment = Segment(number=(self.last_sent + 1) % MAX_INT, data=data)
+        self.last_sent = segment.number
+        if len(self._unacked) == 0:
+            self._timer = time.monotonic()
+        if self._rtt_probe is None:
+            self._rtt_probe = (segment.number, time.monotonic())
+        self._unacked.append(segment)
+        self.payload_sent += len(data)
+        self._send(segment)
+
+    def _window_timeout(self):
+        """Seconds left until the oldest unacknowledged segment times
+        out, or None if there are no unacknowledged segments."""
+        if len(self._unacked) == 0:
+            return None
+        return self._timer + self.rto - time.monotonic()
+
+    @staticmethod
+    def _remaining(deadline):
+        """Seconds left until a deadline (see time.monotonic), or None if
+        there is no deadline."""
+        return None if deadline is None else deadline - time.monotonic()
+
+    @staticmethod
+    def _earliest(timeout, remaining):
+        """The shortest of two timeouts (in seconds), either of which can
+        be None (no timeout)."""
+        if remaining is None:
+            return timeout
+        remaining = max(0.0, remaining)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _resend_window(self):
+        self._timed_out()
+        self._rtt_probe = None  # Resent segments can't be timed
+        self.resends += len(self._unacked)
+        for segment in self._unacked:
+            self._send(segment)
+        self._timer = time.monotonic()
+
+    def _handle_windowed(self, segment):
+        """Process a segment received in windowed mode."""
+        if segment is None:
+            # i.e. timed out or checksum failed
+            return
+        elif segment.ack:
+            # Cumulative acknowledgement of all segments up to ack_number
+            acknowledged = distance(self.last_delivered, segment.ack_number)
+            if 0 < acknowledged <= len(self._unacked):
+                if self._rtt_probe is not None:
+                    number, sent_at = self._rtt_probe
+                    if distance(self.last_delivered, number) <= acknowledged:
+                        self._update_rtt(time.monotonic() - sent_at)
+                        self._rtt_probe = None
+                for _ in range(acknowledged):
+                    self._unacked.popleft()
+                self.last_delivered = segment.ack_number
+                self._timer = time.monotonic()
+        elif segment.number == (self.last_acknowledged + 1) % MAX_INT:
+            # The next segment in order: deliver and acknowledge it
+            self._received.append(segment.data)
+            self.payload_received += len(segment.data)
+            self.last_acknowledged = segment.number
+            self._send_ack(segment.number)
+        else:
+            # A repeated or out-of-order segment (i.e. a previous one
+            # was lost): repeat the acknowledgement of the last
+            # segment received in order
+            self._send_ack(self.last_acknowledged)
+            self.ack_resends += 1
+
+    # ------------------------------------------------------------------
+    # Retransmission timeout
+
+    def _update_rtt(self, rtt):
+        """Update the smoothed round-trip time and its variation with a
+        new measurement, and compute the retransmission timeout from
+        them (see RFC 6298)."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        rto = self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)
+        self.rto = min(max(rto, MIN_ACK_TIMEOUT), MAX_ACK_TIMEOUT)
+        if self.metrics is not None:
+            self.metrics.record_rtt(rtt)
+
+    def _timed_out(self):
+        """Double the retransmission timeout after it expired."""
+        self.log(f"    ACK reception timed out after {self.rto} seconds", 1)
+        self.ack_timeouts += 1
+        self.rto = min(2 * self.rto, MAX_ACK_TIMEOUT)
+        if self.tracer.enabled:
+            self.tracer.record(trace.ACK_TIMEOUT, int(self.rto * 1e6))
 
     def __str__(self):
         string = "TRANSPORT LAYER STATE"
-        string += "n---------------------"
+        string += "\n---------------------"
+        string += f"\n  window size = {self.window_size}"
+        if self.srtt is None:
+            string += f"\n  retransmission timeout = {self.rto * 1000:0.2f} ms (no RTT measured)"
+        else:
+            string += f"\n  retransmission timeout = {self.rto * 1000:0.2f} ms (smoothed RTT = {self.srtt * 1000:0.2f} ms, RTT variation = {self.rttvar * 1000:0.2f} ms)"
         string += f"\n  last delivered sequence number = {self.last_delivered}"
         string += f"\n  last acknowledged sequence number = {self.last_acknowledged}"
         string += f"\n  unexpected segments = {self.unexpected}"
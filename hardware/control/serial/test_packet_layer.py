@@ -21,12 +21,23 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import serial
+import os
+import binascii
+import threading
+import timeit
+import pytest
 from control.serial.packet import PacketLayer
-import time
-import base64
+from control.serial.loopback import loopback_pair
 
-lines = [
+"""Tests and throughput benchmark of the packet layer, run over an
+in-memory serial link (see loopback.py) with the other end echoing the
+packets it receives, as the board's test firmware did. Run with
+
+  python -m pytest -s control/serial/test_packet_layer.py
+
+from the hardware/ directory (-s shows the benchmark results)."""
+
+poem = [
     "I like to think (and",
     "the sooner the better!)",
     "of a cybernetic meadow",
@@ -44,17 +55,111 @@ lines = [
     "past computers",
     "as if they were flowers",
     "with spinning blossoms.",
-] * 100
+]
+lines = poem * 10
+
+
+def echo(port, n):
+    """Echo n packets received on port."""
+    layer = PacketLayer(port, max_size=None)
+    for _ in range(n):
+        layer.send(layer.receive())
 
-with serial.Serial("/dev/ttyACM0", 500000, timeout=None) as ser:
-    ser.reset_input_buffer()
-    ser.reset_output_buffer()
 
-    layer = PacketLayer(ser, verbose=3)
-    print(ser.read(1))
+def start_echo(port, n):
+    thread = threading.Thread(target=echo, args=(port, n), daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("baud_rate", [None, 500000])
+def test_echo(baud_rate):
+    host, board = loopback_pair(baud_rate)
+    thread = start_echo(board, len(lines))
+    layer = PacketLayer(host)
     for line in lines:
-        print()
         layer.send(line.encode())
-        response = layer.receive()
-        assert response == line.encode()
-        # time.sleep(0.1)
+        assert layer.receive() == line.encode()
+    thread.join()
+    assert layer.decoder.packets == len(lines)
+
+
+def test_max_size():
+    host, _ = loopback_pair()
+    layer = PacketLayer(host)
+    layer.send(b"x" * 45)  # 62 bytes once encoded
+    with pytest.raises(ValueError):
+        layer.send(b"x" * 48)
+
+
+def test_timeout():
+    host, board = loopback_pair()
+    with pytest.raises(UserWarning):
+        PacketLayer(host).receive(timeout=0.01)
+    # A partial frame is dropped when the reception times out
+    layer = PacketLayer(host)
+    board.write(b"\0dGVz")
+    with pytest.raises(UserWarning):
+        layer.receive(timeout=0.01)
+    board.write(b"\0dGVzdA==\4")
+    assert layer.receive(timeout=1) == b"test"
+
+
+def test_discarded():
+    host, board = loopback_pair()
+    board.write(b"noise\0dGVzdA==\4")
+    assert PacketLayer(host, discarded="ignore").receive() == b"test"
+    board.write(b"noise\0dGVzdA==\4")
+    with pytest.raises(Exception, match="outside of message symbols"):
+        PacketLayer(host, discarded="raise").receive()
+
+
+def test_corruption():
+    # Corrupted frames are either dropped, fail to decode or are
+    # received with different contents; the layer never blocks
+    host, board = loopback_pair(corruption=0.01, seed=1)
+    packets = [os.urandom(32) for _ in range(500)]
+    sender = PacketLayer(board, max_size=None)
+    for packet in packets:
+        sender.send(packet)
+    layer = PacketLayer(host, discarded="ignore")
+    received = 0
+    errors = 0
+    while True:
+        try:
+            packet = layer.receive(timeout=0.05)
+            received += packet in packets
+        except binascii.Error:
+            errors += 1
+        except UserWarning:  # Timed out: no more packets
+            break
+    assert 0 < received < len(packets)
+    assert errors > 0
+    assert board._tx.bytes_corrupted > 0
+
+
+def test_throughput():
+    """Benchmark: packets/s for a stream of observation-sized packets,
+    and for echoed packets (i.e. one round trip per packet)."""
+    n = 5000
+    host, board = loopback_pair()
+    packet = os.urandom(176)
+    sender = PacketLayer(board, max_size=None)
+    receiver = PacketLayer(host)
+    start = timeit.default_timer()
+    for _ in range(n):
+        sender.send(packet)
+    for _ in range(n):
+        assert receiver.receive() == packet
+    stream_rate = n / (timeit.default_timer() - start)
+
+    n_echo = 1000
+    thread = start_echo(board, n_echo)
+    start = timeit.default_timer()
+    for _ in range(n_echo):
+        receiver.send(b"x" * 32)
+        receiver.receive()
+    echo_rate = n_echo / (timeit.default_timer() - start)
+    thread.join()
+    print(f"\nPACKET LAYER: {stream_rate:0.0f} packets/s (stream of 176-byte packets)")
+    print(f"PACKET LAYER: {echo_rate:0.0f} packets/s (echoed 32-byte packets)")
@@ -21,105 +21,128 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import serial
+import os
+import threading
+import timeit
+import pytest
 from control.serial.packet import PacketLayer
 import control.serial.segment as segment
-import timeit
-import base64
-import numpy as np
-import os
+from control.serial.loopback import loopback_pair
+from control.serial.test_packet_layer import lines
+
+# Roughly 1 in 10 observation-sized frames is damaged
+LOSSY = {"loss": 0.0003, "corruption": 0.0003}
+
+"""Tests and throughput benchmark of the transport layer, run over an
+in-memory serial link (see loopback.py), clean or with bytes dropped
+and corrupted at random. Run with
+
+  python -m pytest -s control/serial/test_segment_layer.py
+
+from the hardware/ directory (-s shows the benchmark results)."""
+
+
+def transport_pair(window_size=1, **link):
+    host, board = loopback_pair(**link)
+    return (
+        segment.TransportLayer(
+            PacketLayer(host, max_size=None, discarded="ignore"),
+            verbose=-1,
+            window_size=window_size,
+        ),
+        segment.TransportLayer(
+            PacketLayer(board, max_size=None, discarded="ignore"),
+            verbose=-1,
+            window_size=window_size,
+        ),
+    )
+
+
+def echo(layer, n):
+    """Echo n segments received on the transport layer."""
+    for _ in range(n):
+        layer.send(layer.receive())
+    # In windowed mode, wait until the last segments are acknowledged
+    layer.flush()
 
-lines = [
-    "I like to think (and",
-    "the sooner the better!)",
-    "of a cybernetic meadow",
-    "where mammals and computers",
-    "live together in mutually",
-    "programming harmony",
-    "like pure water",
-    "touching clear sky.",
-    "",
-    "I like to think",
-    "(right now, please!)",
-    "of a cybernetic forest",
-    "filled with pines and electronics",
-    "where deer stroll peacefully",
-    "past computers",
-    "as if they were flowers",
-    "with spinning blossoms.",
-] * 100
-
-a = 12314081
-
-segments = [
-    segment.Segment(11, 10, ack=True, data=b"test"),
-    segment.Segment(10, ack=True, data=b"test"),
-    segment.Segment(3),
-    segment.Segment(3),
-    segment.Segment(11, 10, ack=True, data=b"also a test"),
-    segment.Segment(
-        11, 10, ack=True, data=a.to_bytes(length=4, byteorder="little", signed=False)
-    ),
-]
-
-n_bytes = 1
-N = 1024
-sent_data = [os.urandom(n_bytes) for _ in range(N)]
-with serial.Serial("/dev/ttyACM0", 1000000, timeout=None) as ser:
-    print("PORT OPEN")
-
-    ser.reset_input_buffer()
-    ser.reset_output_buffer()
-
-    # Send reset signal to arduino
-    ser.setDTR(False)
-    ser.setDTR(True)
-
-    layer = PacketLayer(ser, verbose=0)
-    transport_layer = segment.TransportLayer(layer, verbose=2)
-    print(ser.read(1))
-    start = timeit.default_timer()
-    # Echo test
-    # for seg in segments:
-    #     b = segment.encode(seg)
-    #     layer.send(b)
-    #     csum = b"v\xd6\xee\xc1"
-    #     print(f"Sent checksum: {int.from_bytes(csum, byteorder='little')}")
-    #     response = layer.receive()
-    #     print(seg)
-    #     print(segment.decode(response))
-    #     assert str(seg) == str(segment.decode(response))
-    # # Reception & acknowledgement test
-    # while True:
-    #     print(
-    #         f"STATE: num={transport_layer.last_delivered}, ack_num={transport_layer.last_acknowledged}"
-    #     )
-    #     msg = transport_layer.receive()
-    #     print(msg)
-    # Duplex test
-    # Send numbers
-
-    # print("SENDING BYTE STRINGS")
-    # for i, data in enumerate(sent_data):
-    #     transport_layer.send(data)
-    #     print("sent", i, data)
-    # # Receive them back
-    # print("RECEIVING BYTE STRINGS")
-    # for i, sent in enumerate(sent_data):
-    #     data = transport_layer.receive()
-    #     rec_n = int.from_bytes(data, byteorder="little", signed=False)
-    #     # print(i, ":", sent, data)
-    #     assert sent == data
 
+@pytest.mark.parametrize(
+    "segments",
+    [
+        segment.Segment(11, 10, ack=True, data=b"test"),
+        segment.Segment(10, ack=True, data=b"test"),
+        segment.Segment(3),
+        segment.Segment(segment.MAX_INT - 1, 11, syn=True, data=os.urandom(200)),
+    ],
+)
+def test_codec(segments):
+    decoded = segment.decode(segment.encode(segments))
+    assert str(decoded) == str(segments)
+
+
+def test_checksum():
+    encoded = bytearray(segment.encode(segment.Segment(3, data=b"test")))
+    encoded[10] ^= 1
+    with pytest.raises(UserWarning, match="checksum"):
+        segment.decode(bytes(encoded))
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+@pytest.mark.parametrize(
+    "link",
+    [{}, {"latency": 0.001}, dict(LOSSY, seed=7)],
+    ids=["clean", "latency", "lossy"],
+)
+def test_echo(window_size, link):
+    host, board = transport_pair(window_size, **link)
+    thread = threading.Thread(target=echo, args=(board, len(lines)), daemon=True)
+    thread.start()
     for line in lines:
-        print(len(line), line.encode())
-        try:
-            transport_layer.send(line.encode())
-        except Exception as e:
-            print(e)
-            continue
-        reply = transport_layer.receive().decode()
-        print(len(reply), reply.encode())
-        assert line == reply
-    print(transport_layer)
-    print(f"{timeit.default_timer() - start} seconds")
+        host.send(line.encode())
+        assert host.receive() == line.encode()
+    if "loss" not in link:
+        thread.join()
+        assert host.unexpected == 0
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+def test_lossy_stream(window_size):
+    # All segments are delivered once and in order, despite loss and
+    # corruption
+    host, board = transport_pair(window_size, seed=3, **LOSSY)
+    data = [os.urandom(176) for _ in range(300)]
+
+    def send():
+        for d in data:
+            board.send(d)
+        board.flush()
+
+    threading.Thread(target=send, daemon=True).start()
+    for d in data:
+        assert host.receive() == d
+    assert board.resends > 0
+
+
+def test_throughput():
+    """Benchmark: segments/s for a stream of observation-sized segments
+    (one ACK each), for stop-and-wait and windowed transport."""
+    n = 2000
+    print()
+    for window_size in [1, 8]:
+        host, board = transport_pair(window_size)
+        data = os.urandom(176)
+
+        def send():
+            for _ in range(n):
+                board.send(data)
+
+        thread = threading.Thread(target=send, daemon=True)
+        start = timeit.default_timer()
+        thread.start()
+        for _ in range(n):
+            assert host.receive() == data
+        rate = n / (timeit.default_timer() - start)
+        thread.join()
+        print(
+            f"TRANSPORT LAYER: {rate:0.0f} segments/s (window size {window_size}, 176-byte segments)"
+        )
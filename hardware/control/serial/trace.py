@@ -0,0 +1,186 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import struct
+import argparse
+import numpy as np
+
+"""Structured tracing of the communication with the board, shared by
+the packet layer, the transport layer and the Board class. Events are
+not formatted when they happen; they are stored as fixed-size binary
+records in a ring buffer, which can be dumped to a file after a run and
+formatted with
+
+  python -m control.serial.trace <file>
+
+from the hardware/ directory. Each layer checks `tracer.enabled` before
+recording an event, so a disabled tracer costs a single branch."""
+
+# Record layout: monotonic time (ns), event id, sequence number, ack
+# number and byte count
+RECORD = struct.Struct("<qHIII")
+_pack_into = RECORD.pack_into
+_RECORD_SIZE = RECORD.size
+_monotonic_ns = time.monotonic_ns
+DTYPE = np.dtype(
+    [
+        ("time_ns", "<i8"),
+        ("event", "<u2"),
+        ("number", "<u4"),
+        ("ack_number", "<u4"),
+        ("n_bytes", "<u4"),
+    ]
+)
+
+# Packet layer events
+PACKET_SENT = 1  # n_bytes: size of the encoded frame
+PACKET_RECEIVED = 2  # n_bytes: size of the decoded packet
+SERIAL_READ = 3  # n_bytes: size of the chunk read
+BYTES_DISCARDED = 4  # n_bytes: bytes received outside of a frame
+# Transport layer events
+SEGMENT_SENT = 10  # number, ack_number, n_bytes: size of the data
+ACK_SENT = 11  # number, ack_number
+SEGMENT_RECEIVED = 12  # number, ack_number, n_bytes: size of the data
+RECEIVE_FAILED = 13  # timed out, base64 or checksum error
+ACK_TIMEOUT = 14  # number: the new retransmission timeout (us)
+UNEXPECTED_SEGMENT = 15  # number, ack_number, n_bytes
+# Board events
+MEASUREMENTS_STARTED = 20  # number: observations requested
+OBSERVATION_RECEIVED = 21  # number: observation counter, n_bytes
+MEASUREMENTS_DONE = 22  # number: observations received
+VARIABLE_SET = 23  # number: index of the variable in Board.variables
+SET_SKIPPED = 24  # number: index of the variable in Board.variables
+WAIT_STARTED = 25  # number: duration of the WAIT (ms)
+
+EVENT_NAMES = {
+    value: name
+    for name, value in list(globals().items())
+    if name.isupper() and not name.startswith("_") and isinstance(value, int)
+}
+
+
+class Tracer:
+    def __init__(self, size=65536):
+        """Ring buffer holding the last `size` events; older events are
+        overwritten. A tracer with size 0 is disabled.
+
+        Examples
+        --------
+        >>> tracer = Tracer(size=2)
+        >>> tracer.record(SEGMENT_SENT, 1, 0, 176)
+        >>> tracer.record(ACK_SENT, 0, 1)
+        >>> tracer.record(SEGMENT_SENT, 2, 0, 176)
+        >>> tracer.dropped
+        1
+        >>> events = tracer.events()
+        >>> [EVENT_NAMES[e] for e in events["event"]]
+        ['ACK_SENT', 'SEGMENT_SENT']
+        >>> print(format_events(events))
+        0.000000 ACK_SENT number=0 ack_number=1 n_bytes=0
+        0.0... SEGMENT_SENT number=2 ack_number=0 n_bytes=176
+        >>> Tracer(size=0).enabled
+        False
+
+        """
+        self.size = size
+        self.enabled = size > 0
+        self.buffer = bytearray(size * RECORD.size)
+        self.recorded = 0  # Total number of events recorded
+
+    def record(self, event, number=0, ack_number=0, n_bytes=0):
+        """Store an event in the ring buffer."""
+        recorded = self.recorded
+        _pack_into(
+            self.buffer,
+            (recorded % self.size) * _RECORD_SIZE,
+            _monotonic_ns(),
+            event,
+            number,
+            ack_number,
+            n_bytes,
+        )
+        self.recorded = recorded + 1
+
+    @property
+    def dropped(self):
+        """Number of events which were overwritten."""
+        return max(0, self.recorded - self.size)
+
+    def events(self):
+        """Return the events in the buffer, oldest first, as a numpy
+        structured array (see DTYPE)."""
+        records = np.frombuffer(self.buffer, dtype=DTYPE)
+        if self.recorded <= self.size:
+            return records[: self.recorded].copy()
+        start = self.recorded % self.size
+        return np.concatenate([records[start:], records[:start]])
+
+    def dump(self, path):
+        """Write the events in the buffer, oldest first, to a binary
+        file (see load)."""
+        self.events().tofile(path)
+
+    def clear(self):
+        self.recorded = 0
+
+
+DISABLED = Tracer(size=0)
+
+
+def load(path):
+    """Load the events dumped to a file by Tracer.dump."""
+    return np.fromfile(path, dtype=DTYPE)
+
+
+def format_events(events):
+    """Format events as text, one per line, with times in seconds
+    relative to the first event."""
+    if len(events) == 0:
+        return ""
+    start = events["time_ns"][0]
+    lines = []
+    for e in events:
+        name = EVENT_NAMES.get(int(e["event"]), str(e["event"]))
+        lines.append(
+            f"{(e['time_ns'] - start) / 1e9:0.6f} {name} number={e['number']} ack_number={e['ack_number']} n_bytes={e['n_bytes']}"
+        )
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------------
+# Doctests and formatting of dumped traces
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Print a dumped trace")
+        parser.add_argument("path", type=str)
+        args = parser.parse_args()
+        print(format_events(load(args.path)))
+    else:
+        import doctest
+
+        doctest.testmod(
+            extraglobs={},
+            verbose=True,
+            optionflags=doctest.ELLIPSIS,
+        )
@@ -0,0 +1,118 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import json
+import time
+
+"""Cache of the sessions with the chambers, used to attach to a board
+which is still running (see Board.__init__) instead of resetting it and
+waiting for it to boot.
+
+When a run ends without resetting the board (see Board.save_session),
+the chamber configuration, variable names, observation counter and
+transport state are stored for the board's port. The next Board
+created on that port resumes the session by resynchronizing the
+sequence numbers of the transport layer (see TransportLayer.resync);
+if the board does not answer, e.g. because it was reset in between,
+the Board falls back to a full reset.
+
+Note that opening a serial port usually resets an Arduino, as the
+operating system raises DTR on open and drops it on close. Use
+keep_dtr on the open port so that it is not dropped on close (the
+first session must also be opened this way)."""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chamber_sessions.json")
+
+
+class SessionCache:
+    def __init__(self, path=DEFAULT_PATH):
+        """Sessions, by port, stored in a JSON file.
+
+        Examples
+        --------
+        >>> import tempfile
+        >>> cache = SessionCache(os.path.join(tempfile.mkdtemp(), "sessions.json"))
+        >>> cache.get("/dev/ttyACM0") is None
+        True
+        >>> cache.put("/dev/ttyACM0", {"chamber_config": "standard"})
+        >>> SessionCache(cache.path).get("/dev/ttyACM0")["chamber_config"]
+        'standard'
+        >>> cache.discard("/dev/ttyACM0")
+        >>> SessionCache(cache.path).get("/dev/ttyACM0") is None
+        True
+
+        """
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, sessions):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(sessions, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, port):
+        """Return the session stored for a port, or None."""
+        return self._load().get(port)
+
+    def put(self, port, session):
+        sessions = self._load()
+        sessions[port] = dict(session, saved=time.time())
+        self._store(sessions)
+
+    def discard(self, port):
+        sessions = self._load()
+        if sessions.pop(port, None) is not None:
+            self._store(sessions)
+
+
+def keep_dtr(ser):
+    """Keep DTR raised when the serial port is closed (i.e. clear the
+    HUPCL flag), so that closing and opening it again does not reset
+    the board. POSIX only."""
+    import termios
+
+    attributes = termios.tcgetattr(ser.fileno())
+    attributes[2] &= ~termios.HUPCL
+    termios.tcsetattr(ser.fileno(), termios.TCSANOW, attributes)
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
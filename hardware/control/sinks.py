@@ -0,0 +1,501 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import queue
+import timeit
+import threading
+
+"""Output sinks, where Board writes the observations it receives (see
+Board.__init__). Observations are passed to a sink as they are stored
+(see control.measurements.Measurements); sinks buffer them and write
+them in batches, so that disk I/O does not happen for every
+observation in the serial reception loop."""
+
+SINKS = ["csv", "binary", "npy", "arrow", "parquet", "null"]
+
+
+def runs(rows):
+    """Group a list of (measurements, index) pairs into a list of
+    (measurements, start, stop) slices, so that contiguous observations
+    of the same measurements can be written at once.
+
+    Examples
+    --------
+    >>> a, b = "a", "b"
+    >>> runs([(a, 0), (a, 1), (a, 2), (b, 0), (b, 1), (a, 5)])
+    [['a', 0, 3], ['b', 0, 2], ['a', 5, 6]]
+
+    """
+    grouped = []
+    for m, i in rows:
+        if grouped and grouped[-1][0] is m and grouped[-1][2] == i:
+            grouped[-1][2] = i + 1
+        else:
+            grouped.append([m, i, i + 1])
+    return grouped
+
+
+class OutputSink:
+    """Interface of the output sinks."""
+
+    _owned = ()  # Files closed with the sink (see open_sink)
+
+    def write_header(self, variables):
+        """Write the names of the variables (e.g. Board.variables)."""
+
+    def write(self, measurements, i):
+        """Write the i-th observation of the given Measurements object."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Write all buffered observations."""
+
+    def drain(self):
+        """Write all buffered observations and return once they are
+        written (see ThreadedSink)."""
+        self.flush()
+
+    def stats(self):
+        """Dictionary of statistics reported with the metrics (see
+        control.serial.metrics.Metrics), or None."""
+        return None
+
+    def offsets(self):
+        """Write all buffered observations and return a dictionary
+        describing how much of the output was written, from which
+        open_sink can resume writing it (see control.checkpoint)."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and close the sink."""
+        self.flush()
+        for file in self._owned:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # Flush what was received even if the run failed
+        self.close()
+
+
+class NullSink(OutputSink):
+    """Discard all observations."""
+
+    def write(self, measurements, i):
+        pass
+
+    def offsets(self):
+        return {}
+
+
+class CsvSink(OutputSink):
+    def __init__(self, file, rows_per_flush=1000, ms_per_flush=1000):
+        """Write observations as CSV lines, in batches.
+
+        Parameters
+        ----------
+        file : file object
+            Where to write the CSV (opened in text mode).
+        rows_per_flush : int, default=1000
+            Write the buffered observations when this many have been
+            received.
+        ms_per_flush : float, default=1000
+            Write the buffered observations when the oldest was
+            received this many milliseconds ago (checked when an
+            observation is received).
+
+        Examples
+        --------
+        >>> import io, numpy as np
+        >>> from control.measurements import Measurements
+        >>> m = Measurements(["timestamp", "config", "counter", "red"], 3, ["std"])
+        >>> for i in range(3):
+        ...     _ = m.store(i, i, 0, np.array([i, 2 * i], dtype=np.float32).tobytes())
+        >>> file = io.StringIO()
+        >>> sink = CsvSink(file, rows_per_flush=2)
+        >>> sink.write_header(m.variables)
+        >>> for i in range(3):
+        ...     sink.write(m, i)
+        >>> print(file.getvalue(), end="")
+        timestamp,config,counter,red
+        0.0,std,0.0,0.0
+        1.0,std,1.0,2.0
+        >>> sink.close()
+        >>> print(file.getvalue(), end="")
+        timestamp,config,counter,red
+        0.0,std,0.0,0.0
+        1.0,std,1.0,2.0
+        2.0,std,2.0,4.0
+
+        """
+        self.file = file
+        self.rows_per_flush = rows_per_flush
+        self.ms_per_flush = ms_per_flush
+        self.header = True  # False if the file already has a header
+        self._rows = []  # (measurements, index) of the buffered observations
+        self._oldest = None  # When the oldest buffered observation was received
+
+    def write_header(self, variables):
+        if self.header:
+            print(",".join(variables), file=self.file)
+            self.file.flush()
+
+    def write(self, measurements, i):
+        now = timeit.default_timer()
+        if len(self._rows) == 0:
+            self._oldest = now
+        self._rows.append((measurements, i))
+        if (
+            len(self._rows) >= self.rows_per_flush
+            or (now - self._oldest) * 1000 >= self.ms_per_flush
+        ):
+            self.flush()
+
+    def flush(self):
+        if len(self._rows) > 0:
+            lines = [m.row_to_csv(i) for m, i in self._rows]
+            self._rows.clear()
+            self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+
+    def offsets(self):
+        self.drain()
+        return {"file": self.file.tell()}
+
+
+class BinarySink(OutputSink):
+    def __init__(
+        self, file, timestamps_file=None, header_file=None, rows_per_flush=1000
+    ):
+        """Append the variables sent by the board (i.e. all but the
+        timestamp and config, see Board.variables) of each observation
+        to a binary file, as a row of little-endian float32 values;
+        the file can be read back with
+
+          numpy.fromfile(path, dtype="<f4").reshape(-1, len(variables) - 2)
+
+        Parameters
+        ----------
+        file : file object
+            Where to write the observations (opened in binary mode).
+        timestamps_file : file object or NoneType, default=None
+            If given, the timestamp of each observation is appended
+            to it as a float64 value.
+        header_file : file object or NoneType, default=None
+            If given, write_header writes the names of the variables
+            to it, as a line of CSV.
+        rows_per_flush : int, default=1000
+            Write the buffered observations when this many have been
+            received.
+
+        """
+        self.file = file
+        self.timestamps_file = timestamps_file
+        self.header_file = header_file
+        self.rows_per_flush = rows_per_flush
+        self._rows = []
+
+    def write_header(self, variables):
+        if self.header_file is not None:
+            print(",".join(variables), file=self.header_file)
+            self.header_file.flush()
+
+    def write(self, measurements, i):
+        self._rows.append((measurements, i))
+        if len(self._rows) >= self.rows_per_flush:
+            self.flush()
+
+    def flush(self):
+        if len(self._rows) > 0:
+            grouped = runs(self._rows)
+            self._rows.clear()
+            for m, start, stop in grouped:
+                self.file.write(m.values[start:stop].astype("<f4").tobytes())
+                if self.timestamps_file is not None:
+                    self.timestamps_file.write(
+                        m.timestamps[start:stop].astype("<f8").tobytes()
+                    )
+        self.file.flush()
+        if self.timestamps_file is not None:
+            self.timestamps_file.flush()
+
+    def offsets(self):
+        self.drain()
+        offsets = {"file": self.file.tell()}
+        if self.timestamps_file is not None:
+            offsets["timestamps_file"] = self.timestamps_file.tell()
+        return offsets
+
+
+class ThreadedSink(OutputSink):
+    def __init__(self, sink, rows_per_block=256, max_blocks=64):
+        """Hand the observations to another sink from a writer thread,
+        so that slow writes (e.g. to a network file system) do not delay
+        the reception of observations. Observations are grouped into
+        blocks, which are put in a bounded queue drained by the writer
+        thread; when the queue is full, write and flush block until the
+        writer catches up.
+
+        Parameters
+        ----------
+        sink : OutputSink
+            The sink written to by the writer thread; it is closed
+            with this sink.
+        rows_per_block : int, default=256
+            Hand a block to the writer thread when it has this many
+            observations (or when flush is called).
+        max_blocks : int, default=64
+            The size of the queue.
+
+        Attributes
+        ----------
+        high_water : int
+            The maximum number of blocks which were in the queue.
+        blocked : float
+            Seconds spent waiting for space in the queue.
+
+        If the wrapped sink fails, the observations after the failure
+        are not written, and the error is raised by every later call
+        to write, flush, drain and close.
+
+        Examples
+        --------
+        >>> import io, numpy as np
+        >>> from control.measurements import Measurements
+        >>> m = Measurements(["timestamp", "config", "counter"], 5, ["std"])
+        >>> for i in range(5):
+        ...     _ = m.store(i, i, 0, np.array([i], dtype=np.float32).tobytes())
+        >>> file = io.StringIO()
+        >>> with ThreadedSink(CsvSink(file), rows_per_block=2) as sink:
+        ...     for i in range(5):
+        ...         sink.write(m, i)
+        ...     sink.drain()
+        ...     print(file.getvalue(), end="")
+        ...     sink.stats()
+        0.0,std,0.0
+        1.0,std,1.0
+        2.0,std,2.0
+        3.0,std,3.0
+        4.0,std,4.0
+        {'queue_depth': 0, 'queue_high_water': ..., 'blocked_seconds': ...}
+
+        """
+        self.sink = sink
+        self.rows_per_block = rows_per_block
+        self.high_water = 0
+        self.blocked = 0.0
+        self._block = []
+        self._queue = queue.Queue(maxsize=max_blocks)
+        self._error = None  # Raised by the writer thread
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _writer(self):
+        while True:
+            block = self._queue.get()
+            try:
+                if block is None:
+                    return
+                if self._error is None:
+                    for m, i in block:
+                        self.sink.write(m, i)
+                    self.sink.flush()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            started = timeit.default_timer()
+            self._queue.put(item)
+            self.blocked += timeit.default_timer() - started
+        self.high_water = max(self.high_water, self._queue.qsize())
+
+    def _check(self):
+        # The error is kept, as the blocks queued after it were dropped
+        if self._error is not None:
+            raise Exception(
+                f"Error in the writer thread: {self._error}"
+            ) from self._error
+
+    def write_header(self, variables):
+        self.drain()
+        self.sink.write_header(variables)
+
+    def write(self, measurements, i):
+        self._check()
+        self._block.append((measurements, i))
+        if len(self._block) >= self.rows_per_block:
+            self.flush()
+
+    def flush(self):
+        self._check()
+        if len(self._block) > 0:
+            block, self._block = self._block, []
+            self._put(block)
+
+    def drain(self):
+        self.flush()
+        self._queue.join()
+        self._check()
+        # The writer thread is idle until the next block
+        self.sink.drain()
+
+    def offsets(self):
+        self.drain()
+        return self.sink.offsets()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_high_water": self.high_water,
+            "blocked_seconds": self.blocked,
+        }
+
+    def close(self):
+        if self._thread.is_alive():
+            try:
+                self.drain()
+            finally:
+                self._put(None)
+                self._thread.join()
+                self.sink.close()
+
+
+def open_sink(
+    kind,
+    path=None,
+    rows_per_flush=1000,
+    ms_per_flush=1000,
+    threaded=False,
+    variables_path=None,
+    resume=None,
+):
+    """Open the files of a sink of the given kind (one of SINKS) and
+    return the sink, which closes them when it is closed. A binary sink
+    writes the observations to path, their timestamps to
+    path + ".timestamps" and the names of the variables to
+    path + ".header". The columnar sinks (see control.columnar) write
+    chunks of rows_per_flush observations, with the column types given
+    by the variables.csv file at variables_path. If threaded is True,
+    the sink is written to from a writer thread (see ThreadedSink),
+    in blocks of rows_per_flush observations.
+
+    If resume is given, continue writing an existing output from the
+    offsets returned by OutputSink.offsets, discarding whatever was
+    written after them; the header is not written again. Arrow IPC
+    streams cannot be resumed.
+
+    Examples
+    --------
+    >>> import tempfile, os, numpy as np
+    >>> from control.measurements import Measurements
+    >>> m = Measurements(["timestamp", "config", "counter", "red"], 2, ["std"])
+    >>> for i in range(2):
+    ...     _ = m.store(i, i, 0, np.array([i, 2 * i], dtype=np.float32).tobytes())
+    >>> path = os.path.join(tempfile.mkdtemp(), "test.bin")
+    >>> with open_sink("binary", path) as sink:
+    ...     sink.write_header(m.variables)
+    ...     sink.write(m, 0)
+    ...     sink.write(m, 1)
+    >>> np.fromfile(path, dtype="<f4").reshape(-1, 2)
+    array([[0., 0.],
+           [1., 2.]], dtype=float32)
+    >>> np.fromfile(path + ".timestamps", dtype="<f8")
+    array([0., 1.])
+    >>> open(path + ".header").read()
+    'timestamp,config,counter,red\\n'
+    >>> with open_sink("binary", path) as sink:
+    ...     sink.write_header(m.variables)
+    ...     sink.write(m, 0)
+    ...     offsets = sink.offsets()
+    ...     sink.write(m, 1)
+    >>> with open_sink("binary", path, resume=offsets) as sink:
+    ...     sink.write_header(m.variables)
+    ...     sink.write(m, 1)
+    >>> np.fromfile(path, dtype="<f4").reshape(-1, 2)
+    array([[0., 0.],
+           [1., 2.]], dtype=float32)
+    >>> open_sink("xml")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown sink "xml"; should be one of ['csv', 'binary', 'npy', 'arrow', 'parquet', 'null']
+
+    """
+    if kind == "csv":
+        if resume is None:
+            file = open(path, "w")
+        else:
+            os.truncate(path, resume["file"])
+            file = open(path, "a")
+        sink = CsvSink(file, rows_per_flush, ms_per_flush)
+        sink.header = resume is None
+        sink._owned = (file,)
+    elif kind == "binary":
+        if resume is None:
+            files = (open(path, "wb"), open(path + ".timestamps", "wb"))
+            header_file = open(path + ".header", "w")
+        else:
+            os.truncate(path, resume["file"])
+            os.truncate(path + ".timestamps", resume["timestamps_file"])
+            files = (open(path, "ab"), open(path + ".timestamps", "ab"))
+            header_file = None
+        sink = BinarySink(*files, header_file, rows_per_flush)
+        sink._owned = files if header_file is None else files + (header_file,)
+    elif kind in ["npy", "parquet"]:
+        from control.columnar import NpySink, ArrowSink
+
+        if kind == "npy":
+            sink = NpySink(path, variables_path, rows_per_flush)
+        else:
+            sink = ArrowSink(path, variables_path, rows_per_flush, "parquet")
+        if resume is not None:
+            sink.resume(resume["chunks"])
+    elif kind == "arrow":
+        from control.columnar import ArrowSink
+
+        if resume is not None:
+            raise ValueError("Arrow IPC streams cannot be resumed")
+        sink = ArrowSink(path, variables_path, rows_per_flush, "ipc")
+    elif kind == "null":
+        sink = NullSink()
+    else:
+        raise ValueError(f'Unknown sink "{kind}"; should be one of {SINKS}')
+    return ThreadedSink(sink, rows_per_block=rows_per_flush) if threaded else sink
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )
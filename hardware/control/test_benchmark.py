@@ -0,0 +1,53 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+from control.benchmark import run_protocol, find_variables
+
+"""Tests for the end-to-end benchmarks (control.benchmark). Run with
+
+  python -m pytest control/test_benchmark.py
+
+from the hardware/ directory."""
+
+
+def test_run_protocol(tmp_path):
+    dataset = tmp_path / "dataset"
+    (dataset / "protocols").mkdir(parents=True)
+    with open("../datasets/lt_walks_v1/variables.csv") as f:
+        (dataset / "variables.csv").write_text(f.read())
+    protocol = dataset / "protocols" / "test.txt"
+    protocol.write_text(
+        "SET,red,10\nSET,red,10\nMSR,5,0\nWAIT,10000\nSET,green,1\nMSR,3,0\n"
+    )
+    assert find_variables(str(protocol)) == str(dataset / "variables.csv")
+    result = run_protocol(str(protocol), baud_rate=None, loss=0.05)
+    assert result["variables"] == 44
+    assert result["instructions"] == 5  # Without the WAIT
+    assert result["observations"] == 8
+    assert result["sets"] == 3 and result["skipped_sets"] == 0
+    assert result["latency"]["MSR"]["p50_ms"] <= result["latency"]["MSR"]["p99_ms"]
+    json.dumps(result)
+    # Larger windows need an emulator which answers WND
+    result = run_protocol(str(protocol), baud_rate=None, window_size=4)
+    assert result["window_size"] == 4 and result["observations"] == 8
@@ -0,0 +1,427 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import time
+import asyncio
+import threading
+import numpy as np
+import serial
+import control.messages as messages
+import control.board as board_module
+from control.board import AsyncBoard, Board
+from control.serial.packet import PacketLayer
+from control.serial.aio import AsyncPacketLayer
+from control.serial.segment import TransportLayer
+from control.serial.ptyserial import PtySerial
+import control.serial.trace as trace
+from control.serial.metrics import Metrics
+import pytest
+from control.sinks import OutputSink, CsvSink, ThreadedSink, open_sink
+
+"""Tests for the asyncio stack (control.serial.aio and
+control.board.AsyncBoard), run against a stand-in for the board on a
+pseudo-terminal. Run with
+
+  python -m pytest control/test_board_aio.py
+
+from the hardware/ directory."""
+
+VARIABLES = ["counter", "flag", "red", "green", "blue"]
+
+
+def stand_in_board(port, reset=None):
+    """Emulate the firmware's side of the protocol: send the chamber
+    configuration and variable names, then answer MSR, SET, RST and WND
+    instructions until the port is closed. If a reset event is given,
+    WND is refused like the chambers' firmware does (an error outside
+    of any packet, then silence) until the event is set."""
+    try:
+        while True:
+            comms = TransportLayer(PacketLayer(port, max_size=None), verbose=0)
+            comms.send("CHAMBER_CONFIG,standard")
+            comms.send("VARIABLES_LIST," + ",".join(VARIABLES))
+            refused = answer(comms, reset)
+            port.write(f"<ERR,er01,WND,{refused}>".encode())
+            reset.wait(5)
+    except (OSError, UserWarning):  # The port was closed
+        return
+
+
+def answer(comms, reset):
+    """Answer instructions until a WND instruction is refused, and
+    return the window size it requested."""
+    values = np.zeros(len(VARIABLES), dtype=np.single)
+    values[0] = -1
+    while True:
+        instruction = comms.receive().decode().split(",")
+        kind = instruction[0]
+        if kind == "MSR":
+            n, wait = int(instruction[1]), int(instruction[2])
+            comms.send(f"OK,MSR,n={n},wait={wait}")
+            for _ in range(n):
+                values[0] += 1
+                comms.send(values.tobytes())
+            comms.send("OK,DONE")
+            values[1] = 0
+        elif kind == "SET":
+            target, value = instruction[1], float(instruction[2])
+            values[VARIABLES.index(target)] = value
+            values[1] = 1
+            comms.send(f"OK,SET,{target}={value}")
+        elif kind == "RST":
+            values[1:] = 0
+            comms.send("OK,RST")
+        elif kind == "WND" and reset is not None:
+            reset.clear()
+            return instruction[1]
+        elif kind == "WND":
+            comms.send(f"OK,WND,{instruction[1]}")
+            comms.set_window_size(int(instruction[1]))
+
+
+class ResettableSerial(serial.Serial):
+    """Host side of the pseudo-terminal, where pulling DTR low sets the
+    given event instead of resetting a board."""
+
+    def __init__(self, port, reset):
+        super().__init__(port, 500000)
+        self.reset = reset
+
+    def setDTR(self, value=True):
+        if not value:
+            self.reset.set()
+
+
+def run_with_board(test, refuse_window=False, **kwargs):
+    """Start a stand-in board and run the coroutine test(board) with an
+    AsyncBoard connected to it, created with the given keyword
+    arguments. If refuse_window=True, the stand-in refuses WND
+    instructions like the chambers' firmware."""
+    port = PtySerial()
+    reset = threading.Event() if refuse_window else None
+    thread = threading.Thread(target=stand_in_board, args=(port, reset), daemon=True)
+    thread.start()
+    host = (
+        ResettableSerial(port.port, reset)
+        if refuse_window
+        else serial.Serial(port.port, 500000)
+    )
+
+    async def main():
+        board = AsyncBoard(host, output_file=None, **kwargs)
+        await asyncio.wait_for(board.connect(), 10)
+        try:
+            return await asyncio.wait_for(test(board), 10)
+        finally:
+            board.close()
+
+    try:
+        return asyncio.run(main())
+    finally:
+        host.close()
+        port.hangup()
+        thread.join()
+        port.close()
+
+
+def test_connect():
+    async def test(board):
+        return board.chamber_config, board.variables
+
+    config, variables = run_with_board(test)
+    assert config == "standard"
+    assert variables == ["timestamp", "config"] + VARIABLES
+
+
+def test_instructions():
+    async def test(board):
+        await board.execute_instruction(messages.parse("SET,red,10"))
+        first = await board.execute_instruction(messages.parse("MSR,5,0"))
+        await board.reset()
+        await board.execute_instruction(messages.parse("WAIT,1"))
+        second = await board.execute_instruction(messages.parse("MSR,3,0"))
+        return first, second
+
+    first, second = run_with_board(test)
+    assert first.values.shape == (5, len(VARIABLES))
+    assert first.to_object_array().shape == (5, 2 + len(VARIABLES))
+    assert list(first["counter"]) == [0, 1, 2, 3, 4]
+    assert list(first["flag"]) == [1, 1, 1, 1, 1]  # Intervention flag
+    assert list(first["red"]) == [10] * 5
+    assert (first["config"] == "standard").all()
+    assert (np.diff(first["timestamp"]) >= 0).all()
+    assert list(second["counter"]) == [5, 6, 7]
+    assert list(second["red"]) == [0] * 3
+
+
+def test_packet_timeout():
+    # A partial frame is dropped when the reception times out
+    port = PtySerial()
+    host = serial.Serial(port.port, 500000)
+
+    async def main():
+        layer = AsyncPacketLayer(host, log_fun=print)
+        layer.start()
+        try:
+            port.write(b"\0dGVz")
+            with pytest.raises(UserWarning):
+                await layer.receive(timeout=0.05)
+            port.write(b"\0dGVzdA==\4")
+            return await layer.receive(timeout=1)
+        finally:
+            layer.stop()
+
+    try:
+        assert asyncio.run(main()) == b"test"
+    finally:
+        host.close()
+        port.close()
+
+
+def test_window():
+    async def test(board):
+        return await board.execute_instruction(messages.parse("MSR,50,0"))
+
+    observations = run_with_board(test, window_size=4)
+    assert list(observations["counter"]) == list(range(50))
+
+
+def test_window_refused(monkeypatch):
+    # The firmware does not know WND: fall back to stop-and-wait
+    monkeypatch.setattr(board_module, "WINDOW_TIMEOUT", 0.2)
+
+    async def test(board):
+        observations = await board.execute_instruction(messages.parse("MSR,5,0"))
+        return board, observations
+
+    logged = []
+    board, observations = run_with_board(
+        test, refuse_window=True, window_size=4, log_fun=logged.append
+    )
+    assert any("<ERR,er01,WND,4>" in line for line in logged)
+    assert board.window_refused
+    assert board.comms.window_size == 1
+    assert list(observations["counter"]) == list(range(5))
+
+
+def test_window_refused_sync(monkeypatch):
+    monkeypatch.setattr(board_module, "WINDOW_TIMEOUT", 0.2)
+    port = PtySerial()
+    reset = threading.Event()
+    thread = threading.Thread(target=stand_in_board, args=(port, reset), daemon=True)
+    thread.start()
+    host = ResettableSerial(port.port, reset)
+    logged = []
+    try:
+        board = Board(host, output_file=None, log_fun=logged.append, window_size=4)
+        observations = board.execute_instruction(messages.parse("MSR,5,0"))
+    finally:
+        host.close()
+        port.hangup()
+        thread.join()
+        port.close()
+    assert board.window_refused
+    assert board.comms.window_size == 1
+    assert any("<ERR,er01,WND,4>" in line for line in logged)
+    assert list(observations["counter"]) == list(range(5))
+
+
+def test_concurrent_tasks():
+    # Other tasks keep running while the board is waited on
+    async def test(board):
+        ticks = 0
+        done = False
+
+        async def ticker():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        measurements = [
+            board.execute_instruction(messages.parse("MSR,20,0")) for _ in range(3)
+        ]
+        results = await asyncio.gather(*measurements)
+        done = True
+        await task
+        return ticks, results
+
+    ticks, results = run_with_board(test)
+    assert ticks > 0
+    # Instructions from different tasks are not interleaved
+    counters = np.concatenate([r["counter"] for r in results])
+    assert sorted(counters) == list(range(60))
+    for r in results:
+        first = int(r["counter"][0])
+        assert list(r["counter"]) == list(range(first, first + 20))
+
+
+def test_trace():
+    async def test(board):
+        await board.execute_instruction(messages.parse("SET,red,10"))
+        await board.execute_instruction(messages.parse("MSR,5,0"))
+
+    tracer = trace.Tracer(size=1000)
+    run_with_board(test, tracer=tracer)
+    events = list(tracer.events()["event"])
+    assert events.count(trace.OBSERVATION_RECEIVED) == 5
+    assert events.count(trace.VARIABLE_SET) == 1
+    assert events.count(trace.MEASUREMENTS_DONE) == 1
+    # Two configuration messages, OK,SET, OK,MSR, 5 observations and OK,DONE
+    assert events.count(trace.SEGMENT_RECEIVED) >= 10
+    assert events.count(trace.PACKET_RECEIVED) == events.count(trace.SEGMENT_RECEIVED)
+
+
+def test_metrics(tmp_path):
+    async def test(board):
+        await board.execute_instruction(messages.parse("MSR,10,0"))
+
+    path = str(tmp_path / "metrics.prom")
+    metrics = Metrics(path=path, interval=0, format="prometheus")
+    run_with_board(test, metrics=metrics)
+    snapshot = metrics.snapshot()
+    assert snapshot["observations"] == 10
+    assert snapshot["observation_latency"]["count"] == 10
+    assert snapshot["ack_rtt"]["count"] > 0
+    transport = snapshot["transport"]
+    assert transport["payload_bytes_received"] >= 10 * 4 * len(VARIABLES)
+    # Base64 and segment overhead
+    assert (
+        transport["wire_bytes_received"] > 4 / 3 * transport["payload_bytes_received"]
+    )
+    with open(path) as f:
+        assert "chamber_observations_total 10" in f.read()
+    # Snapshots are also written when only SETs are executed
+
+    async def test(board):
+        await board.execute_instruction(messages.parse("SET,red,10"))
+
+    path = str(tmp_path / "sets.prom")
+    run_with_board(test, metrics=Metrics(path=path, interval=0, format="prometheus"))
+    with open(path) as f:
+        assert "chamber_observations_total 0" in f.read()
+
+
+def test_sinks(tmp_path):
+    async def test(board):
+        first = await board.execute_instruction(messages.parse("MSR,7,0"))
+        second = await board.execute_instruction(messages.parse("MSR,5,0"))
+        return first, second
+
+    # Buffered CSV: all observations are written when the MSRs return
+    file = io.StringIO()
+    sink = CsvSink(file, rows_per_flush=3)
+    first, second = run_with_board(test, sink=sink)
+    lines = file.getvalue().splitlines()
+    assert lines == [m.row_to_csv(i) for m in [first, second] for i in range(len(m))]
+    # Binary
+    path = str(tmp_path / "run.bin")
+    with open_sink("binary", path, rows_per_flush=4) as sink:
+        first, second = run_with_board(test, sink=sink)
+    values = np.fromfile(path, dtype="<f4").reshape(-1, len(VARIABLES))
+    assert (values == np.vstack([first.values, second.values])).all()
+    timestamps = np.fromfile(path + ".timestamps", dtype="<f8")
+    assert (timestamps == np.hstack([first.timestamps, second.timestamps])).all()
+
+
+class SlowSink(OutputSink):
+    """Sink which takes 20 ms to write each batch of observations."""
+
+    def __init__(self, fail=False):
+        self.written = []
+        self.fail = fail
+
+    def write(self, measurements, i):
+        if self.fail:
+            raise OSError("disk full")
+        self.written.append(measurements.row_to_csv(i))
+
+    def flush(self):
+        time.sleep(0.02)
+
+
+def test_writer_thread():
+    async def test(board):
+        m = await board.execute_instruction(messages.parse("MSR,30,0"))
+        # Writes are not waited for...
+        assert len(slow.written) < len(m)
+        await board.reset()
+        # ...but the board is only reset once they are done
+        assert slow.written == [m.row_to_csv(i) for i in range(len(m))]
+
+    slow = SlowSink()
+    sink = ThreadedSink(slow, rows_per_block=2, max_blocks=4)
+    metrics = Metrics()
+    run_with_board(test, metrics=metrics, sink=sink)
+    sink.close()
+    assert metrics.snapshot()["sink"]["queue_high_water"] == 4
+    assert metrics.snapshot()["sink"]["blocked_seconds"] > 0
+    # Errors of the writer thread are raised by the board
+    sink = ThreadedSink(SlowSink(fail=True), rows_per_block=10)
+
+    async def test(board):
+        await board.execute_instruction(messages.parse("MSR,4,0"))
+        with pytest.raises(Exception, match="disk full"):
+            await board.reset()
+
+    run_with_board(test, sink=sink)
+    # The error is raised again until the sink is closed
+    for call in [sink.flush, sink.drain, sink.close]:
+        with pytest.raises(Exception, match="disk full"):
+            call()
+    sink.close()
+    # Blocks are as large as the flushes of the wrapped sink
+    with open_sink("null", rows_per_flush=7, threaded=True) as sink:
+        assert isinstance(sink, ThreadedSink) and sink.rows_per_block == 7
+
+
+@pytest.mark.parametrize("skip", [True, False])
+def test_redundant_sets(skip):
+    async def test(board):
+        flags = []
+        for instruction in ["SET,red,10", "SET,red,10.0", "SET,green,0", "MSR,1,0"]:
+            await board.execute_instruction(messages.parse(instruction))
+        m = await board.take_measurements(messages.parse("MSR,1,0"))
+        flags.append(m["flag"][0])
+        await board.execute_instruction(messages.parse("SET,red,10"))
+        m = await board.take_measurements(messages.parse("MSR,1,0"))
+        flags.append(m["flag"][0])
+        assert m["red"][0] == 10
+        # The board forgets its variables when reset
+        await board.reset()
+        await board.execute_instruction(messages.parse("SET,red,10"))
+        m = await board.take_measurements(messages.parse("MSR,1,0"))
+        flags.append(m["flag"][0])
+        return board.skipped_sets, flags
+
+    tracer = trace.Tracer()
+    skipped, flags = run_with_board(test, skip_redundant_sets=skip, tracer=tracer)
+    events = tracer.events()["event"]
+    if skip:
+        assert skipped == 2 and (events == trace.SET_SKIPPED).sum() == 2
+        assert flags == [0, 0, 1]
+    else:
+        assert skipped == 0 and (events == trace.SET_SKIPPED).sum() == 0
+        assert flags == [0, 1, 1]
+    assert (events == trace.VARIABLE_SET).sum() == 5 - skipped
@@ -0,0 +1,92 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import serial
+import pytest
+import control.messages as messages
+from control.board import Board
+from control.serial.ptyserial import PtySerial
+from control.serial.capture import CaptureSerial, replay, sent_data
+from control.serial.loopback import loopback_pair
+from control.serial.frame import FrameEncoder
+import control.serial.segment as segment
+from control.test_board_aio import stand_in_board
+
+"""Tests for the capture and replay of serial traffic
+(control.serial.capture). Run with
+
+  python -m pytest control/test_capture.py
+
+from the hardware/ directory."""
+
+
+def capture_run(path, window_size=1):
+    """Run a few instructions against a stand-in board, capturing the
+    traffic; return the measurements."""
+    port = PtySerial()
+    thread = threading.Thread(target=stand_in_board, args=(port,), daemon=True)
+    thread.start()
+    host = CaptureSerial(serial.Serial(port.port, 500000), path)
+    try:
+        board = Board(host, output_file=None, log_fun=print, window_size=window_size)
+        board.set_variable(messages.parse("SET,red,10"))
+        first = board.take_measurements(messages.parse("MSR,20,0"))
+        board.reset()
+        second = board.take_measurements(messages.parse("MSR,5,0"))
+    finally:
+        host.close()
+        port.hangup()
+        thread.join()
+        port.close()
+    return [first, second]
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+def test_replay(tmp_path, window_size):
+    path = str(tmp_path / "run.cap")
+    captured = capture_run(path, window_size)
+    instructions = [b"SET,red,10", b"MSR,20,0", b"RST", b"MSR,5,0"]
+    if window_size > 1:
+        instructions = [f"WND,{window_size}".encode()] + instructions
+    assert sent_data(path) == instructions
+    for realtime in [False, True]:
+        board, replayed = replay(path, realtime=realtime)
+        assert len(replayed) == 2
+        for c, r in zip(captured, replayed):
+            # All but the timestamps are the same
+            assert (c.values == r.values).all()
+            assert (c["config"] == r["config"]).all()
+        assert board.comms.unexpected == 0
+
+
+def test_sent_data(tmp_path):
+    # Go-Back-N retransmissions of a window are not counted again
+    path = str(tmp_path / "resends.cap")
+    host, _ = loopback_pair()
+    encoder = FrameEncoder()
+    with CaptureSerial(host, path) as capture:
+        for number in [1, 2, 3, 2, 3, 4, 5, 6, 7, 5, 6, 7, 8]:
+            seg = segment.Segment(number, data=b"instruction %d" % number)
+            capture.write(encoder.encode(segment.encode(seg)))
+            capture.write(encoder.encode(segment.encode_ack(0, number)))
+    assert sent_data(path) == [b"instruction %d" % n for n in range(1, 9)]
@@ -0,0 +1,103 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import csv
+import threading
+import serial
+import pytest
+import control.messages as messages
+import control.checkpoint as checkpoint
+from control.board import Board
+from control.sinks import open_sink
+from control.serial.ptyserial import PtySerial
+from control.test_board_aio import stand_in_board
+
+"""Tests for checkpointing and resuming runs (control.checkpoint). Run
+with
+
+  python -m pytest control/test_checkpoint.py
+
+from the hardware/ directory."""
+
+PROTOCOL = ["SET,red,10", "MSR,3,0", "SET,green,5", "MSR,2,0", "SET,red,7", "MSR,4,0"]
+
+
+def run(path, kind, resume=None, fail_at=None):
+    """Run PROTOCOL against a stand-in board, writing its output to
+    path and checkpointing after every instruction; raise an exception
+    before executing the instruction fail_at."""
+    port = PtySerial()
+    thread = threading.Thread(target=stand_in_board, args=(port,), daemon=True)
+    thread.start()
+    host = serial.Serial(port.port, 500000)
+    offsets = None if resume is None else resume["offsets"]
+    try:
+        with open_sink(kind, path, rows_per_flush=2, resume=offsets) as sink:
+            board = Board(host, sink=sink, log_fun=print)
+            sink.write_header(board.variables)
+            checkpointer = checkpoint.Checkpointer(
+                path + ".checkpoint", sink, {"output": path}, interval=0
+            )
+            start = 0
+            if resume is not None:
+                start = checkpoint.restore(board, resume, checkpointer)
+            protocol = [messages.parse(i) for i in PROTOCOL]
+            for i in range(start, len(protocol)):
+                if i == fail_at:
+                    raise OSError("serial hiccup")
+                board.execute_instruction(protocol[i])
+                checkpointer.step(i + 1, protocol[i])
+    finally:
+        host.close()
+        port.hangup()
+        thread.join()
+        port.close()
+
+
+@pytest.mark.parametrize("fail_at", [2, 5])
+def test_resume(tmp_path, fail_at):
+    path = str(tmp_path / "run.csv")
+    with pytest.raises(OSError):
+        run(path, "csv", fail_at=fail_at)
+    resume = checkpoint.load(path + ".checkpoint")
+    assert resume["index"] == fail_at
+    run(path, "csv", resume=resume)
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 9
+    # The actuator state was restored
+    assert [float(r["red"]) for r in rows] == [10] * 5 + [7] * 4
+    assert [float(r["green"]) for r in rows] == [0] * 3 + [5] * 6
+
+
+def test_resume_npy(tmp_path):
+    from control.columnar import load_npy
+    import numpy as np
+
+    path = str(tmp_path / "run")
+    with pytest.raises(OSError):
+        run(path, "npy", fail_at=5)
+    run(path, "npy", resume=checkpoint.load(path + ".checkpoint"))
+    chunks, manifest = load_npy(path)
+    assert manifest["rows"] == 9
+    assert list(np.concatenate(chunks)["red"]) == [10] * 5 + [7] * 4
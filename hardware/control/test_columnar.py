@@ -0,0 +1,116 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import numpy as np
+import pytest
+import control.messages as messages
+from control.columnar import NpySink, ArrowSink, load_npy, load_arrow, load_schema
+from control.test_board_aio import VARIABLES, run_with_board
+
+"""Tests for the columnar outputs (control.columnar). Run with
+
+  python -m pytest control/test_columnar.py
+
+from the hardware/ directory."""
+
+COLUMNS = ["timestamp", "config"] + VARIABLES
+
+
+@pytest.fixture
+def variables_path(tmp_path):
+    """A variables.csv for the stand-in board, storing the counter and
+    flag as integers."""
+    path = tmp_path / "variables.csv"
+    lines = ["column_name,latex_name,description,dtype"]
+    lines += ["timestamp,,The timestamp.,", "config,,The configuration.,"]
+    lines += ["counter,,The counter.,<i4", "flag,,A flag.,u1"]
+    lines += [f"{v},,A light source.," for v in VARIABLES[2:]]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def take_measurements(sink):
+    async def test(board):
+        sink.write_header(board.variables)
+        first = await board.execute_instruction(messages.parse("MSR,7,0"))
+        await board.execute_instruction(messages.parse("SET,red,10"))
+        second = await board.execute_instruction(messages.parse("MSR,5,0"))
+        return first, second
+
+    return run_with_board(test, sink=sink)
+
+
+def test_schema(variables_path):
+    dtype, descriptions = load_schema(COLUMNS, variables_path)
+    assert dtype["counter"] == np.dtype("<i4")
+    assert dtype["red"] == np.dtype("<f4")
+    assert descriptions["flag"] == "A flag."
+    with pytest.raises(ValueError, match="are not in"):
+        load_schema(COLUMNS + ["unknown"], variables_path)
+
+
+def test_npy(tmp_path, variables_path):
+    directory = str(tmp_path / "run")
+    with NpySink(directory, variables_path, rows_per_chunk=4) as sink:
+        first, second = take_measurements(sink)
+    chunks, manifest = load_npy(directory)
+    assert [len(c) for c in chunks] == [4, 4, 4]
+    records = np.concatenate(chunks)
+    assert records.dtype["counter"] == np.dtype("<i4")
+    assert (records["counter"] == np.arange(12)).all()
+    assert (records["red"][7:] == 10).all()
+    assert (records["timestamp"][:7] == first.timestamps).all()
+    assert manifest["configs"] == ["standard"] and (records["config"] == 0).all()
+
+
+def test_npy_interrupted(tmp_path):
+    directory = str(tmp_path / "run")
+    sink = NpySink(directory, rows_per_chunk=5)
+    take_measurements(sink)
+    # The sink was not closed: the complete chunks can be read
+    chunks, manifest = load_npy(directory)
+    assert manifest["rows"] == 10
+    assert (np.concatenate(chunks)["counter"] == np.arange(10)).all()
+    # A chunk being written is ignored
+    with open(os.path.join(directory, "chunk-00002.npy.tmp"), "wb") as f:
+        f.write(b"\x93NUMPY")
+    chunks, manifest = load_npy(directory)
+    assert len(chunks) == 2
+
+
+@pytest.mark.parametrize("format", ["ipc", "parquet"])
+def test_arrow(tmp_path, variables_path, format):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "run")
+    with ArrowSink(path, variables_path, rows_per_chunk=4, format=format) as sink:
+        take_measurements(sink)
+    if format == "ipc":
+        table = load_arrow(path)
+    else:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+    assert table.num_rows == 12
+    assert table.column("counter").to_pylist() == list(range(12))
+    assert set(table.column("config").to_pylist()) == {"standard"}
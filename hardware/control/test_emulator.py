@@ -0,0 +1,153 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import serial
+import pytest
+import control.messages as messages
+from control.board import Board
+from control.emulator import Emulator, load_variables
+
+"""Tests for the chamber emulator (control.emulator). Run with
+
+  python -m pytest control/test_emulator.py
+
+from the hardware/ directory."""
+
+LIGHT_TUNNEL = "../datasets/lt_walks_v1/variables.csv"
+WIND_TUNNEL = "../datasets/wt_walks_v1/variables.csv"
+
+
+def run_with_emulator(test, emulator, **kwargs):
+    """Run test(board) with a Board connected to the emulator, created
+    with the given keyword arguments."""
+    with emulator:
+        host = serial.Serial(emulator.port, 500000)
+        try:
+            return test(Board(host, output_file=None, log_fun=print, **kwargs))
+        finally:
+            host.close()
+
+
+def test_variables():
+    light_tunnel = load_variables(LIGHT_TUNNEL)
+    assert light_tunnel[:6] == [
+        "counter",
+        "flag",
+        "intervention",
+        "red",
+        "green",
+        "blue",
+    ]
+    assert len(light_tunnel) == 44
+    wind_tunnel = load_variables(WIND_TUNNEL)
+    assert wind_tunnel[:4] == ["counter", "flag", "intervention", "hatch"]
+    assert len(wind_tunnel) == 35
+    # Camera metadata is added by the host
+    assert load_variables("../datasets/lt_camera_v1/variables.csv") == light_tunnel
+
+
+@pytest.mark.parametrize("path", [LIGHT_TUNNEL, WIND_TUNNEL])
+def test_protocol(path):
+    variables = load_variables(path)
+    target = variables[3]
+
+    def test(board):
+        board.set_variable(messages.parse(f"SET,{target},10"))
+        first = board.take_measurements(messages.parse("MSR,3,0"))
+        second = board.take_measurements(messages.parse("MSR,2,0"))
+        return board, first, second
+
+    emulator = Emulator(variables, latency=0.001)
+    board, first, second = run_with_emulator(test, emulator)
+    assert board.variables == ["timestamp", "config"] + variables
+    assert list(first["counter"]) == [0, 1, 2]
+    assert list(second["counter"]) == [3, 4]
+    assert list(first["intervention"]) == [1, 0, 0]
+    assert list(second[target]) == [10] * 2
+    assert emulator.observations == 5
+
+
+def test_reset():
+    # After RST the board boots again, as the firmware does
+    emulator = Emulator(load_variables(LIGHT_TUNNEL))
+    with emulator:
+        for _ in range(2):
+            host = serial.Serial(emulator.port, 500000)
+            board = Board(host, output_file=None, log_fun=print)
+            board.set_variable(messages.parse("SET,red,10"))
+            observations = board.take_measurements(messages.parse("MSR,2,0"))
+            assert list(observations["counter"]) == [0, 1]
+            board.reset()
+            host.close()
+    assert emulator.boots == 3
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+def test_loss(window_size):
+    def test(board):
+        return board.take_measurements(messages.parse("MSR,100,0"))
+
+    emulator = Emulator(
+        load_variables(WIND_TUNNEL), loss=0.1, seed=42, accept_window=True
+    )
+    observations = run_with_emulator(test, emulator, window_size=window_size)
+    assert list(observations["counter"]) == list(range(100))
+    assert emulator.comms.packet_layer.dropped > 0
+
+
+def test_model():
+    def model(values, rng):
+        values["ir_1"] = values["red"] * 2
+
+    def test(board):
+        board.set_variable(messages.parse("SET,red,10"))
+        return board.take_measurements(messages.parse("MSR,2,0"))
+
+    emulator = Emulator(load_variables(LIGHT_TUNNEL), model=model)
+    observations = run_with_emulator(test, emulator)
+    assert list(observations["ir_1"]) == [20, 20]
+
+
+def test_error():
+    # The board stops answering after an error
+    def test(board):
+        board.comms.send("SET,counter,1")
+        with pytest.raises(UserWarning):
+            board.comms.packet_layer.receive(timeout=0.5)
+
+    emulator = Emulator(load_variables(LIGHT_TUNNEL))
+    run_with_emulator(test, emulator)
+    assert emulator.error == "er04,counter"
+
+
+def test_window_refused():
+    # As the firmware, WND is an unknown instruction by default
+    def test(board):
+        board.comms.send("WND,4")
+        with pytest.raises(UserWarning):
+            board.comms.packet_layer.receive(timeout=0.5)
+        return board.comms.packet_layer.decoder.pop_discarded()
+
+    emulator = Emulator(load_variables(LIGHT_TUNNEL))
+    assert run_with_emulator(test, emulator) == b"<ERR,er01,WND,4>"
+    assert emulator.error == "er01,WND,4"
@@ -0,0 +1,185 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import pytest
+import numpy as np
+import control.protocol as prtcl
+
+"""Tests for the loading of experiment protocols (control.protocol).
+Run with
+
+  python -m pytest control/test_protocol.py
+
+from the hardware/ directory."""
+
+PROTOCOL = """# A comment
+
+SET,red,10
+MSR,5,0
+WAIT,100
+
+SET,green,1/2
+MSR,1,0
+WAIT_INPUT,continue?
+"""
+
+TARGETS = ["red", "green"]
+
+
+def write(tmp_path, contents):
+    path = tmp_path / "protocol.txt"
+    path.write_text(contents)
+    return str(path)
+
+
+def test_stream(tmp_path):
+    path = write(tmp_path, PROTOCOL)
+    assert prtcl.check(path, TARGETS) == 6
+    loaded = prtcl.load(path, TARGETS)
+    streamed = list(prtcl.stream(path))
+    assert [str(i) for i in streamed] == [str(i) for i in loaded]
+    assert [i.kind for i in loaded] == [
+        "SET",
+        "MSR",
+        "WAIT",
+        "SET",
+        "MSR",
+        "WAIT_INPUT",
+    ]
+    # Resume from the fourth instruction
+    assert [str(i) for i in prtcl.stream(path, start=3)] == [
+        "SET,green,1/2",
+        "MSR,1,0",
+        "WAIT_INPUT,continue?",
+    ]
+
+
+def test_lazy(tmp_path):
+    # Instructions are parsed as they are read, so the first ones are
+    # returned before an error further down the file
+    path = write(tmp_path, "MSR,1,0\nMSR,1\n")
+    instructions = prtcl.stream(path)
+    assert str(next(instructions)) == "MSR,1,0"
+    with pytest.raises(ValueError, match="Line 1"):
+        next(instructions)
+
+
+def test_errors(tmp_path):
+    path = write(tmp_path, PROTOCOL + "MSR,1\n")
+    with pytest.raises(ValueError, match='Line 9: "MSR,1" does not match'):
+        prtcl.check(path, TARGETS)
+    with pytest.raises(ValueError, match="Line 9"):
+        prtcl.load(path, TARGETS)
+    path = write(tmp_path, PROTOCOL + "SET,blue,1\n")
+    with pytest.raises(SyntaxError, match='Line 9: target "blue"'):
+        prtcl.check(path, TARGETS)
+    path = write(tmp_path, "OK,DONE\nTEST,1\n")
+    with pytest.raises(ValueError, match="Line 1"):
+        prtcl.check(path, TARGETS)
+    # Numbers are checked too, and errors name the line of the file
+    for line in ["WAIT,", "MSR,,", "MSR,1,"]:
+        path = write(tmp_path, "SET,red,10\nMSR,1,0\n\n# Comment\n%s\n" % line)
+        message = 'Line 4: "%s" does not match any valid instructions.' % line
+        for function in [prtcl.check, prtcl.load, prtcl.compile]:
+            with pytest.raises(ValueError, match=message):
+                function(path, TARGETS)
+
+
+def test_compile(tmp_path):
+    path = write(tmp_path, PROTOCOL)
+    compiled = prtcl.compile(path, ["blue"] + TARGETS)
+    loaded = prtcl.load(path, TARGETS)
+    assert len(compiled) == 6
+    assert [str(i) for i in compiled.instructions()] == [str(i) for i in loaded]
+    assert [str(i) for i in compiled.instructions(start=3)] == [
+        "SET,green,1/2",
+        "MSR,1,0",
+        "WAIT_INPUT,continue?",
+    ]
+    assert compiled.opcodes.tolist() == [0, 1, 2, 0, 1, 3]
+    assert compiled.targets.tolist() == [1, -1, -1, 2, -1, -1]
+    assert compiled.values[0] == 10 and np.isnan(compiled.values[3])
+    assert compiled.wait.tolist() == [0, 0, 100, 0, 0, 0]
+    # Instructions built from the arrays hold the same fields
+    msr = list(compiled.instructions())[1]
+    assert (msr.n, msr.wait) == (5, 0)
+    path = write(tmp_path, PROTOCOL + "MSR,,1\n")
+    with pytest.raises(ValueError, match="Line 9"):
+        prtcl.compile(path, TARGETS)
+
+
+def test_compiled_cache(tmp_path):
+    path = write(tmp_path, PROTOCOL)
+    cache = prtcl.compiled_path(path)
+    first = prtcl.load_compiled(path, TARGETS)
+    assert os.path.exists(cache)
+    # The second time, the protocol is memory-mapped from the cache
+    second = prtcl.load_compiled(path, TARGETS)
+    assert isinstance(second.opcodes, np.memmap)
+    assert [str(i) for i in second.instructions()] == [
+        str(i) for i in first.instructions()
+    ]
+    # It is compiled again if the variables or the protocol change
+    assert prtcl.load_compiled(path, ["green", "red"]).targets[0] == 1
+    assert prtcl.load_compiled(path, ["green", "red"]).targets[0] == 1
+    path = write(tmp_path, PROTOCOL + "MSR,2,0\n")
+    changed = prtcl.load_compiled(path, TARGETS)
+    assert len(changed) == 7 and not isinstance(changed.opcodes, np.memmap)
+    assert len(prtcl.load_compiled(path, TARGETS)) == 7
+    # An unreadable cache is replaced
+    with open(cache, "wb") as f:
+        f.write(b"not a cache")
+    assert len(prtcl.load_compiled(path, TARGETS)) == 7
+    assert isinstance(prtcl.load_compiled(path, TARGETS).opcodes, np.memmap)
+    # Empty protocols
+    path = write(tmp_path, "# Nothing\n")
+    prtcl.load_compiled(path, TARGETS)
+    assert list(prtcl.load_compiled(path, TARGETS).instructions()) == []
+
+
+def test_optimize(tmp_path):
+    path = write(
+        tmp_path,
+        PROTOCOL
+        + "SET,red,10\nMSR,1,0\nMSR,2,0\nMSR,1,5\nWAIT,1\nWAIT,2\nWAIT,3\n"
+        + "MSR,%d,0\nMSR,1,0\n" % prtcl.MAX_MSR,
+    )
+    instructions, report = prtcl.optimize(prtcl.load(path, TARGETS))
+    assert [str(i) for i in instructions][6:] == [
+        # SET,red,10 is dropped even after WAIT_INPUT
+        "MSR,3,0",
+        "MSR,1,5",
+        "WAIT,6",
+        "MSR,%d,0" % prtcl.MAX_MSR,
+        "MSR,1,0",
+    ]
+    assert report["instructions"] == 15 and report["optimized"] == 11
+    assert report["removed"] == {"SET": 1, "WAIT": 2, "MSR": 1}
+    assert report["round_trips"] == (10, 8)
+    # The optimized protocol can be optimized no further
+    again, report = prtcl.optimize(instructions)
+    assert [str(i) for i in again] == [str(i) for i in instructions]
+    assert report["round_trips"] == (8, 8)
+    instructions, report = prtcl.optimize(prtcl.stream(path), strict=True)
+    assert report["removed"] == {"SET": 0, "WAIT": 2, "MSR": 1}
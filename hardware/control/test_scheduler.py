@@ -0,0 +1,112 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import io
+import threading
+import serial
+import control.messages as messages
+from control.board import Board
+from control.scheduler import Scheduler
+from control.sinks import CsvSink
+import control.serial.trace as trace
+from control.serial.ptyserial import PtySerial
+from control.test_board_aio import stand_in_board
+
+"""Tests for the deadline-based scheduler (control.scheduler). Run with
+
+  python -m pytest control/test_scheduler.py
+
+from the hardware/ directory."""
+
+
+class OvershootingClock:
+    """Fake clock, where each reading takes 100 microseconds and each
+    sleep overshoots by 3 milliseconds."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        self.now += 1e-4
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + 0.003
+
+
+class StandInBoard:
+    sink = None
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def execute_instruction(self, instruction):
+        self.clock.now += 0.01  # Instructions take 10 ms
+
+
+def test_deadlines():
+    clock = OvershootingClock()
+    scheduler = Scheduler(StandInBoard(clock), clock.clock, clock.sleep)
+    protocol = ["SET,red,10", "WAIT,500", "MSR,1,0"] * 100
+    scheduler.run([messages.parse(i) for i in protocol])
+    # The overshoot of each sleep is recovered by the next WAITs
+    assert scheduler.waits == 100
+    assert scheduler.overshoot > 0.2
+    assert scheduler.lateness < 0.004
+    assert abs(clock.now - (100 * 0.5 + 200 * 0.01)) < 0.02
+
+
+def test_trace():
+    # The start of each WAIT is recorded in the board's trace
+    clock = OvershootingClock()
+    board = StandInBoard(clock)
+    board.tracer = trace.Tracer()
+    scheduler = Scheduler(board, clock.clock, clock.sleep)
+    scheduler.run([messages.parse(i) for i in ["SET,red,10", "WAIT,500", "WAIT,20"]])
+    events = board.tracer.events()
+    assert events["event"].tolist() == [trace.WAIT_STARTED] * 2
+    assert events["number"].tolist() == [500, 20]
+
+
+def test_deferred_output():
+    port = PtySerial()
+    thread = threading.Thread(target=stand_in_board, args=(port,), daemon=True)
+    thread.start()
+    host = serial.Serial(port.port, 500000)
+    file = io.StringIO()
+    try:
+        board = Board(host, sink=CsvSink(file), log_fun=print)
+        scheduler = Scheduler(board)
+        lines = []
+        scheduler.defer(lambda: lines.append(len(file.getvalue().splitlines())))
+        protocol = ["MSR,5,0", "WAIT,50", "MSR,5,0"]
+        scheduler.run([messages.parse(i) for i in protocol])
+    finally:
+        host.close()
+        port.hangup()
+        thread.join()
+        port.close()
+    # Observations are flushed while waiting, and when the run ends
+    assert lines == [5]
+    assert len(file.getvalue().splitlines()) == 10
+    assert scheduler.lateness < 0.05
@@ -0,0 +1,118 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import threading
+import serial
+import pytest
+import control.messages as messages
+from control.board import Board
+from control.session import SessionCache
+from control.serial.ptyserial import PtySerial
+from control.test_board_aio import VARIABLES, stand_in_board
+
+"""Tests for resuming sessions with a board (control.session). Run with
+
+  python -m pytest control/test_session.py
+
+from the hardware/ directory."""
+
+
+class StandIn:
+    """A stand-in board running on a pseudo-terminal."""
+
+    def __init__(self):
+        self.port = PtySerial()
+        self.thread = threading.Thread(
+            target=stand_in_board, args=(self.port,), daemon=True
+        )
+        self.thread.start()
+        self.hosts = []  # Closed with the stand-in, e.g. if a test fails
+
+    def close(self):
+        for host in self.hosts:
+            host.close()
+        self.port.hangup()
+        self.thread.join()
+        self.port.close()
+
+
+def connect(stand_in, cache, window_size):
+    host = serial.Serial(stand_in.port.port, 500000)
+    stand_in.hosts.append(host)
+    board = Board(
+        host,
+        output_file=None,
+        log_fun=print,
+        window_size=window_size,
+        session_cache=cache,
+    )
+    return host, board
+
+
+@pytest.mark.parametrize("window_size", [1, 4])
+def test_resume(tmp_path, window_size):
+    cache = SessionCache(str(tmp_path / "sessions.json"))
+    stand_in = StandIn()
+    try:
+        host, board = connect(stand_in, cache, window_size)
+        assert not board.warm and "chamber_config" in board.startup
+        board.take_measurements(messages.parse("MSR,5,0"))
+        board.save_session()
+        host.close()
+        # The next connection resumes the session
+        host, board = connect(stand_in, cache, window_size)
+        assert board.warm and "chamber_config" not in board.startup
+        assert board.variables == ["timestamp", "config"] + VARIABLES
+        assert board.comms.window_size == window_size
+        m = board.take_measurements(messages.parse("MSR,3,0"))
+        assert list(m["counter"]) == [5, 6, 7]
+        assert board.comms.unexpected == 0
+        # A reset ends the session
+        board.reset()
+        assert cache.get(stand_in.port.port) is None
+        host.close()
+    finally:
+        stand_in.close()
+
+
+def test_fallback(tmp_path):
+    cache = SessionCache(str(tmp_path / "sessions.json"))
+    stand_in = StandIn()
+    try:
+        # A session which the (freshly booted) board is not in
+        session = {
+            "chamber_config": "standard",
+            "variables": VARIABLES,
+            "last_observation": 99.0,
+            "window_size": 1,
+            "last_delivered": 41,
+        }
+        cache.put(stand_in.port.port, session)
+        host, board = connect(stand_in, cache, 1)
+        assert not board.warm and "resync" in board.startup
+        assert cache.get(stand_in.port.port) is None
+        m = board.take_measurements(messages.parse("MSR,3,0"))
+        assert list(m["counter"]) == [0, 1, 2]
+        host.close()
+    finally:
+        stand_in.close()
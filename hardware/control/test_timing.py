@@ -0,0 +1,128 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import pytest
+import numpy as np
+import control.messages as messages
+import control.protocol as prtcl
+import control.timing as timing
+import control.serial.trace as trace
+
+"""Tests for the timing model of the chambers (control.timing). Run
+with
+
+  python -m pytest control/test_timing.py
+
+from the hardware/ directory."""
+
+SET_RTT = 0.002
+OVERHEAD = 0.005
+BASE = 0.010
+COEF = 0.001
+
+
+def run(instructions):
+    """The trace and output of a run of the given (kind, n, osr)
+    instructions by a chamber following the model above; for WAITs, n
+    is their duration in milliseconds."""
+    events, counters, osr = [], [], []
+    now = 0.0
+
+    def record(event, number=0, n_bytes=0):
+        events.append((round(now * 1e9), event, number, 0, n_bytes))
+
+    for kind, n, setting in instructions:
+        if kind == "SET":
+            record(trace.VARIABLE_SET)
+            now += SET_RTT
+        elif kind == "WAIT":
+            record(trace.WAIT_STARTED, n)
+            now += n / 1000
+        else:
+            record(trace.MEASUREMENTS_STARTED, n)
+            now += OVERHEAD
+            for _ in range(n):
+                now += BASE + COEF * setting
+                record(trace.OBSERVATION_RECEIVED, len(counters), 176)
+                counters.append(len(counters))
+                osr.append(setting)
+            record(trace.MEASUREMENTS_DONE, n)
+    events = np.array(events, dtype=trace.DTYPE)
+    return events, {"counter": np.array(counters, float), "osr_c": np.array(osr, float)}
+
+
+def test_fit():
+    instructions = []
+    for i in range(50):
+        instructions += [("SET", 0, 0), ("MSR", 1 + i % 7, [1, 2, 4, 8][i % 4])]
+    events, observations = run(instructions)
+    model = timing.fit(events, observations)
+    assert model.osr_variables == ["osr_c"]
+    assert model.set_rtt == pytest.approx(SET_RTT)
+    assert model.msr_overhead == pytest.approx(OVERHEAD)
+    assert model.base_period == pytest.approx(BASE)
+    assert model.osr_coefs == pytest.approx([COEF])
+    # Predict a protocol
+    protocol = [
+        messages.parse(line)
+        for line in ["SET,osr_c,4", "MSR,10,0", "WAIT,1000", "SET,osr_c,4", "MSR,5,0"]
+    ]
+    prediction = model.predict(prtcl.analyze(protocol, model.osr_variables))
+    measuring = 2 * OVERHEAD + 15 * (BASE + 4 * COEF)
+    assert prediction["measuring"] == pytest.approx(measuring)
+    assert prediction["setting"] == pytest.approx(2 * SET_RTT)
+    assert prediction["total"] == pytest.approx(1 + 2 * SET_RTT + measuring)
+    assert sum(prediction["shares"].values()) == pytest.approx(1)
+    # Without the output, the period does not depend on the settings
+    model = timing.fit(events)
+    assert model.osr_variables == [] and model.set_rtt == pytest.approx(SET_RTT)
+
+
+def test_fit_waits():
+    # The time spent in WAITs is not counted in the SETs and MSRs
+    instructions = []
+    for i in range(50):
+        instructions += [("SET", 0, 0), ("WAIT", 100, 0)]
+        instructions += [("MSR", 1 + i % 7, 1), ("WAIT", 250, 0)]
+    events, observations = run(instructions)
+    model = timing.fit(events, observations)
+    assert model.set_rtt == pytest.approx(SET_RTT)
+    assert model.msr_overhead == pytest.approx(OVERHEAD)
+    assert model.base_period + model.osr_coefs[0] == pytest.approx(BASE + COEF)
+
+
+def test_fit_errors():
+    events, observations = run([("SET", 0, 0), ("MSR", 3, 1)])
+    observations["counter"][-1] = 5
+    with pytest.raises(ValueError, match="do not match"):
+        timing.fit(events, observations)
+    events, observations = run([("MSR", 3, 1)])
+    with pytest.raises(ValueError, match="no SET"):
+        timing.fit(events, observations)
+
+
+def test_save(tmp_path):
+    model = timing.TimingModel(0.002, 0.003, 0.01, ["osr_c"], [0.001], [1])
+    model.save(str(tmp_path / "model.json"))
+    loaded = timing.load(str(tmp_path / "model.json"))
+    assert loaded.to_dict() == model.to_dict()
@@ -0,0 +1,331 @@
+# MIT License
+
+# Copyright (c) 2023 Juan L. Gamella
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import csv
+import json
+import numpy as np
+import control.serial.trace as trace
+
+"""Timing model of a chamber, to predict how long a protocol takes to
+run before running it (see control.protocol.analyze and
+control/plan_protocol.py).
+
+A run is modelled as the time spent in WAITs, a round trip per SET
+sent to the board, and for every MSR instruction a fixed overhead plus
+a sampling period per measurement. The sampling period grows with the
+oversampling settings of the chamber (the osr_* variables, which hold
+the number of readings averaged by a sensor), and is modelled as
+
+  period = base + sum_k coef_k * osr_k
+
+The parameters are fitted from previous runs: the trace of a run (see
+run_experiment.py --trace_path) gives the time taken by each SET and
+MSR instruction, and its output gives the oversampling
+settings each measurement was taken with (matched by observation
+counter)."""
+
+
+class TimingModel:
+    def __init__(
+        self,
+        set_rtt,
+        msr_overhead,
+        base_period,
+        osr_variables=(),
+        osr_coefs=(),
+        osr_defaults=(),
+    ):
+        """Timing model of a chamber; all times are in seconds.
+
+        Parameters
+        ----------
+        set_rtt : float
+            The time taken by a SET instruction, i.e. its round trip
+            and the host's time to go on to the next instruction.
+        msr_overhead : float
+            The time taken by an MSR instruction on top of its
+            measurements (i.e. its round trip and the host's time to
+            go on to the next instruction).
+        base_period : float
+            The sampling period with no oversampling.
+        osr_variables : list of str, default=()
+            The oversampling settings the period depends on.
+        osr_coefs : list of float, default=()
+            The seconds added to the period by each unit of each
+            oversampling setting.
+        osr_defaults : list of float, default=()
+            The value of each oversampling setting when a protocol does
+            not set it.
+
+        Examples
+        --------
+        >>> model = TimingModel(0.002, 0.003, 0.01, ["osr_c"], [0.001], [1])
+        >>> model.period((None,)), model.period((4,))
+        (0.011, 0.014)
+        >>> analysis = {"wait_ms": 1000, "wait_inputs": 0, "sets": 500,
+        ...     "measurements": {(None,): [100, 100], (4,): [1, 100]}}
+        >>> prediction = model.predict(analysis)
+        >>> round(prediction["total"], 3), round(prediction["measuring"], 3)
+        (4.803, 2.803)
+        >>> round(prediction["shares"]["waiting"], 3)
+        0.208
+        >>> TimingModel.from_dict(model.to_dict()).period((4,))
+        0.014
+
+        """
+        self.set_rtt = float(set_rtt)
+        self.msr_overhead = float(msr_overhead)
+        self.base_period = float(base_period)
+        self.osr_variables = list(osr_variables)
+        self.osr_coefs = [float(c) for c in osr_coefs]
+        self.osr_defaults = [float(d) for d in osr_defaults]
+
+    def period(self, settings):
+        """The sampling period for the given oversampling settings, in
+        the order of osr_variables; settings which are None take their
+        default value."""
+        period = self.base_period
+        for value, coef, default in zip(settings, self.osr_coefs, self.osr_defaults):
+            period += coef * (default if value is None else float(value))
+        return round(period, 12)
+
+    def predict(self, analysis):
+        """Predict the run time of a protocol from its analysis (see
+        control.protocol.analyze, called with this model's
+        osr_variables).
+
+        Returns a dict with the seconds spent "waiting" (in WAITs),
+        "setting" (in SET round trips) and "measuring" (in MSR
+        instructions), their "total", the "shares" of the total spent
+        in each, and the number of WAIT_INPUTs ("wait_inputs"), whose
+        duration is not included.
+
+        """
+        waiting = analysis["wait_ms"] / 1000
+        setting = analysis["sets"] * self.set_rtt
+        measuring = sum(
+            msrs * self.msr_overhead + samples * self.period(settings)
+            for settings, (msrs, samples) in analysis["measurements"].items()
+        )
+        total = waiting + setting + measuring
+        parts = {"waiting": waiting, "setting": setting, "measuring": measuring}
+        return {
+            **parts,
+            "total": total,
+            "shares": {k: v / total if total > 0 else 0.0 for k, v in parts.items()},
+            "wait_inputs": analysis["wait_inputs"],
+        }
+
+    def to_dict(self):
+        return {
+            "set_rtt": self.set_rtt,
+            "msr_overhead": self.msr_overhead,
+            "base_period": self.base_period,
+            "osr_variables": self.osr_variables,
+            "osr_coefs": self.osr_coefs,
+            "osr_defaults": self.osr_defaults,
+        }
+
+    @classmethod
+    def from_dict(cls, params):
+        return cls(**params)
+
+    def save(self, path):
+        """Store the model as JSON (see load)."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def __str__(self):
+        terms = "".join(
+            f" + {c * 1e3:0.4f} ms * {v}"
+            for v, c in zip(self.osr_variables, self.osr_coefs)
+        )
+        return (
+            f"TimingModel(set round trip {self.set_rtt * 1e3:0.3f} ms, "
+            f"MSR overhead {self.msr_overhead * 1e3:0.3f} ms, "
+            f"period {self.base_period * 1e3:0.3f} ms{terms})"
+        )
+
+
+def load(path):
+    """Load a model stored with TimingModel.save."""
+    with open(path, "r") as f:
+        return TimingModel.from_dict(json.load(f))
+
+
+def read_observations(path, osr_variables=None):
+    """Read the observation counter and the oversampling settings
+    (by default, all osr_* columns) from the output of a run written by
+    the csv sink; returns a dict of numpy arrays by column name."""
+    with open(path, "r", newline="") as f:
+        header = next(csv.reader(f))
+    if osr_variables is None:
+        osr_variables = [v for v in header if v.startswith("osr_")]
+    columns = ["counter"] + list(osr_variables)
+    data = np.loadtxt(
+        path,
+        delimiter=",",
+        skiprows=1,
+        usecols=[header.index(c) for c in columns],
+        ndmin=2,
+    )
+    return {c: data[:, i] for i, c in enumerate(columns)}
+
+
+# Events recorded when the Board (or Scheduler) starts an instruction
+_STARTS = [
+    trace.VARIABLE_SET,
+    trace.SET_SKIPPED,
+    trace.MEASUREMENTS_STARTED,
+    trace.WAIT_STARTED,
+]
+
+
+def _instructions(events):
+    """Go through the SET and MSR instructions in a trace. Returns the
+    seconds from each SET being sent to the next instruction, and the
+    MSR instructions which were recorded whole, as a list of (seconds
+    from start to the board's OK,DONE, seconds from then to the next
+    instruction or None, indices of their observations among the
+    OBSERVATION_RECEIVED events of the trace). The intervals end at the
+    start of a WAIT (see trace.WAIT_STARTED), as the time spent in WAITs
+    is modelled separately."""
+    sets, blocks = [], []
+    set_sent, started, done = None, None, None
+    observations = []
+    n_observations = 0
+    for event, time_ns in zip(events["event"].tolist(), events["time_ns"].tolist()):
+        if event in _STARTS:
+            if set_sent is not None:
+                sets.append((time_ns - set_sent) / 1e9)
+            elif done is not None:
+                blocks[-1][1] = (time_ns - done) / 1e9
+            set_sent, done = None, None
+        if event == trace.VARIABLE_SET:
+            set_sent = time_ns
+        elif event == trace.MEASUREMENTS_STARTED:
+            started, observations = time_ns, []
+        elif event == trace.OBSERVATION_RECEIVED:
+            observations.append(n_observations)
+            n_observations += 1
+        elif event == trace.MEASUREMENTS_DONE and started is not None:
+            blocks.append([(time_ns - started) / 1e9, None, observations])
+            started, done = None, time_ns
+    return sets, blocks
+
+
+def fit(events, observations=None, osr_variables=None):
+    """Fit a timing model to the trace of a run.
+
+    Parameters
+    ----------
+    events : numpy.ndarray
+        The trace of the run (see control.serial.trace.load); it must
+        hold SET round trips and whole MSR instructions.
+    observations : dict of numpy.ndarray or NoneType, default=None
+        The output of the run, as returned by read_observations. The
+        observations recorded in the trace are matched to the last
+        rows of the output by their counter. If None, the sampling
+        period does not depend on the oversampling settings.
+    osr_variables : list of str or NoneType, default=None
+        The oversampling settings to fit; by default, all the osr_*
+        columns in observations.
+
+    Returns
+    -------
+    model : TimingModel
+
+    Note that if all the MSR instructions in the trace take the same
+    number of measurements (e.g. MSR,1,0), their overhead cannot be
+    told apart from the sampling period, and the model only predicts
+    MSR instructions of that size well.
+
+    Raises
+    ------
+    ValueError :
+        If the trace holds no SETs or MSR instructions, or does not
+        match the observations.
+
+    """
+    sets, blocks = _instructions(events)
+    if len(sets) == 0 or len(blocks) == 0:
+        raise ValueError("The trace holds no SET round trips or MSR instructions")
+    counters = events["number"][events["event"] == trace.OBSERVATION_RECEIVED]
+    if observations is not None and osr_variables is None:
+        osr_variables = [c for c in observations if c.startswith("osr_")]
+    if observations is None or len(osr_variables) == 0:
+        osr_variables, settings = [], np.zeros((len(counters), 0))
+    else:
+        if (
+            len(counters) > len(observations["counter"])
+            or (
+                observations["counter"][len(observations["counter"]) - len(counters) :]
+                != counters
+            ).any()
+        ):
+            raise ValueError("The observations do not match the trace")
+        settings = np.column_stack(
+            [
+                observations[v][len(observations[v]) - len(counters) :]
+                for v in osr_variables
+            ]
+        ).reshape(len(counters), len(osr_variables))
+    # Regress the duration of each MSR on its number of measurements
+    # and the sum of their oversampling settings; the time taken to go
+    # on to the next instruction is added to the overhead (the median,
+    # as it also holds any WAIT_INPUTs)
+    X = np.array(
+        [
+            [1, len(block)] + settings[block].sum(axis=0).tolist()
+            for *_, block in blocks
+        ],
+        dtype=float,
+    )
+    y = np.array([duration for duration, *_ in blocks])
+    coefs = np.linalg.lstsq(X, y, rcond=None)[0]
+    gaps = [gap for _, gap, _ in blocks if gap is not None]
+    defaults = (
+        np.median(settings, axis=0).tolist()
+        if len(settings)
+        else [0] * len(osr_variables)
+    )
+    return TimingModel(
+        set_rtt=np.median(sets),
+        msr_overhead=coefs[0] + (np.median(gaps) if gaps else 0.0),
+        base_period=coefs[1],
+        osr_variables=osr_variables,
+        osr_coefs=coefs[2:],
+        osr_defaults=defaults,
+    )
+
+
+# ----------------------------------------------------------------------
+# Doctests
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod(
+        extraglobs={},
+        verbose=True,
+        optionflags=doctest.ELLIPSIS,
+    )